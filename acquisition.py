@@ -0,0 +1,458 @@
+# vtc/acquisition.py
+import threading
+import time
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from config import Calibration
+from channels import ControlCombiner, channel_gains
+
+
+@dataclass
+class SampleBlock:
+    """
+    A run of consecutive samples. `start` is the absolute sample index of
+    the first sample, `t` the perf_counter() time of each sample and `v`
+    the values: one per sample, or one row per sample in a multi-channel
+    ring. Blocks read from a SampleRing hold a read-only view of the
+    ring's storage in `v`, not a copy.
+    """
+    start: int
+    t: np.ndarray
+    v: np.ndarray
+
+
+class SampleRing:
+    """
+    Bounded ring buffer of evenly spaced samples: the sample bus between
+    one producer and any number of consumers.
+
+    One writer pushes blocks; each reader keeps its own cursor (an
+    absolute sample index, see subscribe()) and asks for everything
+    written since. A reader that falls more than `capacity` samples
+    behind loses the oldest samples and is told how many. With
+    channels > 1 each sample is a row of `channels` values and blocks are
+    (n, channels) arrays.
+
+    The storage is mirrored (every sample is written at i and at
+    i + capacity), so any run of up to `capacity` samples is contiguous
+    and read() hands out views instead of copying. The writer claims the
+    slots it is about to fill by advancing `head` before it writes and
+    publishes them by advancing `total` after, so a reader can tell
+    whether a view it still holds has since been overwritten.
+    """
+
+    def __init__(self, capacity, sample_hz, t_origin=0.0, channels=1):
+        self.capacity = max(1, int(capacity))
+        self.sample_hz = float(sample_hz)
+        self.t_origin = float(t_origin)
+        self.total = 0
+        self.head = 0
+        self.channels = max(1, int(channels))
+
+        self._data = np.zeros(self._shape(2 * self.capacity))
+        self._lock = threading.Lock()
+
+    def _shape(self, n):
+        return (n,) if self.channels == 1 else (n, self.channels)
+
+    def reset(self, sample_hz, t_origin):
+        with self._lock:
+            self.sample_hz = float(sample_hz)
+            self.t_origin = float(t_origin)
+            self.head = 0
+            self.total = 0
+
+    def subscribe(self, cursor=None):
+        """
+        A Subscription reading from absolute index `cursor` (default: from
+        whatever is pushed next).
+        """
+        return Subscription(self, cursor)
+
+    def push(self, block):
+        block = np.asarray(block, dtype=float).reshape((-1,) + self._data.shape[1:])
+        if len(block) > self.capacity:
+            block = block[-self.capacity:]
+        with self._lock:
+            n = len(block)
+            start = self.total % self.capacity
+            first = min(n, self.capacity - start)
+            self.head = self.total + n
+            for base in (0, self.capacity):
+                self._data[base + start:base + start + first] = block[:first]
+                self._data[base:base + n - first] = block[first:]
+            self.total = self.head
+
+    def skip(self, n):
+        """
+        Advance past `n` samples that were lost upstream, marking them NaN so
+        sample indices stay aligned with time.
+        """
+        n = int(n)
+        if n <= 0:
+            return
+        self.push(np.full(self._shape(min(n, self.capacity)), np.nan))
+        with self._lock:
+            self.head += n - min(n, self.capacity)
+            self.total = self.head
+
+    def rewrite(self, start, block):
+        """
+        Overwrite already pushed samples from absolute index `start` (drive
+        that was queued and then replaced before it was played). Samples
+        the ring no longer holds, or has not been given yet, are ignored.
+        """
+        block = np.asarray(block, dtype=float).reshape((-1,) + self._data.shape[1:])
+        with self._lock:
+            idx = np.arange(int(start), int(start) + len(block))
+            ok = (idx >= max(0, self.total - self.capacity)) & (idx < self.total)
+            slot = idx[ok] % self.capacity
+            self._data[slot] = block[ok]
+            self._data[slot + self.capacity] = block[ok]
+
+    def _slice(self, start, stop):
+        t = self.t_origin + np.arange(start, stop) / self.sample_hz
+        first = start % self.capacity
+        v = self._data[first:first + stop - start]
+        v.flags.writeable = False
+        return SampleBlock(start, t, v)
+
+    def read(self, cursor, stop=None):
+        """
+        Return (block, dropped) with every sample from absolute index
+        `cursor` onwards (up to `stop`, if given). The next cursor is
+        block.start + len(block.v). block.v is a view that stays valid
+        until the writer wraps onto it (see Subscription.intact).
+        """
+        with self._lock:
+            total = self.total if stop is None else min(int(stop), self.total)
+            oldest = max(0, self.head - self.capacity)
+            start = min(max(int(cursor), oldest), total)
+            dropped = start - int(cursor) if cursor < oldest else 0
+            return self._slice(start, total), dropped
+
+    def sample_at(self, t):
+        """
+        Values at perf_counter() times `t` (nearest sample). Times outside
+        what the ring still holds come back as NaN.
+        """
+        t = np.asarray(t, dtype=float)
+        with self._lock:
+            idx = np.rint((t - self.t_origin) * self.sample_hz).astype(np.int64)
+            oldest = max(0, self.head - self.capacity)
+            ok = (idx >= oldest) & (idx < self.total)
+            out = np.full(t.shape + self._data.shape[1:], np.nan)
+            out[ok] = self._data[idx[ok] % self.capacity]
+            return out
+
+    def latest(self, n):
+        with self._lock:
+            total = self.total
+            n = max(0, min(int(n), total, self.capacity - (self.head - total)))
+            return self._slice(total - n, total)
+
+
+class Subscription:
+    """
+    One consumer's cursor on a SampleRing.
+
+    poll() returns everything published since the last call as a
+    SampleBlock whose values are a read-only view into the ring (into
+    shared memory for a SharedSampleRing); nothing is copied and the
+    writer never waits for a reader. A reader that falls more than
+    `capacity` samples behind skips to the oldest sample still held:
+    each such overrun is counted in `overruns` and the samples lost in
+    `dropped`. A view stays valid until the writer wraps onto it;
+    intact(block) tells whether it still is, so a slow consumer can check
+    after using it (and copy what it must keep).
+    """
+
+    def __init__(self, ring, cursor=None):
+        self.ring = ring
+        self.cursor = ring.total if cursor is None else int(cursor)
+        self.overruns = 0
+        self.dropped = 0
+
+    def seek(self, cursor=None):
+        """
+        Move to absolute index `cursor` (default: the newest sample, i.e.
+        skip everything published so far).
+        """
+        self.cursor = self.ring.total if cursor is None else int(cursor)
+
+    @property
+    def pending(self):
+        return max(0, self.ring.total - self.cursor)
+
+    def poll(self, stop=None):
+        """
+        Return (block, dropped): the samples from the cursor on (up to
+        absolute index `stop`, if given), and advance past them. A ring
+        that was reset behind the cursor (a new run) is read from 0.
+        """
+        if self.ring.total < self.cursor:
+            self.cursor = 0
+        block, dropped = self.ring.read(self.cursor, stop)
+        self.cursor = block.start + len(block.v)
+        if dropped:
+            self.overruns += 1
+            self.dropped += dropped
+        return block, dropped
+
+    def intact(self, block):
+        """
+        Whether `block` (from this ring) has not been overwritten since it
+        was read.
+        """
+        return self.ring.head - self.ring.capacity <= block.start
+
+
+class SharedSampleRing(SampleRing):
+    """
+    SampleRing in multiprocessing.shared_memory, for passing samples from
+    the engine process to the GUI process.
+
+    The header (total, capacity, channels, head, sample rate, time origin)
+    lives in the block with the data, so another process can attach by
+    `name` alone, and blocks read in either process are views of the
+    shared block itself.
+    There is one writer; it claims slots (head) before it stores the
+    samples and advances total after, so readers never see unwritten data
+    and need no lock. Timestamps stay perf_counter() values, which share
+    one monotonic clock across processes on Linux.
+    """
+
+    HEADER_BYTES = 48
+
+    def __init__(self, capacity=1, sample_hz=1.0, t_origin=0.0, name=None, channels=1):
+        create = name is None
+        if create:
+            capacity = max(1, int(capacity))
+            channels = max(1, int(channels))
+            self.shm = shared_memory.SharedMemory(
+                create=True, size=self.HEADER_BYTES + 8 * 2 * capacity * channels)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self._hdr_i = np.ndarray(4, np.int64, self.shm.buf, 0)
+        self._hdr_f = np.ndarray(2, np.float64, self.shm.buf, 32)
+        if create:
+            self._hdr_i[:] = (0, capacity, channels, 0)
+            self._hdr_f[:] = (sample_hz, t_origin)
+        self.capacity = int(self._hdr_i[1])
+        self.channels = int(self._hdr_i[2])
+        self._data = np.ndarray(self._shape(2 * self.capacity), np.float64, self.shm.buf,
+                                self.HEADER_BYTES)
+        self._lock = threading.Lock()
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def total(self):
+        return int(self._hdr_i[0])
+
+    @total.setter
+    def total(self, value):
+        self._hdr_i[0] = value
+
+    @property
+    def head(self):
+        return int(self._hdr_i[3])
+
+    @head.setter
+    def head(self, value):
+        self._hdr_i[3] = value
+
+    @property
+    def sample_hz(self):
+        return float(self._hdr_f[0])
+
+    @sample_hz.setter
+    def sample_hz(self, value):
+        self._hdr_f[0] = value
+
+    @property
+    def t_origin(self):
+        return float(self._hdr_f[1])
+
+    @t_origin.setter
+    def t_origin(self, value):
+        self._hdr_f[1] = value
+
+    def close(self, unlink=False):
+        """
+        Detach; the creating process passes unlink=True to free the block.
+        """
+        self._hdr_i = self._hdr_f = self._data = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+class AcquisitionWorker:
+    """
+    Continuous hardware-clocked AI acquisition.
+
+    The DAQ fills its own circular scan buffer at `sample_hz`, one scan of
+    all `dac.ai_channels` per sample, interleaved; this thread polls the
+    scan position and takes the new scans as (n, channels) reshaped views
+    of that buffer (no copy, no per-channel loop). One broadcast multiply
+    applies each channel's ADC_SCALE * G_PER_V; the rows go into
+    `channel_ring` and the control signal formed from them (`strategy`,
+    see channels.ControlCombiner) into `ring`, both in g. If more samples
+    arrive between two polls than the scan buffer holds, the oldest ones
+    were overwritten on the device: that is counted in `overruns` /
+    `lost_samples`. The rings may be passed in (e.g. SharedSampleRings).
+
+    A DAQ without AI scans is polled instead: one dac.read() (the first
+    channel) every 1 / `poll_hz`, published on the same rings, with
+    missed ticks pushed as NaN and counted like overruns. Consumers read
+    the rings either way.
+    """
+
+    def __init__(self, dac, sample_hz=5000, buffer_samples=10000, ring_seconds=10.0,
+                 ring=None, channel_ring=None, strategy="average", weights=(), rms_s=0.5,
+                 poll_hz=200.0):
+        self.dac = dac
+        self.scanning = bool(getattr(dac, "supports_ai_scan", False))
+        self.sample_hz = max(1, int(sample_hz))
+        if not self.scanning:
+            self.sample_hz = max(1, min(self.sample_hz, int(poll_hz)))
+        self.buffer_samples = max(2, int(buffer_samples))
+        self.actual_hz = float(self.sample_hz)
+        self.channels = len(getattr(dac, "ai_channels", (0,))) if self.scanning else 1
+
+        if ring is None:
+            ring = SampleRing(self.sample_hz * ring_seconds, self.sample_hz)
+        if channel_ring is None:
+            channel_ring = SampleRing(self.sample_hz * ring_seconds, self.sample_hz,
+                                      channels=self.channels)
+        self.ring = ring
+        self.channel_ring = channel_ring
+        self.combine = ControlCombiner(strategy, self.channels, self.sample_hz, weights, rms_s)
+        self.set_calibration(Calibration())
+
+        self.overruns = 0
+        self.lost_samples = 0
+        self.error = None
+
+        self.running = False
+        self.thread = None
+
+    def set_calibration(self, cal):
+        gains = channel_gains(cal, self.channels)
+        self.cal = cal
+        self.gains = gains
+
+    @property
+    def control_channel(self):
+        """
+        Channel currently controlled on under "max_rms", else None.
+        """
+        return self.combine.selected if self.combine.strategy == "max_rms" else None
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.overruns = 0
+        self.lost_samples = 0
+        self.error = None
+        target = self._run if self.scanning else self._run_polled
+        self.thread = threading.Thread(target=target, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout=1.0)
+            self.thread = None
+
+    def _push(self, scans):
+        g = scans * self.gains
+        self.channel_ring.push(g)
+        self.ring.push(self.combine(g))
+
+    def _run(self):
+        n = self.buffer_samples
+        nch = self.channels
+        try:
+            view = self.dac.create_ai_buffer(n)
+            t_origin = time.perf_counter()
+            self.actual_hz = self.dac.start_ai_scan(self.sample_hz)
+            self.ring.reset(self.actual_hz, t_origin)
+            self.channel_ring.reset(self.actual_hz, t_origin)
+            self.combine.sample_hz = self.actual_hz
+        except Exception as e:
+            self.error = e
+            self.running = False
+
+        # Poll often enough that the scan buffer is never more than a
+        # quarter full between reads.
+        poll_s = min(0.02, n / self.actual_hz / 4.0)
+        read_pos = 0
+
+        while self.running:
+            try:
+                pos = self.dac.ai_scan_position()
+            except Exception as e:
+                self.error = e
+                self.running = False
+                break
+
+            if pos - read_pos > n:
+                lost = pos - read_pos - n
+                self.overruns += 1
+                self.lost_samples += lost
+                self.ring.skip(lost)
+                self.channel_ring.skip(lost)
+                read_pos = pos - n
+
+            if pos > read_pos:
+                # At most two contiguous runs of scans (before / after the wrap)
+                start = read_pos % n
+                first = min(pos - read_pos, n - start)
+                for a, b in ((start, start + first), (0, pos - read_pos - first)):
+                    if b > a:
+                        self._push(view[a * nch:b * nch].reshape(-1, nch))
+                read_pos = pos
+
+            time.sleep(poll_s)
+
+        try:
+            self.dac.stop_ai_scan()
+        except Exception:
+            pass
+
+    def _run_polled(self):
+        # Fallback for DAQs without AI scans: sample k belongs to tick
+        # t_origin + k / actual_hz; ticks the loop missed are lost samples.
+        t_origin = time.perf_counter()
+        self.ring.reset(self.actual_hz, t_origin)
+        self.channel_ring.reset(self.actual_hz, t_origin)
+        self.combine.sample_hz = self.actual_hz
+        k = 0
+
+        while self.running:
+            try:
+                v = float(self.dac.read())
+            except Exception as e:
+                self.error = e
+                self.running = False
+                break
+
+            tick = int((time.perf_counter() - t_origin) * self.actual_hz)
+            if tick > k:
+                self.overruns += 1
+                self.lost_samples += tick - k
+                self.ring.skip(tick - k)
+                self.channel_ring.skip(tick - k)
+                k = tick
+            self._push(np.array([[v]]))
+            k += 1
+
+            time.sleep(max(0.0, t_origin + k / self.actual_hz - time.perf_counter()))
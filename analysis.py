@@ -0,0 +1,296 @@
+# vtc/analysis.py
+import csv
+import glob
+import itertools
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from config import Analysis, Runtime
+from logging_utils import BinaryLogReader
+from spectrum import CrossSpectrum
+
+SIDECARS = ("_resonance.csv", "_srs.csv")
+STATS = ("mean", "rms", "peak", "crest", "min", "max")
+
+
+class RunningStats:
+    """
+    Mean, AC RMS, peak and crest factor of a signal seen block by block.
+    Only sums, min and max are kept; NaN samples are ignored.
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.sum = 0.0
+        self.sumsq = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def push(self, x):
+        x = np.asarray(x, dtype=float)
+        x = x[~np.isnan(x)]
+        if not len(x):
+            return
+        self.n += len(x)
+        self.sum += float(x.sum())
+        self.sumsq += float(np.dot(x, x))
+        self.min = min(self.min, float(x.min()))
+        self.max = max(self.max, float(x.max()))
+
+    def result(self):
+        if not self.n:
+            return dict.fromkeys(STATS)
+        mean = self.sum / self.n
+        rms = float(np.sqrt(max(self.sumsq / self.n - mean * mean, 0.0)))
+        peak = max(self.max - mean, mean - self.min)
+        return {"mean": mean, "rms": rms, "peak": peak,
+                "crest": peak / rms if rms > 0.0 else None,
+                "min": self.min, "max": self.max}
+
+
+def find_logs(log_dir):
+    """
+    Run logs under `log_dir`: binary logs, and CSV logs that are neither
+    sidecars (resonance / SRS) nor the CSV export of a binary log.
+    """
+    logs = sorted(glob.glob(os.path.join(log_dir, "vtc_run_*.vtclog")))
+    stems = {os.path.splitext(p)[0] for p in logs}
+    for p in sorted(glob.glob(os.path.join(log_dir, "vtc_run_*.csv"))):
+        if not p.endswith(SIDECARS) and os.path.splitext(p)[0] not in stems:
+            logs.append(p)
+    return logs
+
+
+def iter_log(path, rows=65536):
+    """
+    Return (header, blocks): the log's metadata and an iterator of
+    {column: array} blocks of at most `rows` rows. Binary logs are read
+    through their memmap; CSV logs `rows` lines at a time.
+    """
+    if path.endswith(".vtclog"):
+        reader = BinaryLogReader(path)
+        return reader.header, reader.iter_blocks(rows)
+
+    f = open(path, "r", newline="")
+    names = next(csv.reader([f.readline()]))
+
+    def blocks():
+        with f:
+            while True:
+                lines = list(itertools.islice(f, rows))
+                if not lines:
+                    return
+                data = np.loadtxt(lines, delimiter=",", ndmin=2)
+                yield {n: data[:, i] for i, n in enumerate(names)}
+
+    return {"columns": [{"name": n} for n in names]}, blocks()
+
+
+def analyze_run(path, cfg=None):
+    """
+    Summary metrics of every signal column and the response PSD (plus H1
+    and coherence against the drive) of one run log, in a single pass.
+    """
+    cfg = cfg or Analysis()
+    header, blocks = iter_log(path, cfg.CHUNK_ROWS)
+    names = [c["name"] for c in header["columns"]]
+    response = "meas_g" if "meas_g" in names else "meas_v"
+    stats = {n: RunningStats() for n in names if n != "t_s"}
+
+    spec = None
+    rows = 0
+    t_first = t_last = None
+    sample_hz = header.get("sample_hz")
+    for blk in blocks:
+        t = blk["t_s"]
+        if not len(t):
+            continue
+        if t_first is None:
+            t_first = float(t[0])
+            if not sample_hz and len(t) > 1:
+                sample_hz = 1.0 / float(np.median(np.diff(t)))
+        t_last = float(t[-1])
+        rows += len(t)
+        for n, s in stats.items():
+            s.push(blk[n])
+        if sample_hz and "cmd_v" in blk and response in blk:
+            if spec is None:
+                spec = CrossSpectrum(cfg.FRAME, sample_hz, averages=2 ** 62)
+            spec.push(blk["cmd_v"], blk[response])
+
+    summary = {
+        "file": os.path.basename(path),
+        "mode": header.get("mode"),
+        "created": header.get("created"),
+        "rows": rows,
+        "duration_s": (t_last - t_first) if rows else 0.0,
+        "sample_hz": sample_hz,
+        "response": response,
+        "metrics": {n: s.result() for n, s in stats.items()},
+        "frames": 0,
+    }
+    spectrum = None
+    if spec is not None and spec.count:
+        res = spec.result()
+        band = res.freqs <= cfg.FMAX_HZ
+        summary["frames"] = res.frames
+        spectrum = {"freqs": res.freqs[band], "psd": res.psd[band],
+                    "h1_mag": res.h1_mag[band], "coherence": res.coherence[band]}
+    return summary, spectrum
+
+
+class ResultCache:
+    """
+    Per-run results under `cache_dir`: index.json maps a log's file name to
+    its size, mtime and summary; spectra are in <stem>.npz. An entry is
+    only used while the log's size and mtime are unchanged.
+    """
+
+    def __init__(self, cache_dir):
+        self.dir = cache_dir
+        self.index_path = os.path.join(cache_dir, "index.json")
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                self.index = json.load(f)
+        except (OSError, ValueError):
+            self.index = {}
+
+    @staticmethod
+    def key(path):
+        st = os.stat(path)
+        return [st.st_size, st.st_mtime_ns]
+
+    def get(self, path):
+        entry = self.index.get(os.path.basename(path))
+        if entry is None or entry["key"] != self.key(path):
+            return None
+        return entry["summary"]
+
+    def spectrum(self, name):
+        p = os.path.join(self.dir, os.path.splitext(name)[0] + ".npz")
+        if not os.path.exists(p):
+            return None
+        with np.load(p) as z:
+            return {k: z[k] for k in z.files}
+
+    def put(self, path, summary, spectrum):
+        os.makedirs(self.dir, exist_ok=True)
+        name = os.path.basename(path)
+        if spectrum is not None:
+            np.savez(os.path.join(self.dir, os.path.splitext(name)[0] + ".npz"), **spectrum)
+        self.index[name] = {"key": self.key(path), "summary": summary}
+
+    def save(self):
+        os.makedirs(self.dir, exist_ok=True)
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.index, f)
+        os.replace(tmp, self.index_path)
+
+
+def analyze_dir(log_dir, out_dir=None, workers=None, force=False, cfg=None, plots=True):
+    """
+    Analyse every run log in `log_dir` (new or changed ones only, unless
+    `force`) on a process pool and write the consolidated report to
+    `out_dir`. Returns (summaries, number of runs analysed now).
+    """
+    cfg = cfg or Analysis()
+    out_dir = out_dir or os.path.join(log_dir, "analysis")
+    cache = ResultCache(os.path.join(log_dir, cfg.CACHE_DIR))
+
+    logs = find_logs(log_dir)
+    todo = [p for p in logs if force or cache.get(p) is None]
+    if todo:
+        workers = workers or int(cfg.WORKERS) or os.cpu_count() or 1
+        with ProcessPoolExecutor(min(workers, len(todo)),
+                                 mp_context=multiprocessing.get_context("spawn")) as pool:
+            for path, result in zip(todo, pool.map(analyze_run, todo, itertools.repeat(cfg))):
+                cache.put(path, *result)
+        cache.save()
+
+    summaries = [cache.get(p) for p in logs]
+    write_report(out_dir, summaries, cache, plots)
+    return summaries, len(todo)
+
+
+def _flatten(summary):
+    row = {k: summary[k] for k in ("file", "mode", "created", "rows", "duration_s", "sample_hz")}
+    for col, metrics in summary["metrics"].items():
+        for k in STATS:
+            row[f"{col}_{k}"] = metrics[k]
+    return row
+
+
+def write_report(out_dir, summaries, cache, plots=True):
+    """
+    summary.csv (one row per run), summary.json and, with `plots`, PNGs of
+    the response PSDs and of the response RMS across runs.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    rows = [_flatten(s) for s in summaries]
+    fields = list(dict.fromkeys(k for r in rows for k in r))
+    with open(os.path.join(out_dir, "summary.csv"), "w", newline="") as f:
+        w = csv.DictWriter(f, fieldnames=fields)
+        w.writeheader()
+        w.writerows(rows)
+    with open(os.path.join(out_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summaries, f, indent=2)
+    if plots and summaries:
+        _plot_report(out_dir, summaries, cache)
+
+
+def _plot_report(out_dir, summaries, cache):
+    """
+    Render the report plots with pyqtgraph on an offscreen Qt platform.
+    """
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    import pyqtgraph as pg
+    pg.mkQApp()
+
+    psd = pg.PlotWidget(title="Response PSD")
+    psd.setLogMode(y=True)
+    psd.setLabel("bottom", "Frequency", units="Hz")
+    psd.showGrid(x=True, y=True, alpha=0.3)
+    legend = psd.addLegend(offset=(10, 10))
+    for i, s in enumerate(summaries):
+        spec = cache.spectrum(s["file"])
+        if spec is None:
+            continue
+        curve = psd.plot(spec["freqs"][1:], np.maximum(spec["psd"][1:], 1e-12),
+                         pen=pg.intColor(i, hues=max(len(summaries), 1)))
+        if i < 12:
+            legend.addItem(curve, s["file"])
+
+    trend = pg.PlotWidget(title="Response RMS per run")
+    trend.setLabel("bottom", "Run")
+    trend.showGrid(x=True, y=True, alpha=0.3)
+    rms = [s["metrics"].get(s["response"], {}).get("rms") for s in summaries]
+    rms = np.array([np.nan if r is None else r for r in rms])
+    trend.plot(np.arange(len(rms)), rms, symbol="o", pen=pg.mkPen(width=2))
+
+    for widget, name in ((psd, "psd.png"), (trend, "rms_trend.png")):
+        widget.resize(1200, 700)
+        widget.grab().save(os.path.join(out_dir, name))
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    ap = argparse.ArgumentParser(description="Summarise run logs: metrics, spectra, report.")
+    ap.add_argument("log_dir", nargs="?", default=Runtime().LOG_PATH)
+    ap.add_argument("-o", "--out", help="report directory (default <log_dir>/analysis)")
+    ap.add_argument("-j", "--workers", type=int, help="process pool size")
+    ap.add_argument("--force", action="store_true", help="ignore cached results")
+    ap.add_argument("--no-plots", action="store_true")
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    summaries, fresh = analyze_dir(args.log_dir, args.out, args.workers, args.force,
+                                   plots=not args.no_plots)
+    print(f"{len(summaries)} runs ({fresh} analysed, {len(summaries) - fresh} cached) "
+          f"in {time.perf_counter() - t0:.2f} s")
@@ -0,0 +1,295 @@
+# vtc/calibration.py
+import json
+import os
+import time
+from dataclasses import asdict, fields
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from config import Calibration, LoopbackCal, Runtime
+from channels import per_channel
+
+
+class CalibrationError(ValueError):
+    pass
+
+
+def load_calibration(path, cal=None):
+    """
+    `cal` (default Calibration()) with the values in a calibration file
+    written by save_calibration() loaded over it. A missing file leaves
+    the defaults.
+    """
+    cal = cal or Calibration()
+    if not path or not os.path.exists(path):
+        return cal
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            values = json.load(f)["calibration"]
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        raise CalibrationError(f"{path}: {e}")
+    for field in fields(Calibration):
+        if field.name in values:
+            v = values[field.name]
+            setattr(cal, field.name, tuple(v) if isinstance(v, list) else float(v))
+    return cal
+
+
+def save_calibration(cal, path, report=None):
+    """
+    Write `cal` (and the loopback report it came from) to `path`
+    atomically.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"calibration": asdict(cal), "report": report or {}}, f, indent=2)
+    os.replace(tmp, path)
+
+
+def stimulus(cfg, sample_hz):
+    """
+    The loopback drive in raw DAC volts: a DC staircase (DC_LEVELS_V,
+    STEP_S each), a multitone (TONES_HZ at TONE_V about TONE_BIAS_V,
+    Schroeder phases for a low crest factor) and a short tail at the
+    bias. Returns (samples, steps) with steps in the compiled-profile
+    index format.
+    """
+    fs = float(sample_hz)
+    parts, steps = [], []
+    start = 0
+
+    def add(label, v):
+        nonlocal start
+        parts.append(v)
+        steps.append({"label": label, "mode": "Loopback", "start": start, "samples": len(v)})
+        start += len(v)
+
+    n_step = int(round(cfg.STEP_S * fs))
+    for level in cfg.DC_LEVELS_V:
+        add(f"DC {level:g} V", np.full(n_step, float(level)))
+
+    t = np.arange(int(round(cfg.MULTITONE_S * fs))) / fs
+    k = np.arange(len(cfg.TONES_HZ))
+    phases = -np.pi * k * (k + 1) / max(len(k), 1)
+    tones = np.sin(2 * np.pi * np.outer(t, cfg.TONES_HZ) + phases).sum(axis=1)
+    add("Multitone", cfg.TONE_BIAS_V + cfg.TONE_V * tones)
+    add("Tail", np.full(int(round((cfg.MAX_DELAY_S + 0.1) * fs)), float(cfg.TONE_BIAS_V)))
+    return np.concatenate(parts), steps
+
+
+def _delay(y, xs, lags):
+    """
+    The lag (samples, refined by parabolic interpolation) whose row of
+    `xs` best matches `y`, and the normalized correlation there.
+    """
+    c = xs @ y
+    norm = np.sqrt(np.dot(y, y) * np.einsum("ij,ij->i", xs, xs))
+    rho = c / np.maximum(norm, 1e-30)
+    i = int(np.argmax(rho))
+    frac = 0.0
+    if 0 < i < len(rho) - 1:
+        a, b, d = rho[i - 1], rho[i], rho[i + 1]
+        den = a - 2 * b + d
+        frac = 0.5 * (a - d) / den if den != 0 else 0.0
+    return lags[i] + frac, float(rho[i])
+
+
+def fit(t, raw, samples, steps, t_origin, sample_hz, cfg=None, cal=None):
+    """
+    Fit the calibration from a loopback recording.
+
+    `t` / `raw` are the AI sample times (perf_counter()) and raw ADC volts
+    (n, channels); `samples` the DAC volts played from `t_origin` at
+    `sample_hz`. The AO -> AI delay is the peak of the cross-correlation
+    of the multitone with the reference channel. On the DC levels, less
+    SETTLE_S at either end, raw = k * dac + m is fitted for every channel
+    at once by least squares; the reference channel (its ADC_SCALE from
+    `cal` trusted) gives the DAC's true gain and offset, and each other
+    channel's ADC_SCALE is the least-squares ratio of true loopback volts
+    to its raw volts. Returns (Calibration, report).
+    """
+    cfg = cfg or LoopbackCal()
+    cal = cal or Calibration()
+    raw = np.asarray(raw, dtype=float).reshape(len(t), -1)
+    nch = raw.shape[1]
+    ref = int(cfg.REFERENCE_CHANNEL)
+    if not 0 <= ref < nch:
+        raise CalibrationError(f"REFERENCE_CHANNEL {ref} is not one of the {nch} AI channels")
+    fs = float(sample_hz)
+    scales = per_channel(cal.ADC_SCALE, nch, "ADC_SCALE")
+    by_label = {s["label"]: s for s in steps}
+
+    # AO sample index at each AI instant; r is its (constant) rounding
+    u = (np.asarray(t, dtype=float) - t_origin) * fs
+    ui = np.rint(u).astype(np.int64)
+    r = float(np.median(ui - u))
+
+    # Delay: multitone interior, AI samples vs the drive `lag` samples earlier
+    mt = by_label["Multitone"]
+    max_lag = int(np.ceil(cfg.MAX_DELAY_S * fs))
+    lo = mt["start"] + max_lag + int(cfg.SETTLE_S * fs)
+    sel = np.flatnonzero((ui >= lo) & (ui < mt["start"] + mt["samples"]))
+    if len(sel) < fs * 0.2:
+        raise CalibrationError("The loopback recording does not cover the multitone")
+    y = raw[sel, ref] - raw[sel, ref].mean()
+    lags = np.arange(-2, max_lag + 1)
+    win = sliding_window_view(samples, len(sel))
+    first = ui[sel[0]]
+    xs = win[first - lags] - samples[mt["start"]:mt["start"] + mt["samples"]].mean()
+    lag, rho = _delay(y, xs, lags)
+    if rho < 0.5:
+        raise CalibrationError(
+            f"Multitone not seen on AI channel {ref} (correlation {rho:.2f}): check the AO -> AI loopback")
+    delay_s = (lag - r) / fs
+
+    # DC levels, aligned by the measured delay, less SETTLE_S at both ends
+    k = np.rint(u - delay_s * fs).astype(np.int64)
+    settle = int(cfg.SETTLE_S * fs)
+    mask = np.zeros(len(k), dtype=bool)
+    for s in steps:
+        if s["label"].startswith("DC "):
+            mask |= (k >= s["start"] + settle) & (k < s["start"] + s["samples"] - settle)
+    if mask.sum() < 10 * len(cfg.DC_LEVELS_V):
+        raise CalibrationError("The loopback recording does not cover the DC levels")
+    dac = samples[k[mask]]
+    X = np.column_stack([dac, np.ones(len(dac))])
+    (gain_raw, offset_raw), *_ = np.linalg.lstsq(X, raw[mask], rcond=None)
+
+    g = scales[ref] * gain_raw[ref]
+    o = scales[ref] * offset_raw[ref]
+    if abs(g - 1.0) > cfg.MAX_DAC_ERROR or abs(o) > cfg.MAX_DAC_ERROR:
+        raise CalibrationError(
+            f"DAC gain {g:.3f}, offset {o * 1e3:.0f} mV is implausible: check the AO -> AI loopback")
+
+    true_v = o + g * dac
+    rm = raw[mask]
+    adc = (rm * true_v[:, None]).sum(axis=0) / np.maximum((rm * rm).sum(axis=0), 1e-30)
+    adc[ref] = scales[ref]
+    resid = rm * adc - true_v[:, None]
+
+    # Gain / phase check per tone: fitted chain vs what arrived, delay removed
+    f = np.asarray(cfg.TONES_HZ, dtype=float)[:, None]
+    X_f = np.exp(-2j * np.pi * f * k[sel] / fs) @ (o + g * samples[k[sel]])
+    Y_f = np.exp(-2j * np.pi * f * (u[sel] / fs - delay_s)) @ (raw[sel, ref] * adc[ref])
+    tones = [{"hz": float(f), "gain_db": float(20 * np.log10(abs(b) / max(abs(a), 1e-30))),
+              "phase_deg": float(np.degrees(np.angle(b / a)))}
+             for f, a, b in zip(cfg.TONES_HZ, X_f, Y_f)]
+
+    new = Calibration(
+        DAC_OFFSET=float(-o / g),
+        DAC_SCALE=float(1.0 / g),
+        ADC_SCALE=float(adc[0]) if nch == 1 else tuple(float(a) for a in adc),
+        G_PER_V=cal.G_PER_V,
+        DELAY_S=float(delay_s),
+    )
+    report = {
+        "measured": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "reference_channel": ref,
+        "dac_gain": float(g),
+        "dac_offset_v": float(o),
+        "adc_scale": [float(a) for a in adc],
+        "delay_ms": float(delay_s * 1e3),
+        "correlation": rho,
+        "max_residual_mv": [float(v) for v in np.abs(resid).max(axis=0) * 1e3],
+        "tones": tones,
+    }
+    return new, report
+
+
+def run_loopback(dac, rt=None, cfg=None, cal=None):
+    """
+    Play the loopback stimulus on `dac` (AO wired to the AI channels, the
+    amplifier disconnected), record the raw AI volts and fit them.
+    Returns (Calibration, report).
+    """
+    from acquisition import AcquisitionWorker
+    from output_worker import DEFAULT_PARAMS, WaveformOutputWorker
+
+    rt = rt or Runtime()
+    cfg = cfg or LoopbackCal()
+    cal = cal or Calibration()
+    fs = rt.SAMPLE_HZ
+    samples, steps = stimulus(cfg, fs)
+
+    # Played through the profile player: the samples go out as raw DAC volts
+    os.makedirs(rt.PROFILE_CACHE, exist_ok=True)
+    path = os.path.join(rt.PROFILE_CACHE, "loopback_calibration.npy")
+    np.save(path, samples.astype(np.float32))
+    with open(path[:-4] + ".json", "w", encoding="utf-8") as f:
+        json.dump({"name": "Loopback calibration", "sample_hz": float(fs),
+                   "samples": len(samples), "steps": steps}, f, indent=2)
+
+    seconds = len(samples) / fs + 2.0
+    acq = AcquisitionWorker(dac, fs, rt.AI_BUFFER_SAMPLES, seconds)
+    acq.set_calibration(Calibration(ADC_SCALE=1.0, G_PER_V=1.0))  # raw ADC volts
+    out = WaveformOutputWorker(dac, fs, rt.AO_BUFFER_SAMPLES, history_s=seconds)
+    out.update_settings("Profile", dict(DEFAULT_PARAMS, profile=path), Calibration())
+    acq.start()
+    try:
+        out.start()
+        while out.running and out.control_status() != "DONE":
+            time.sleep(0.05)
+        # The tail is queued; wait until it has been played and sampled
+        time.sleep(rt.AO_BUFFER_SAMPLES / fs + cfg.MAX_DELAY_S + 0.1)
+        block, _ = acq.channel_ring.read(0)
+        t_origin, hz = out.cmd_ring.t_origin, out.cmd_ring.sample_hz
+    finally:
+        out.stop()
+        acq.stop()
+    for error in (out.error, acq.error):
+        if error is not None:
+            raise CalibrationError(f"Loopback run failed: {error}")
+    if out.underruns or acq.overruns:
+        raise CalibrationError(
+            f"Loopback run lost samples ({out.underruns} output underruns, "
+            f"{acq.overruns} AI overruns); run it again on an idle system")
+    return fit(block.t, block.v, samples, steps, t_origin, hz, cfg, cal)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from daq_backend import make_daq
+
+    ap = argparse.ArgumentParser(
+        description="Loopback calibration: wire AO to the AI channels and disconnect the amplifier.")
+    ap.add_argument("--sim", action="store_true", help="simulated DAQ with DAC / ADC errors (SimLoopback)")
+    ap.add_argument("--dry-run", action="store_true", help="show the result without saving it")
+    ap.add_argument("--yes", action="store_true", help="skip the wiring confirmation")
+    ap.add_argument("-o", "--output", help="calibration file (default Runtime.CALIBRATION_FILE)")
+    args = ap.parse_args()
+
+    rt = Runtime()
+    path = args.output or rt.CALIBRATION_FILE
+    try:
+        current = load_calibration(path)
+    except CalibrationError as e:
+        print(f"Ignoring {e}")
+        current = Calibration()
+    if args.sim:
+        from config import SimLoopback
+        from sim_daq import SimDAQ
+        dac = SimDAQ(sample_hz=rt.SAMPLE_HZ, ai_channels=rt.AI_CHANNELS, loopback=SimLoopback())
+    else:
+        if not args.yes and input("AO wired to AI and amplifier disconnected? [y/N] ").lower() != "y":
+            raise SystemExit(1)
+        dac = make_daq(rt)
+    dac.connect()
+    try:
+        cal, report = run_loopback(dac, rt, cal=current)
+    finally:
+        dac.close()
+
+    print(f"DAC gain {report['dac_gain']:.5f}, offset {report['dac_offset_v'] * 1e3:+.2f} mV "
+          f"-> DAC_SCALE {cal.DAC_SCALE:.5f}, DAC_OFFSET {cal.DAC_OFFSET:+.5f} V")
+    print("ADC_SCALE " + ", ".join(f"{a:.5f}" for a in report["adc_scale"])
+          + f"  (reference channel {report['reference_channel']}, residual "
+          + ", ".join(f"{m:.1f}" for m in report["max_residual_mv"]) + " mV)")
+    print(f"Delay {report['delay_ms']:.3f} ms (correlation {report['correlation']:.3f})")
+    for tone in report["tones"]:
+        print(f"  {tone['hz']:7.1f} Hz  {tone['gain_db']:+.2f} dB  {tone['phase_deg']:+.1f} deg")
+    if not args.dry_run:
+        save_calibration(cal, path, report)
+        print(f"Saved to {path}")
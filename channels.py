@@ -0,0 +1,67 @@
+# vtc/channels.py
+import numpy as np
+
+STRATEGIES = ("average", "max_rms", "weighted")
+
+
+def per_channel(value, channels, name="value"):
+    """
+    A calibration value given as one number (all channels) or one per
+    channel, as an array of `channels` floats.
+    """
+    arr = np.atleast_1d(np.asarray(value, dtype=float))
+    if arr.size == 1:
+        return np.full(channels, float(arr[0]))
+    if arr.size != channels:
+        raise ValueError(f"{name} has {arr.size} values for {channels} AI channels")
+    return arr
+
+
+def channel_gains(cal, channels):
+    """
+    g per raw ADC volt for each channel (ADC_SCALE * G_PER_V).
+    """
+    return (per_channel(cal.ADC_SCALE, channels, "ADC_SCALE")
+            * per_channel(cal.G_PER_V, channels, "G_PER_V"))
+
+
+class ControlCombiner:
+    """
+    Reduces a block of per-channel responses, shape (n, channels) in g, to
+    the single control signal.
+
+    "average" is the channel mean and "weighted" uses `weights` scaled to
+    sum to 1; both are one matrix-vector product per block. "max_rms"
+    controls on whichever channel has the highest running RMS (exponential
+    over `rms_s`), chosen per block; `selected` is that channel.
+    """
+
+    def __init__(self, strategy, channels, sample_hz, weights=(), rms_s=0.5):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Control strategy must be one of {', '.join(STRATEGIES)}")
+        self.strategy = strategy
+        self.channels = int(channels)
+        self.sample_hz = float(sample_hz)
+        self.rms_s = max(float(rms_s), 1e-3)
+        if strategy == "weighted":
+            w = per_channel(weights, self.channels, "CONTROL_WEIGHTS")
+            if w.sum() <= 0.0:
+                raise ValueError("CONTROL_WEIGHTS must sum to more than zero")
+        else:
+            w = np.ones(self.channels)
+        self.weights = w / w.sum()
+        self.mean_square = np.zeros(self.channels)
+        self.selected = 0
+
+    def __call__(self, g):
+        if self.strategy != "max_rms":
+            return g @ self.weights
+        n = len(g)
+        if n:
+            alpha = 1.0 - np.exp(-n / (self.rms_s * self.sample_hz))
+            self.mean_square += alpha * (np.einsum("ij,ij->j", g, g) / n - self.mean_square)
+            self.selected = int(np.argmax(self.mean_square))
+        return g[:, self.selected]
+
+    def rms(self):
+        return np.sqrt(self.mean_square)
@@ -1,6 +1,8 @@
 # vtc/config.py
+import os
 from dataclasses import dataclass
 from pathlib import Path
+from typing import Optional
 
 @dataclass
 class Calibration:
@@ -8,6 +10,10 @@ class Calibration:
     DAC_SCALE: float  = 1.0   # multiplier after waveform calc
     ADC_SCALE: float  = 1.0   # volts multiplier after divider (V_meas = ADC*ADC_SCALE)
     G_PER_V: float    = 1.0   # g per volt on monitor/accelerometer path
+    # ADC_SCALE and G_PER_V may also be tuples, one value per Runtime.AI_CHANNELS entry
+    DELAY_S: float    = 0.0   # AO -> AI pipeline delay, aligns command with measured samples
+    # Values measured by the loopback calibration (calibration.py) are loaded
+    # over these defaults from Runtime.CALIBRATION_FILE at startup
 
 @dataclass
 class GPIOPins:
@@ -16,6 +22,197 @@ class GPIOPins:
 
 @dataclass
 class Runtime:
+    DAQ_BACKEND: str = os.environ.get("VTC_DAQ", "uldaq")  # "uldaq" or "sim"
     SAMPLE_HZ: int = 5000
     GUI_HZ: int = 50
+    PARAM_RAMP_S: float = 0.5       # amplitude / DC / frequency changes ramp over this time
+    AO_BUFFER_SAMPLES: int = 1000   # circular AO scan buffer, refilled in halves
+    AI_BUFFER_SAMPLES: int = 10000  # circular AI scan buffer on the device side
+    AI_RING_SECONDS: float = 10.0   # feedback history kept for plot/log/analysis
+    AI_POLL_HZ: float = 200.0       # single-sample AI rate for DAQs without AI scans
+    # Accelerometer channels, scanned together (uldaq needs a contiguous range)
+    # and combined into the control signal (see channels.ControlCombiner)
+    AI_CHANNELS: tuple = (0,)
+    CONTROL_STRATEGY: str = "average"  # "average", "max_rms" or "weighted"
+    CONTROL_WEIGHTS: tuple = ()     # one weight per channel for "weighted"
+    CONTROL_RMS_S: float = 0.5      # RMS averaging time for "max_rms"
+    SPECTRUM_FRAME: int = 4096      # FFT frame for the live spectrum view
+    SPECTRUM_AVERAGES: int = 16
+    SPECTRUM_FMAX_HZ: float = 100.0
+    PLOT_WINDOWS_S: tuple = (1.0, 10.0, 60.0)  # selectable live-plot time windows
     LOG_PATH: str = str(Path.home() / "vtc_logs")
+    CALIBRATION_FILE: str = str(Path.home() / "vtc_calibration.json")  # written by calibration.py
+    EXPORT_CSV: bool = True         # also export a CSV copy of binary run logs
+    EXPORT_COMPRESS: bool = False   # gzip files on the way to the USB drive
+    EXPORT_CHUNK_MB: int = 4        # copy / checksum block size
+    PROFILE_CACHE: str = str(Path.home() / "vtc_profiles")  # compiled test profiles
+    PROFILE_MEMMAP_S: float = 120.0  # longer profiles play memory-mapped from disk
+    # Run DAQ, acquisition and output in a separate process (engine_process)
+    ENGINE_PROCESS: bool = os.environ.get("VTC_ENGINE_PROCESS", "0") == "1"
+    ENGINE_POLL_S: float = 0.01     # engine control-block service period
+    ENGINE_WATCHDOG_S: float = 2.0  # stop output if the GUI heartbeat is this old
+    # Real-time profile for the output thread (see rt_sched.RTProfile)
+    RT_ENABLE: bool = False
+    RT_PRIORITY: int = 80           # SCHED_FIFO priority, 1..99
+    RT_CPU: Optional[int] = None    # core to pin to, e.g. 3 with isolcpus=3 (README); None = any
+    RT_MLOCK: bool = True           # mlockall() at startup
+    RT_GC_OFF: bool = True          # freeze the heap; GC runs off the output thread (RTProfile)
+    RT_GC_FULL_S: float = 60.0      # full collection interval meanwhile
+    RT_SPIN_US: float = 100.0       # busy-wait this long before each deadline
+
+@dataclass
+class RandomControl:
+    FRAME_LEN: int = 4096        # samples per FFT frame (drive synthesis and Welch)
+    AVERAGES: int = 8            # Welch averages in the measured ASD
+    TOLERANCE_AVERAGES: int = 32 # longer average the ALARM / ABORT lines are judged on (~120 DOF)
+    UPDATE_FRAMES: int = 2       # equalize the drive every N new measured frames
+    EQ_GAIN: float = 0.5         # exponent on target/measured per update
+    MAX_STEP_DB: float = 3.0     # max drive change per line per update
+    MAX_DRIVE_RMS: float = 1.5   # volts; drive is scaled down if it exceeds this
+    ALARM_DB: float = 3.0        # tolerance lines around the target ASD
+    ABORT_DB: float = 6.0
+    ABORT_FRACTION: float = 0.1  # abort when this fraction of lines is outside ABORT_DB
+    PROFILE: str = "5:0.001, 10:0.01, 40:0.01, 50:0.001"  # default ASD breakpoints, Hz:g²/Hz
+
+@dataclass
+class SineControl:
+    TRACK_BW_HZ: float = 2.0       # tracking-filter bandwidth (capped at f/8)
+    COMPRESSION_DB_S: float = 20.0 # max drive change rate
+    LOOP_GAIN: float = 0.5         # fraction of the dB error corrected per update
+    START_FRACTION: float = 0.1    # start at this fraction of the amplitude limit
+    ALARM_DB: float = 1.0          # tolerance around the target g level
+    ABORT_DB: float = 3.0
+    ABORT_HOLD_S: float = 1.0      # error must stay beyond ABORT_DB this long
+
+@dataclass
+class SimPlant:
+    """Table model used by the simulated DAQ backend (sim_daq.TablePlant)."""
+    FN_HZ: float = 30.0          # payload natural frequency
+    ZETA: float = 0.05           # damping ratio
+    GAIN_G_PER_V: float = 1.0    # commanded acceleration per drive volt
+    INPUT_BIAS_V: float = 2.5    # drive level that means "no motion"
+    LATENCY_S: float = 0.002     # amplifier + ADC pipeline delay
+    NOISE_G: float = 0.002       # RMS sensor noise
+    SENSOR_V_PER_G: float = 1.0
+    SENSOR_BIAS_V: float = 0.0
+    ADC_RANGE_V: float = 10.0    # ±, BIP10VOLTS
+    ADC_BITS: int = 12
+    CHANNEL_GAINS: tuple = (1.0, 1.3, 0.8, 1.1)  # response seen by AI channel 0, 1, ... (mount position)
+
+@dataclass
+class SimLoopback:
+    """AO -> AI loopback wiring simulated by sim_daq.SimDAQ(loopback=...)."""
+    DAC_GAIN: float = 0.985       # volts out per volt written
+    DAC_OFFSET_V: float = 0.012
+    ADC_GAINS: tuple = (1.0, 0.5, 0.25, 0.2)  # raw ADC volts per loopback volt on AI channel 0, 1, ... (dividers)
+    DELAY_S: float = 0.0016       # AO -> AI pipeline delay
+    NOISE_V: float = 0.001        # RMS noise at the ADC
+
+@dataclass
+class LoopbackCal:
+    """Loopback calibration of the DAC / ADC chain (calibration.py)."""
+    DC_LEVELS_V: tuple = (0.5, 1.25, 2.0, 2.75, 3.5, 4.25)  # DAC levels of the DC staircase
+    STEP_S: float = 0.5           # time on each level
+    SETTLE_S: float = 0.1         # left out of the fit at both ends of each level
+    TONES_HZ: tuple = (7.0, 31.0, 113.0, 397.0)  # multitone for the delay and the gain check
+    TONE_V: float = 0.3           # amplitude of each tone, about TONE_BIAS_V
+    TONE_BIAS_V: float = 2.5
+    MULTITONE_S: float = 2.0
+    MAX_DELAY_S: float = 0.05     # delay search range
+    REFERENCE_CHANNEL: int = 0    # AI channel (index into AI_CHANNELS) whose ADC_SCALE is trusted
+    MAX_DAC_ERROR: float = 0.2    # reject a fitted DAC gain or offset (V) further than this from nominal
+
+@dataclass
+class ResonanceSearch:
+    """Resonance search sweep and tracking dwell (resonance.py)."""
+    BINS_PER_OCTAVE: int = 48       # log-frequency resolution of the sweep FRF
+    MIN_PROMINENCE_DB: float = 3.0  # peaks must stand this far above their surroundings
+    MAX_PEAKS: int = 5
+    SETTLE_S: float = 0.5           # keep recording after the sweep for the response to arrive
+    TRACK_WINDOW_S: float = 0.5     # demodulation window of the dwell tracker
+    TRACK_GAIN: float = 0.5         # fraction of the phase error corrected per update
+    MAX_DRIFT_HZ_S: float = 2.0     # limit on how fast the dwell frequency may move
+
+@dataclass
+class ShockSRS:
+    """Shock response spectrum of the measured pulse in Shock mode (srs.py)."""
+    F_MIN_HZ: float = 2.0
+    F_MAX_HZ: float = 800.0        # ramp-invariant filters stay accurate to about SAMPLE_HZ/6
+    POINTS: int = 240              # log-spaced natural frequencies
+    Q: float = 10.0                # 5 % damping
+    PRE_S: float = 0.05            # record kept before the pulse (baseline)
+    POST_S: float = 0.5            # record kept after the pulse
+    WORKERS: int = 0               # SRS process pool size, 0 = one per CPU
+    REFERENCE: str = "10:2, 30:10, 800:10"  # required maximax SRS breakpoints, Hz:g
+    TOLERANCE_DB: float = 6.0      # band around REFERENCE the measured SRS must stay within
+
+
+@dataclass
+class Analysis:
+    """Batch post-run analysis of the run logs (analysis.py)."""
+    FRAME: int = 4096              # Welch frame for run spectra
+    FMAX_HZ: float = 500.0         # spectra are kept and plotted up to here
+    CHUNK_ROWS: int = 65536        # rows read at a time
+    WORKERS: int = 0               # process pool size, 0 = one per CPU
+    CACHE_DIR: str = ".vtc_analysis"  # per-run results, under the log directory
+
+
+@dataclass
+class Replay:
+    """Replay of finished runs from their min/max pyramid (replay.py)."""
+    BASE_BIN: int = 16             # rows per bin of the finest pyramid level
+    FACTOR: int = 8                # bins folded into one at each coarser level
+    TOP_BINS: int = 2048           # levels are added until one has at most this many bins
+    BUILD_ROWS: int = 1 << 20      # rows read at a time while building
+    REDRAW_MS: int = 30            # redraw at most this often while panning / zooming
+
+
+@dataclass
+class Replication:
+    """Time-waveform replication of recorded field data (replication.py)."""
+    CACHE_DIR: str = str(Path.home() / "vtc_replication")  # resampled references and drives
+    CHUNK_SAMPLES: int = 1 << 18   # samples read, resampled and corrected at a time
+    WAV_FULL_SCALE_G: float = 1.0  # g at full scale of integer WAV samples
+    FRAME: int = 4096              # FFT frame of the transfer function and the inverse filter
+    F_MIN_HZ: float = 2.0          # the drive is only corrected in this band
+    F_MAX_HZ: float = 500.0
+    COHERENCE_MIN: float = 0.5     # lines with less coherence are not corrected
+    REGULARIZATION: float = 0.01   # fraction of the median in-band |H|² added to |H|², bounds the inverse
+    GAIN: float = 0.7              # fraction of the error corrected after each pass (halved when a pass gets worse)
+    INITIAL_G_PER_V: float = 1.0   # table gain assumed for the first drive
+    START_FRACTION: float = 0.5    # the first pass plays this fraction of that drive
+    MAX_DRIVE_V: float = 2.4       # drive limit either side of DC
+    TOLERANCE_PCT: float = 10.0    # converged once RMS(reference - response) / RMS(reference) is below this
+    MAX_PASSES: int = 8
+    SETTLE_S: float = 1.0          # DC held before each pass, and response recorded after it
+
+
+@dataclass
+class AbortLimits:
+    """Sample-rate abort limits (limits.py); 0 disables a limit."""
+    ENABLE: bool = True
+    PEAK_G: float = 50.0           # |control signal| at any sample
+    RMS_G: float = 30.0            # AC RMS of the control signal over RMS_WINDOW_S
+    RMS_WINDOW_S: float = 0.1
+    RATIO_G_PER_V: float = 25.0    # response RMS per drive volt RMS (runaway, lost specimen)
+    RATIO_MIN_DRIVE_V: float = 0.05  # ratio only checked while the drive RMS is above this
+    FEEDBACK_TIMEOUT_S: float = 0.1  # feedback lost (NaN) or not arriving for this long
+    SLEW_V_PER_S: float = 0.0      # drive change between consecutive samples (off: see README)
+    RAMP_DOWN_S: float = 0.05      # drive ramps from its level to 0 V over this after a trip
+    GUARD_S: float = 0.002         # queued drive this close to the DAC is left as it is
+
+
+@dataclass
+class Telemetry:
+    """Streaming server for remote monitoring clients (telemetry.py)."""
+    ENABLE: bool = os.environ.get("VTC_TELEMETRY", "0") == "1"
+    HOST: str = "127.0.0.1"        # "0.0.0.0" to serve other machines on the network
+    PORT: int = 8765
+    POINTS_HZ: float = 500.0       # min/max bins per second sent to clients
+    SEND_PERIOD_S: float = 0.1     # sample messages are batched this often
+    STATUS_PERIOD_S: float = 0.5
+    METRICS_S: float = 1.0         # RMS / peak window of the run metrics
+    QUEUE_MESSAGES: int = 50       # per-client backlog before the drop policy applies
+    POLICY: str = "drop_oldest"    # "drop_oldest", "drop_newest" or "disconnect"
+    SEND_BUFFER_BYTES: int = 32768  # per-client socket / transport send buffer
+    MAX_CLIENTS: int = 32
@@ -1,27 +1,48 @@
 # vtc/dac_uldaq.py
+import numpy as np
 from uldaq import (
     get_daq_device_inventory, DaqDevice, InterfaceType,
-    AOutFlag, AInFlag, Range
+    AOutFlag, AInFlag, Range, AOutScanFlag, AInScanFlag, AiInputMode,
+    ScanOption, ScanStatus, create_float_buffer,
 )
 
-class DacULDAQ:
+from daq_backend import DAQBackend
+
+class DacULDAQ(DAQBackend):
     """
     Simple wrapper around an MCC USB-1208FS-Plus:
     - AO: single channel for drive (0–5 V typical)
-    - AI: single channel for feedback (BIP10VOLTS from ADAM-3017)
+    - AI: one or more feedback channels (BIP10VOLTS from ADAM-3017), a
+      contiguous range so they can share one hardware scan
+
+    AO can be driven one sample at a time with write(), or streamed from a
+    circular buffer with a hardware-paced continuous scan (create_ao_buffer /
+    start_ao_scan / ao_scan_position / stop_ao_scan). AI likewise has
+    read() for single samples and a continuous scan into a circular buffer
+    (create_ai_buffer / start_ai_scan / ai_scan_position / stop_ai_scan).
     """
+
+    supports_ao_scan = True
+    supports_ai_scan = True
+
     def __init__(
         self,
         device_hint=None,
         ao_channel=0,
-        ai_channel=0,
+        ai_channels=(0,),
         ao_range=Range.UNI5VOLTS,
         ai_range=Range.BIP10VOLTS,
+        ai_input_mode=AiInputMode.SINGLE_ENDED,
     ):
         self.ao_channel = ao_channel
-        self.ai_channel = ai_channel
+        self.ai_channels = tuple(int(c) for c in ai_channels)
+        if not self.ai_channels or list(self.ai_channels) != list(
+                range(self.ai_channels[0], self.ai_channels[0] + len(self.ai_channels))):
+            raise ValueError("AI channels must be a contiguous ascending range, e.g. (0, 1, 2)")
+        self.ai_channel = self.ai_channels[0]
         self.ao_range = ao_range
         self.ai_range = ai_range
+        self.ai_input_mode = ai_input_mode
 
         devices = get_daq_device_inventory(InterfaceType.USB)
         if not devices:
@@ -37,6 +58,14 @@ class DacULDAQ:
         self.ao_device = None
         self.ai_device = None
 
+        self._ao_buffer = None
+        self._ao_view = None
+        self._ao_scanning = False
+
+        self._ai_buffer = None
+        self._ai_view = None
+        self._ai_scanning = False
+
     def connect(self):
         self.device.connect()
         self.ao_device = self.device.get_ao_device()
@@ -50,27 +79,143 @@ class DacULDAQ:
 
     # --- AO ---
 
+    @property
+    def ao_limits(self):
+        if self.ao_range == Range.UNI5VOLTS:
+            return 0.0, 5.0
+        return -5.0, 5.0
+
     def write(self, volts: float):
         # Clamp to selected AO range
-        if self.ao_range == Range.UNI5VOLTS:
-            volts = max(0.0, min(5.0, volts))
-        else:
-            volts = max(-5.0, min(5.0, volts))
+        lo, hi = self.ao_limits
+        volts = max(lo, min(hi, volts))
         self.ao_device.a_out(self.ao_channel, self.ao_range, AOutFlag.DEFAULT, volts)
 
+    # --- AO scan ---
+
+    def create_ao_buffer(self, samples: int) -> np.ndarray:
+        """
+        Allocate the circular buffer used by the continuous AO scan and
+        return a numpy view onto it. The buffer starts at 0 V.
+        """
+        self._ao_buffer = create_float_buffer(1, int(samples))
+        self._ao_view = np.ctypeslib.as_array(self._ao_buffer)
+        self._ao_view[:] = max(self.ao_limits[0], 0.0)
+        return self._ao_view
+
+    def write_ao_block(self, start: int, samples):
+        """
+        Copy a block of volts into the AO scan buffer at `start`,
+        clamped to the AO range. The block must not wrap the buffer end.
+        """
+        lo, hi = self.ao_limits
+        stop = start + len(samples)
+        np.clip(samples, lo, hi, out=self._ao_view[start:stop])
+
+    def start_ao_scan(self, rate_hz: float) -> float:
+        """
+        Start clocking the AO buffer out continuously at `rate_hz`.
+        Returns the rate actually set by the device.
+        """
+        if self._ao_buffer is None:
+            raise RuntimeError("AO scan buffer not allocated.")
+        rate = self.ao_device.a_out_scan(
+            self.ao_channel,
+            self.ao_channel,
+            self.ao_range,
+            len(self._ao_view),
+            float(rate_hz),
+            ScanOption.CONTINUOUS,
+            AOutScanFlag.DEFAULT,
+            self._ao_buffer,
+        )
+        self._ao_scanning = True
+        return float(rate)
+
+    def ao_scan_position(self) -> int:
+        """
+        Total number of samples the scan has taken from the buffer so far.
+        """
+        status, transfer = self.ao_device.get_scan_status()
+        if status != ScanStatus.RUNNING:
+            raise RuntimeError("AO scan is not running.")
+        return int(transfer.current_total_count)
+
+    def stop_ao_scan(self):
+        try:
+            if self._ao_scanning:
+                self.ao_device.scan_stop()
+        finally:
+            self._ao_scanning = False
+            self._ao_buffer = None
+            self._ao_view = None
+
     # --- AI ---
 
     def read(self) -> float:
         """
-        Returns AI voltage on ai_channel in volts.
+        Returns AI voltage on the first AI channel in volts.
         Assumes ADAM-3017 output is wired to that channel.
         """
         return float(self.ai_device.a_in(self.ai_channel, self.ai_range, AInFlag.DEFAULT))
 
+    # --- AI scan ---
+
+    def create_ai_buffer(self, samples: int) -> np.ndarray:
+        """
+        Allocate the circular buffer the continuous AI scan writes into
+        (`samples` scans of all channels, interleaved) and return a numpy
+        view onto it. Callers should only read from it.
+        """
+        self._ai_buffer = create_float_buffer(len(self.ai_channels), int(samples))
+        self._ai_view = np.ctypeslib.as_array(self._ai_buffer)
+        self._ai_view[:] = 0.0
+        return self._ai_view
+
+    def start_ai_scan(self, rate_hz: float) -> float:
+        """
+        Scan the AI channels continuously into the AI buffer at `rate_hz`
+        scans per second. Returns the rate actually set by the device.
+        """
+        if self._ai_buffer is None:
+            raise RuntimeError("AI scan buffer not allocated.")
+        rate = self.ai_device.a_in_scan(
+            self.ai_channels[0],
+            self.ai_channels[-1],
+            self.ai_input_mode,
+            self.ai_range,
+            len(self._ai_view) // len(self.ai_channels),
+            float(rate_hz),
+            ScanOption.CONTINUOUS,
+            AInScanFlag.DEFAULT,
+            self._ai_buffer,
+        )
+        self._ai_scanning = True
+        return float(rate)
+
+    def ai_scan_position(self) -> int:
+        """
+        Total number of scans the device has written into the buffer so far.
+        """
+        status, transfer = self.ai_device.get_scan_status()
+        if status != ScanStatus.RUNNING:
+            raise RuntimeError("AI scan is not running.")
+        return int(transfer.current_scan_count)
+
+    def stop_ai_scan(self):
+        try:
+            if self._ai_scanning:
+                self.ai_device.scan_stop()
+        finally:
+            self._ai_scanning = False
+            self._ai_buffer = None
+            self._ai_view = None
+
     def close(self):
         try:
+            self.stop_ai_scan()
+            self.stop_ao_scan()
             self.write(0.0)
         finally:
             self.device.disconnect()
             self.device.release()
-
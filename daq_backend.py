@@ -0,0 +1,88 @@
+# vtc/daq_backend.py
+
+
+class DAQBackend:
+    """
+    Interface the controller uses to talk to a DAQ.
+
+    Single-sample I/O (write / read) is required. Buffered scans are
+    optional: a backend that implements them sets supports_ao_scan /
+    supports_ai_scan, and the workers fall back to single samples
+    otherwise.
+
+    AO scan: create_ao_buffer(n) returns a writable numpy view of the
+    circular buffer, write_ao_block(start, samples) fills part of it,
+    start_ao_scan(rate_hz) starts it, ao_scan_position() is the total
+    number of samples taken from it, stop_ao_scan() stops it.
+
+    AI scan: every sample is one scan of all `ai_channels`, stored
+    interleaved. create_ai_buffer(n) returns a numpy view of n scans
+    (n * len(ai_channels) values) the scan writes into, start_ai_scan(rate_hz)
+    starts it, ai_scan_position() is the total number of scans written,
+    stop_ai_scan() stops it. read() returns the first channel.
+    """
+
+    supports_ao_scan = False
+    supports_ai_scan = False
+    ai_channels = (0,)
+    simulated = False
+    ao_limits = (0.0, 5.0)
+
+    def connect(self):
+        raise NotImplementedError
+
+    def write(self, volts: float):
+        raise NotImplementedError
+
+    def read(self) -> float:
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+    # --- AO scan ---
+
+    def create_ao_buffer(self, samples: int):
+        raise NotImplementedError
+
+    def write_ao_block(self, start: int, samples):
+        raise NotImplementedError
+
+    def start_ao_scan(self, rate_hz: float) -> float:
+        raise NotImplementedError
+
+    def ao_scan_position(self) -> int:
+        raise NotImplementedError
+
+    def stop_ao_scan(self):
+        raise NotImplementedError
+
+    # --- AI scan ---
+
+    def create_ai_buffer(self, samples: int):
+        raise NotImplementedError
+
+    def start_ai_scan(self, rate_hz: float) -> float:
+        raise NotImplementedError
+
+    def ai_scan_position(self) -> int:
+        raise NotImplementedError
+
+    def stop_ai_scan(self):
+        raise NotImplementedError
+
+
+def make_daq(rt):
+    """
+    Build the backend named by Runtime.DAQ_BACKEND ("uldaq" or "sim").
+    Backends are imported lazily so the simulator runs without uldaq.
+    """
+    backend = str(rt.DAQ_BACKEND).lower()
+    if backend == "uldaq":
+        from dac_uldaq import DacULDAQ
+        return DacULDAQ(ai_channels=rt.AI_CHANNELS)
+    if backend == "sim":
+        from config import SimPlant
+        from sim_daq import SimDAQ
+        return SimDAQ(plant=SimPlant(), sample_hz=rt.SAMPLE_HZ, ai_channels=rt.AI_CHANNELS)
+    raise ValueError(f"Unknown DAQ backend: {rt.DAQ_BACKEND}")
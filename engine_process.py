@@ -0,0 +1,524 @@
+# vtc/engine_process.py
+import json
+import multiprocessing as mp
+import os
+import time
+import zlib
+from dataclasses import asdict
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from config import AbortLimits, Calibration
+from acquisition import AcquisitionWorker, SharedSampleRing
+from daq_backend import make_daq
+from output_worker import WaveformOutputWorker
+from rt_sched import RTProfile
+
+# Control block header slots (int64)
+GUI_BEAT = 0      # time.monotonic_ns() of the last GUI heartbeat
+ENGINE_BEAT = 1   # time.monotonic_ns() of the last engine loop
+ENGINE_PID = 2
+
+COMMAND = 0       # mailbox written by the GUI
+STATUS = 1        # mailbox written by the engine
+
+
+class ControlBlock:
+    """
+    Shared-memory control block between the GUI and the engine process.
+
+    A small int64 header carries both heartbeats and the engine pid. Two
+    JSON mailboxes carry state: COMMAND (GUI -> engine: mode, params,
+    calibration, run flag) and STATUS (engine -> GUI). Each mailbox has a
+    single writer and is a seqlock: the version is odd while the payload
+    is rewritten, and a reader only accepts a payload whose even version
+    was the same before and after the copy and whose crc matches.
+    """
+
+    MAILBOX_BYTES = 32768
+    _HEADER = 32
+    _BOX_HEADER = 24  # version, length, crc32
+
+    def __init__(self, name=None):
+        size = self._HEADER + 2 * (self._BOX_HEADER + self.MAILBOX_BYTES)
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.header = np.ndarray(4, np.int64, self.shm.buf, 0)
+        self._box = [
+            np.ndarray(3, np.int64, self.shm.buf, self._offset(i)) for i in (COMMAND, STATUS)
+        ]
+        if name is None:
+            self.header[:] = 0
+            for box in self._box:
+                box[:] = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def _offset(self, which):
+        return self._HEADER + which * (self._BOX_HEADER + self.MAILBOX_BYTES)
+
+    def version(self, which):
+        return int(self._box[which][0])
+
+    def write(self, which, obj):
+        data = json.dumps(obj).encode()
+        if len(data) > self.MAILBOX_BYTES:
+            raise ValueError("control block message too large")
+        box = self._box[which]
+        start = self._offset(which) + self._BOX_HEADER
+        box[0] += 1
+        self.shm.buf[start:start + len(data)] = data
+        box[1] = len(data)
+        box[2] = zlib.crc32(data)
+        box[0] += 1
+
+    def read(self, which, retries=100):
+        """
+        Return (version, obj), or (version, None) if nothing was written yet
+        or no consistent copy could be taken.
+        """
+        box = self._box[which]
+        start = self._offset(which) + self._BOX_HEADER
+        for _ in range(retries):
+            version = int(box[0])
+            if version == 0:
+                return 0, None
+            if version % 2:
+                continue
+            n = int(box[1])
+            crc = int(box[2])
+            data = bytes(self.shm.buf[start:start + n])
+            if int(box[0]) == version and zlib.crc32(data) == crc:
+                return version, json.loads(data)
+        return int(box[0]), None
+
+    def close(self, unlink=False):
+        self.header = None
+        self._box = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def engine_main(control_name, meas_name, chan_name, cmd_name, rt, gui_pid):
+    """
+    Entry point of the engine process: owns the DAQ, the acquisition and
+    output workers (under the RT profile) and serves the control block
+    until told to quit or the GUI process goes away. The DAC is zeroed on
+    the way out, whatever the reason.
+    """
+    control = ControlBlock(control_name)
+    meas_ring = SharedSampleRing(name=meas_name)
+    chan_ring = SharedSampleRing(name=chan_name)
+    cmd_ring = SharedSampleRing(name=cmd_name)
+    control.header[ENGINE_PID] = os.getpid()
+
+    dac = acq = out = None
+    try:
+        profile = RTProfile(rt)
+        profile.lock_memory()
+        dac = make_daq(rt)
+        dac.connect()
+        # A polled (single-channel) acquisition keeps its channel ring local
+        acq = AcquisitionWorker(
+            dac=dac,
+            sample_hz=rt.SAMPLE_HZ,
+            buffer_samples=rt.AI_BUFFER_SAMPLES,
+            ring=meas_ring,
+            channel_ring=chan_ring if dac.supports_ai_scan else None,
+            strategy=rt.CONTROL_STRATEGY,
+            weights=rt.CONTROL_WEIGHTS,
+            rms_s=rt.CONTROL_RMS_S,
+            poll_hz=rt.AI_POLL_HZ,
+        )
+        acq.start()
+        out = WaveformOutputWorker(
+            dac=dac,
+            sample_hz=rt.SAMPLE_HZ,
+            buffer_samples=rt.AO_BUFFER_SAMPLES,
+            feedback=acq.ring,
+            rt_profile=profile,
+            cmd_ring=cmd_ring,
+            ramp_s=rt.PARAM_RAMP_S,
+            limits=AbortLimits(),
+        )
+        _serve(control, dac, acq, out, profile, rt, gui_pid)
+    except Exception as e:
+        control.write(STATUS, {"fatal": repr(e)})
+    finally:
+        for worker in (out, acq):
+            try:
+                if worker is not None:
+                    worker.stop()
+            except Exception:
+                pass
+        if dac is not None:
+            try:
+                dac.write(0.0)
+            except Exception:
+                pass
+            try:
+                dac.close()
+            except Exception:
+                pass
+        meas_ring.close()
+        chan_ring.close()
+        cmd_ring.close()
+        control.close()
+
+
+def _serve(control, dac, acq, out, profile, rt, gui_pid):
+    cmd_version = None
+    run_id = 0
+    idle_v = 0.0
+    watchdog = None
+    poll_s = max(0.005, rt.ENGINE_POLL_S)
+
+    while True:
+        now_ns = time.monotonic_ns()
+        control.header[ENGINE_BEAT] = now_ns
+
+        version, cmd = control.read(COMMAND)
+        if cmd is not None and version != cmd_version:
+            cmd_version = version
+            if cmd["quit"]:
+                break
+            cal = Calibration(**cmd["cal"])
+            out.update_settings(cmd["mode"], cmd["params"], cal)
+            acq.set_calibration(cal)
+            if cmd["run"] and cmd["run_id"] != run_id:
+                out.stop()
+                run_id = cmd["run_id"]
+                watchdog = None
+                out.start()
+            elif not cmd["run"] and out.running:
+                out.stop()
+            if not out.running and cmd["idle_v"] != idle_v:
+                idle_v = cmd["idle_v"]
+                dac.write(idle_v)
+
+        # Stop driving if the GUI hangs; exit if it is gone altogether
+        if os.getppid() != gui_pid:
+            break
+        beat_age = (now_ns - int(control.header[GUI_BEAT])) * 1e-9
+        if out.running and beat_age > rt.ENGINE_WATCHDOG_S:
+            out.stop()
+            watchdog = f"GUI heartbeat lost for {beat_age:.1f} s"
+
+        error = watchdog or (repr(out.error) if out.error is not None else None)
+        status = {
+            "ready": True,
+            "simulated": bool(getattr(dac, "simulated", False)),
+            "supports_ai_scan": acq.scanning,
+            "ao_limits": list(getattr(dac, "ao_limits", (0.0, 5.0))),
+            "run_id": run_id,
+            "running": out.running,
+            "control": out.control_status(),
+            "report": out.control_report(),
+            "error": error,
+            "fault": out.fault,
+            "abort": out.abort,
+            "underruns": out.underruns,
+            "timing": out.timing.summary(),
+            "timing_text": out.timing.status_text(),
+            "acq_running": acq.running,
+            "acq_overruns": acq.overruns,
+            "acq_channels": acq.channels,
+            "acq_control_channel": acq.control_channel,
+            "rt_enabled": profile.enabled,
+            "rt_notes": profile.notes,
+            "rt_text": profile.status_text(),
+        }
+        control.write(STATUS, status)
+        profile.collect()
+        time.sleep(poll_s)
+
+
+class EngineProcess:
+    """
+    Runs the DAQ, acquisition and waveform output in a child process
+    (Runtime.ENGINE_PROCESS), so GUI work cannot take the GIL from the
+    output loop.
+
+    Settings and run/stop go to the engine through the ControlBlock;
+    command and measured samples come back through SharedSampleRings. The
+    attributes dac / acq / output / rt_profile are stand-ins shaped like
+    the in-process objects VTCApp otherwise uses. poll() must be called
+    regularly from the GUI: it sends the heartbeat the engine's watchdog
+    expects. If the engine dies, the DAC is reopened here and zeroed.
+    """
+
+    def __init__(self, rt, cal, start_timeout_s=15.0):
+        self.rt = rt
+        ring_n = int(rt.SAMPLE_HZ * rt.AI_RING_SECONDS)
+        self.control = ControlBlock()
+        self.meas_ring = SharedSampleRing(ring_n, rt.SAMPLE_HZ)
+        self.chan_ring = SharedSampleRing(ring_n, rt.SAMPLE_HZ, channels=len(rt.AI_CHANNELS))
+        self.cmd_ring = SharedSampleRing(ring_n, rt.SAMPLE_HZ)
+
+        self.status = {}
+        self._status_version = None
+        self._crash = None
+        self._cmd = {
+            "quit": False,
+            "run": False,
+            "run_id": 0,
+            "mode": "Manual",
+            "params": {},
+            "cal": asdict(cal),
+            "idle_v": 0.0,
+        }
+        self.control.write(COMMAND, self._cmd)
+        self.control.header[GUI_BEAT] = time.monotonic_ns()
+
+        ctx = mp.get_context("spawn")
+        self.proc = ctx.Process(
+            target=engine_main,
+            args=(self.control.name, self.meas_ring.name, self.chan_ring.name, self.cmd_ring.name,
+                  rt, os.getpid()),
+            daemon=True,
+        )
+        self.proc.start()
+
+        try:
+            self.wait_for(lambda s: s.get("ready") or s.get("fatal"), start_timeout_s)
+        except TimeoutError:
+            self.shutdown()
+            raise RuntimeError("Engine process did not start.")
+        if not self.status.get("ready"):
+            reason = self.status.get("fatal") or f"exit code {self.proc.exitcode}"
+            self.shutdown()
+            raise RuntimeError(f"Engine process failed to start: {reason}")
+
+        self.dac = _RemoteDAQ(self)
+        self.acq = _RemoteAcq(self)
+        self.output = _RemoteOutput(self)
+        self.rt_profile = _RemoteRTProfile(self)
+
+    def poll(self):
+        """
+        Send the GUI heartbeat and pick up a new status, if any.
+        """
+        if self.control is None:
+            return self.status
+        self.control.header[GUI_BEAT] = time.monotonic_ns()
+        if self.control.version(STATUS) != self._status_version:
+            version, status = self.control.read(STATUS)
+            if status is not None:
+                self._status_version = version
+                self.status = status
+        return self.status
+
+    def wait_for(self, predicate, timeout_s=2.0):
+        deadline = time.monotonic() + timeout_s
+        while not predicate(self.poll()):
+            if not self.proc.is_alive():
+                self.poll()
+                return
+            if time.monotonic() > deadline:
+                raise TimeoutError
+            time.sleep(0.005)
+
+    def send(self, **changes):
+        changes = {k: v for k, v in changes.items() if self._cmd.get(k) != v}
+        if changes and self.control is not None:
+            self._cmd.update(changes)
+            self.control.write(COMMAND, self._cmd)
+
+    def crashed(self):
+        """
+        Description of an engine failure (process exit or a stalled loop),
+        or None. The DAC is zeroed the first time one is seen.
+        """
+        if self._crash is None:
+            if not self.proc.is_alive():
+                self._crash = f"engine process exited (code {self.proc.exitcode})"
+            else:
+                age = (time.monotonic_ns() - int(self.control.header[ENGINE_BEAT])) * 1e-9
+                if self.status.get("ready") and age > self.rt.ENGINE_WATCHDOG_S:
+                    self.proc.kill()
+                    self.proc.join(timeout=1.0)
+                    self._crash = f"engine process stalled for {age:.1f} s"
+            if self._crash is not None:
+                self._zero_dac()
+        return self._crash
+
+    def _zero_dac(self):
+        try:
+            dac = make_daq(self.rt)
+            dac.connect()
+            dac.write(0.0)
+            dac.close()
+        except Exception:
+            pass
+
+    def shutdown(self):
+        if self.control is None:
+            return
+        self.send(quit=True)
+        self.proc.join(timeout=3.0)
+        if self.proc.is_alive():
+            self.proc.kill()
+            self.proc.join(timeout=1.0)
+        if self.proc.exitcode not in (0, None) and self._crash is None:
+            self._zero_dac()
+        self.meas_ring.close(unlink=True)
+        self.chan_ring.close(unlink=True)
+        self.cmd_ring.close(unlink=True)
+        self.control.close(unlink=True)
+        self.control = None
+
+
+class _RemoteTiming:
+    def __init__(self, engine):
+        self.engine = engine
+
+    def summary(self):
+        return self.engine.status.get("timing", {})
+
+    def status_text(self):
+        return self.engine.status.get("timing_text", "Out: --")
+
+
+class _RemoteOutput:
+    """
+    WaveformOutputWorker stand-in.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.cmd_ring = engine.cmd_ring
+        self.timing = _RemoteTiming(engine)
+
+    def update_settings(self, mode, params, cal):
+        self.engine.send(mode=str(mode), params=dict(params), cal=asdict(cal))
+
+    def start(self):
+        run_id = self.engine._cmd["run_id"] + 1
+        self.engine.send(run=True, run_id=run_id)
+        try:
+            self.engine.wait_for(lambda s: s.get("run_id") == run_id)
+        except TimeoutError:
+            pass
+
+    def stop(self):
+        self.engine.send(run=False)
+        try:
+            self.engine.wait_for(lambda s: not s.get("running"))
+        except TimeoutError:
+            pass
+
+    @property
+    def running(self):
+        return bool(self.engine.status.get("running"))
+
+    @property
+    def error(self):
+        crash = self.engine.crashed()
+        if crash is not None:
+            return RuntimeError(crash)
+        error = self.engine.status.get("error")
+        return RuntimeError(error) if error else None
+
+    @property
+    def fault(self):
+        return self.engine.status.get("fault")
+
+    @property
+    def abort(self):
+        return self.engine.status.get("abort")
+
+    @property
+    def underruns(self):
+        return self.engine.status.get("underruns", 0)
+
+    def control_status(self):
+        return self.engine.status.get("control")
+
+    def control_report(self):
+        return self.engine.status.get("report")
+
+
+class _RemoteAcq:
+    """
+    AcquisitionWorker stand-in; the samples are in the shared ring.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.ring = engine.meas_ring
+        self.channel_ring = engine.chan_ring
+        self.channels = engine.status.get("acq_channels", engine.chan_ring.channels)
+
+    @property
+    def actual_hz(self):
+        return self.ring.sample_hz
+
+    @property
+    def running(self):
+        return bool(self.engine.status.get("acq_running"))
+
+    @property
+    def overruns(self):
+        return self.engine.status.get("acq_overruns", 0)
+
+    @property
+    def control_channel(self):
+        return self.engine.status.get("acq_control_channel")
+
+    def set_calibration(self, cal):
+        self.engine.send(cal=asdict(cal))
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+class _RemoteDAQ:
+    """
+    DAQ stand-in: idle writes set the level the engine holds between runs.
+    """
+
+    supports_ao_scan = True
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.simulated = engine.status.get("simulated", False)
+        self.supports_ai_scan = engine.status.get("supports_ai_scan", False)
+        self.ao_limits = tuple(engine.status.get("ao_limits", (0.0, 5.0)))
+
+    def connect(self):
+        pass
+
+    def write(self, volts: float):
+        self.engine.send(idle_v=float(volts))
+
+    def close(self):
+        self.engine.shutdown()
+
+
+class _RemoteRTProfile:
+    def __init__(self, engine):
+        self.engine = engine
+
+    @property
+    def enabled(self):
+        return bool(self.engine.status.get("rt_enabled"))
+
+    @property
+    def notes(self):
+        return self.engine.status.get("rt_notes", [])
+
+    def status_text(self):
+        return self.engine.status.get("rt_text", "RT: off")
+
+    def collect(self):
+        # The engine process runs its own collections (see _serve)
+        pass
@@ -1,5 +1,22 @@
 # vtc/export_utils.py
-import os, shutil
+import gzip
+import hashlib
+import os
+import threading
+
+from logging_utils import export_csv
+
+CHUNK_BYTES = 4 << 20
+MANIFEST = "SHA256SUMS"
+
+
+class ExportError(RuntimeError):
+    pass
+
+
+class ExportCancelled(Exception):
+    pass
+
 
 def list_usb_mounts():
     candidates = []
@@ -16,12 +33,250 @@ def list_usb_mounts():
                     seen.add(p)
     return candidates
 
-def export_files(dest_dir, files):
+
+def list_runs(log_dir):
+    """
+    Binary run logs in `log_dir`, newest first.
+    """
+    try:
+        names = [n for n in os.listdir(log_dir) if n.startswith("vtc_run_") and n.endswith(".vtclog")]
+    except OSError:
+        return []
+    return [os.path.join(log_dir, n) for n in sorted(names, reverse=True)]
+
+
+def run_files(log_path):
+    """
+    The log and the files written next to it for the same run (plot PNG,
+    resonance / SRS sidecars).
+    """
+    stem = os.path.splitext(log_path)[0]
+    files = [log_path]
+    for suffix in (".png", "_resonance.csv", "_srs.csv"):
+        if os.path.exists(stem + suffix):
+            files.append(stem + suffix)
+    return files
+
+
+class _HashingWriter:
+    """
+    File-like sink that hashes what goes through it (for gzip's fileobj).
+    """
+
+    def __init__(self, f, digest):
+        self.f = f
+        self.digest = digest
+
+    def write(self, data):
+        self.digest.update(data)
+        return self.f.write(data)
+
+    def flush(self):
+        self.f.flush()
+
+
+def _fsync_dir(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _drop_cache(f):
+    # Read the copy back from the drive, not from the page cache
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def copy_verified(src, dst, compress=False, chunk_bytes=CHUNK_BYTES, progress=None, cancelled=None):
+    """
+    Stream `src` to `dst` (gzip-compressed when `compress`) in `chunk_bytes`
+    blocks through a temporary `.part` file, fsync it, read it back and
+    check its content against the SHA-256 of the source, then rename it
+    into place. `progress(n)` is called with the bytes copied and verified,
+    `cancelled()` is checked between blocks. Returns the SHA-256 of the
+    file as stored.
+    """
+    part = dst + ".part"
+    src_hash = hashlib.sha256()
+    out_hash = hashlib.sha256()
+    try:
+        with open(src, "rb") as fi, open(part, "wb") as raw:
+            sink = _HashingWriter(raw, out_hash)
+            # Level 1: the Pi's CPU, not the drive, would otherwise be the limit
+            out = gzip.GzipFile(os.path.basename(src), "wb", 1, sink) if compress else sink
+            while True:
+                if cancelled is not None and cancelled():
+                    raise ExportCancelled()
+                buf = fi.read(chunk_bytes)
+                if not buf:
+                    break
+                src_hash.update(buf)
+                out.write(buf)
+                if progress is not None:
+                    progress(len(buf))
+            if compress:
+                out.close()
+            raw.flush()
+            os.fsync(raw.fileno())
+            _drop_cache(raw)
+
+        check = hashlib.sha256()
+        with (gzip.open(part, "rb") if compress else open(part, "rb")) as f:
+            while True:
+                if cancelled is not None and cancelled():
+                    raise ExportCancelled()
+                buf = f.read(chunk_bytes)
+                if not buf:
+                    break
+                check.update(buf)
+                if progress is not None:
+                    progress(len(buf))
+        if check.digest() != src_hash.digest():
+            raise ExportError(f"{os.path.basename(dst)}: read-back does not match the source")
+        os.replace(part, dst)
+    except BaseException:
+        try:
+            os.remove(part)
+        except OSError:
+            pass
+        raise
+    _fsync_dir(os.path.dirname(dst) or ".")
+    return out_hash.hexdigest()
+
+
+def _write_manifest(dest_dir, digests):
+    """
+    Add / replace entries in the destination's SHA256SUMS (in the format
+    sha256sum -c reads).
+    """
+    path = os.path.join(dest_dir, MANIFEST)
+    entries = {}
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                digest, _, name = line.rstrip("\n").partition("  ")
+                if name:
+                    entries[name] = digest
+    entries.update(digests)
+    with open(path, "w", encoding="utf-8") as f:
+        for name in sorted(entries):
+            f.write(f"{entries[name]}  {name}\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def export_files(dest_dir, files, compress=False):
+    """
+    Copy and verify `files` into `dest_dir` on the calling thread.
+    """
     os.makedirs(dest_dir, exist_ok=True)
+    digests = {}
     copied = []
     for src in files:
         if src and os.path.isfile(src):
-            dst = os.path.join(dest_dir, os.path.basename(src))
-            shutil.copy2(src, dst)
+            dst = os.path.join(dest_dir, os.path.basename(src) + (".gz" if compress else ""))
+            digests[os.path.basename(dst)] = copy_verified(src, dst, compress)
             copied.append(dst)
+    _write_manifest(dest_dir, digests)
+    os.sync()
     return copied
+
+
+class ExportWorker:
+    """
+    Copies run files to a USB drive on a background thread, so the GUI
+    (and MUTE) stays responsive however large the logs are.
+
+    With `csv` set, a CSV copy of each .vtclog is written next to it first
+    (unless an up-to-date one exists). Every file then goes through
+    copy_verified(); the manifest is updated and the drive synced before
+    `state` becomes "DONE". The GUI polls `state`, `status`, `done_bytes`
+    and `total_bytes`; cancel() stops after the current block and leaves
+    no partial file behind.
+    """
+
+    def __init__(self, dest_dir, files, compress=False, csv=False, chunk_bytes=CHUNK_BYTES):
+        self.dest_dir = dest_dir
+        self.files = [f for f in dict.fromkeys(files) if f and os.path.isfile(f)]
+        self.compress = bool(compress)
+        self.csv = bool(csv)
+        self.chunk_bytes = int(chunk_bytes)
+
+        self.state = "IDLE"
+        self.status = ""
+        self.done_bytes = 0
+        self.total_bytes = 0
+        self.exported = []
+        self.error = None
+        self._cancel = threading.Event()
+        self.thread = None
+
+    @property
+    def running(self):
+        return self.state == "RUNNING"
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.state = "RUNNING"
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def fraction(self):
+        return self.done_bytes / self.total_bytes if self.total_bytes else 0.0
+
+    def _progress(self, n):
+        self.done_bytes += n
+
+    def _run(self):
+        try:
+            files = list(self.files)
+            if self.csv:
+                for path in self.files:
+                    if self._cancel.is_set():
+                        raise ExportCancelled()
+                    if path.endswith(".vtclog"):
+                        files.append(self._csv_copy(path))
+
+            os.makedirs(self.dest_dir, exist_ok=True)
+            # Each byte is counted twice: once copied, once read back
+            self.total_bytes = 2 * sum(os.path.getsize(f) for f in files)
+            digests = {}
+            for i, src in enumerate(files, start=1):
+                name = os.path.basename(src) + (".gz" if self.compress else "")
+                self.status = f"{i}/{len(files)} {name}"
+                dst = os.path.join(self.dest_dir, name)
+                digests[name] = copy_verified(src, dst, self.compress, self.chunk_bytes,
+                                              self._progress, self._cancel.is_set)
+                self.exported.append(dst)
+
+            self.status = "Syncing"
+            _write_manifest(self.dest_dir, digests)
+            os.sync()
+            self.status = f"Exported {len(self.exported)} file(s) to {self.dest_dir}"
+            self.state = "DONE"
+        except ExportCancelled:
+            self.status = f"Cancelled after {len(self.exported)} file(s)"
+            self.state = "CANCELLED"
+        except Exception as e:
+            self.error = e
+            self.status = f"Export failed: {e}"
+            self.state = "FAILED"
+
+    def _csv_copy(self, log_path):
+        csv_path = os.path.splitext(log_path)[0] + ".csv"
+        if not os.path.exists(csv_path) or os.path.getmtime(csv_path) < os.path.getmtime(log_path):
+            self.status = f"Converting {os.path.basename(log_path)}"
+            export_csv(log_path, csv_path)
+        return csv_path
+
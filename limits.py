@@ -0,0 +1,173 @@
+# vtc/limits.py
+import numpy as np
+
+from config import AbortLimits
+
+
+def _windowed(x, tail, n):
+    """
+    Sample count, sum and sum of squares over the last `n` samples ending
+    at each sample of `x`, with `tail` the samples that preceded x. NaN
+    samples are left out. Returns (count, s1, s2, new tail).
+    """
+    z = np.concatenate([tail, x])
+    ok = ~np.isnan(z)
+    zz = np.where(ok, z, 0.0)
+    c0 = np.concatenate([[0], np.cumsum(ok)])
+    c1 = np.concatenate([[0.0], np.cumsum(zz)])
+    c2 = np.concatenate([[0.0], np.cumsum(zz * zz)])
+    end = np.arange(len(tail) + 1, len(z) + 1)
+    start = np.maximum(end - n, 0)
+    return (c0[end] - c0[start], c1[end] - c1[start], c2[end] - c2[start],
+            z[max(len(z) - (n - 1), 0):])
+
+
+def _ac_rms(count, s1, s2):
+    mean = s1 / np.maximum(count, 1)
+    return np.sqrt(np.maximum(s2 / np.maximum(count, 1) - mean * mean, 0.0))
+
+
+class AbortMonitor:
+    """
+    Abort limits checked on every sample, one vectorized pass per block.
+
+    check_drive() sees each output block before it is queued: the slew
+    between consecutive drive samples. check_response() sees each block of
+    the measured control signal (g) with the drive played at the same
+    instants: peak |g|, the AC RMS over the last RMS_WINDOW_S at every
+    sample, the ratio of that RMS to the drive's AC RMS over the same
+    window, and runs of lost (NaN) samples. check_stale() catches a
+    feedback stream that stops arriving altogether.
+
+    A check returns None, or (cause, index / time of the first offending
+    sample). A limit of 0 disables its check.
+    """
+
+    def __init__(self, cfg=None, sample_hz=5000.0):
+        self.cfg = cfg or AbortLimits()
+        self.reset(sample_hz)
+
+    def reset(self, sample_hz=None, now=None, total=0):
+        if sample_hz is not None:
+            self.sample_hz = float(sample_hz)
+        self.window = max(2, int(round(self.cfg.RMS_WINDOW_S * self.sample_hz)))
+        self._g_tail = np.zeros(0)
+        self._v_tail = np.zeros(0)
+        self._last_v = None
+        self._nan_run = 0
+        self._seen_total = total
+        self._seen_t = now
+
+    @property
+    def enabled(self):
+        return bool(self.cfg.ENABLE)
+
+    def check_drive(self, v):
+        """
+        Slew limit on a block of drive volts about to be output.
+        Returns None or (cause, index into v).
+        """
+        lim = self.cfg.SLEW_V_PER_S
+        v = np.asarray(v, dtype=float)
+        if not len(v):
+            return None
+        prev = self._last_v
+        self._last_v = float(v[-1])
+        if not (self.enabled and lim > 0.0):
+            return None
+        step = np.abs(np.diff(v if prev is None else np.concatenate([[prev], v])))
+        bad = np.flatnonzero(step * self.sample_hz > lim)
+        if not len(bad):
+            return None
+        i = int(bad[0])
+        # step[i] ends at v[i] when the previous block's last sample leads
+        return (f"drive slew {step[i] * self.sample_hz:.0f} V/s > {lim:g} V/s",
+                i + 1 if prev is None else i)
+
+    def check_response(self, t, g, drive_v):
+        """
+        Response limits on a block of control-signal samples `g` (times
+        `t`) and the drive `drive_v` output at the same instants.
+        Returns None or (cause, time of the first offending sample).
+        """
+        g = np.asarray(g, dtype=float)
+        if not len(g):
+            return None
+        cfg = self.cfg
+        lost = np.isnan(g)
+        run = self._lost_run(lost)
+        if not self.enabled:
+            return None
+        found = []
+
+        if cfg.PEAK_G > 0.0:
+            bad = np.flatnonzero(np.abs(g) > cfg.PEAK_G)
+            if len(bad):
+                i = int(bad[0])
+                found.append((i, f"peak {abs(g[i]):.2f} g > {cfg.PEAK_G:g} g"))
+
+        n = self.window
+        cg, g1, g2, self._g_tail = _windowed(g, self._g_tail, n)
+        full = cg >= n // 2
+        rms = _ac_rms(cg, g1, g2)
+        if cfg.RMS_G > 0.0:
+            bad = np.flatnonzero(full & (rms > cfg.RMS_G))
+            if len(bad):
+                i = int(bad[0])
+                found.append((i, f"RMS {rms[i]:.2f} g > {cfg.RMS_G:g} g "
+                                 f"over {cfg.RMS_WINDOW_S * 1e3:.0f} ms"))
+
+        drive_v = np.asarray(drive_v, dtype=float)
+        cv, v1, v2, self._v_tail = _windowed(drive_v, self._v_tail, n)
+        if cfg.RATIO_G_PER_V > 0.0:
+            v_rms = _ac_rms(cv, v1, v2)
+            live = full & (cv >= n // 2) & (v_rms >= cfg.RATIO_MIN_DRIVE_V)
+            ratio = np.where(live, rms / np.maximum(v_rms, 1e-12), 0.0)
+            bad = np.flatnonzero(ratio > cfg.RATIO_G_PER_V)
+            if len(bad):
+                i = int(bad[0])
+                found.append((i, f"response/drive {ratio[i]:.1f} g/V > {cfg.RATIO_G_PER_V:g} g/V"))
+
+        limit = int(cfg.FEEDBACK_TIMEOUT_S * self.sample_hz)
+        if cfg.FEEDBACK_TIMEOUT_S > 0.0 and run is not None and run[0] > limit:
+            found.append((run[1], f"feedback lost for {run[0] / self.sample_hz * 1e3:.0f} ms"))
+
+        if not found:
+            return None
+        i, cause = min(found)
+        return cause, float(t[i])
+
+    def _lost_run(self, lost):
+        """
+        Longest run of lost samples, counting the run carried over from
+        earlier blocks: (length, index where it ends in this block) or None.
+        """
+        if not lost.any():
+            self._nan_run = 0
+            return None
+        good = np.flatnonzero(~lost)
+        if not len(good):
+            self._nan_run += len(lost)
+            return self._nan_run, len(lost) - 1
+        runs = [(self._nan_run + int(good[0]), max(int(good[0]) - 1, 0))]
+        gaps = np.diff(good) - 1
+        if len(gaps) and gaps.max() > 0:
+            k = int(np.argmax(gaps))
+            runs.append((int(gaps[k]), int(good[k + 1]) - 1))
+        self._nan_run = len(lost) - 1 - int(good[-1])
+        runs.append((self._nan_run, len(lost) - 1))
+        return max(runs)
+
+    def check_stale(self, now, total):
+        """
+        Feedback that stops arriving: the ring's `total` has not moved for
+        FEEDBACK_TIMEOUT_S. Returns None or (cause, time the timeout ran out).
+        """
+        if self._seen_t is None or total != self._seen_total:
+            self._seen_total = total
+            self._seen_t = now
+            return None
+        lim = self.cfg.FEEDBACK_TIMEOUT_S
+        if not (self.enabled and lim > 0.0) or now - self._seen_t <= lim:
+            return None
+        return f"no feedback for {(now - self._seen_t) * 1e3:.0f} ms", self._seen_t + lim
@@ -1,7 +1,9 @@
 # vtc/logging_utils.py
-import csv, os, time
+import csv, json, os, queue, threading, time
 from datetime import datetime
 
+import numpy as np
+
 class CSVLogger:
     def __init__(self, folder, filename_prefix="vtc_run"):
         os.makedirs(folder, exist_ok=True)
@@ -14,6 +16,18 @@ class CSVLogger:
 
     def write(self, t, cmd_v, meas_v, flush_interval_s=1.0):
         self.w.writerow([f"{t:.6f}", f"{cmd_v:.6f}", f"{meas_v:.6f}"])
+        self._maybe_flush(flush_interval_s)
+
+    def write_block(self, t, cmd_v, meas_v, flush_interval_s=1.0):
+        """
+        Write one row per sample. Arguments are arrays or scalars and are
+        broadcast against each other.
+        """
+        cols = np.broadcast_arrays(t, cmd_v, meas_v)
+        self.w.writerows(zip(*(np.char.mod("%.6f", c) for c in cols)))
+        self._maybe_flush(flush_interval_s)
+
+    def _maybe_flush(self, flush_interval_s):
         now = time.time()
         if now - self.last_flush > flush_interval_s:
             self.f.flush()
@@ -26,3 +40,254 @@ class CSVLogger:
             os.fsync(self.f.fileno())
         finally:
             self.f.close()
+
+
+# --- Binary run logs ---
+#
+# File layout:
+#   MAGIC (8 bytes)
+#   JSON metadata header, space-padded to HEADER_BYTES
+#   data: fixed-size chunks of CHUNK_ROWS rows, stored column by column
+#         (t_s float64, cmd_v float32, meas_g float32 control signal, then
+#         ch0_g, ch1_g, ... float32 when more than one AI channel is logged)
+#
+# Every chunk has the same size, so the data section maps directly onto a
+# numpy.memmap of the chunk dtype built from the header's "columns". The
+# last chunk is NaN-padded; the header's "rows" field holds the true row
+# count once the log is closed. Version 1 logs have meas_v (volts) in
+# place of meas_g and no channel columns.
+
+MAGIC = b"VTCLOG1\n"
+HEADER_BYTES = 65536
+CHUNK_ROWS = 4096
+COLUMNS = [("t_s", "<f8"), ("cmd_v", "<f4"), ("meas_g", "<f4")]
+DATA_OFFSET = len(MAGIC) + HEADER_BYTES
+
+
+def log_columns(channels=1):
+    """
+    Column list of a log with `channels` AI channels.
+    """
+    if channels <= 1:
+        return list(COLUMNS)
+    return COLUMNS + [(f"ch{i}_g", "<f4") for i in range(channels)]
+
+
+def chunk_dtype(columns, chunk_rows=CHUNK_ROWS):
+    return np.dtype([(name, dt, (chunk_rows,)) for name, dt in columns])
+
+
+class BinaryLogger:
+    """
+    Chunked binary run log with a background writer thread.
+
+    write()/write_block() only put arrays on a queue, so the caller (the Qt
+    thread) never formats, writes or fsyncs. The writer thread packs rows
+    into column chunks and fsyncs at most once per `fsync_interval_s` for
+    everything written since the last one. If the queue is full the block
+    is dropped and counted in `dropped_blocks`. With channels > 1 each
+    block also carries the per-channel responses.
+    """
+
+    def __init__(self, folder, filename_prefix="vtc_run", metadata=None,
+                 fsync_interval_s=1.0, max_queue=1000, channels=1):
+        os.makedirs(folder, exist_ok=True)
+        ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.path = os.path.join(folder, f"{filename_prefix}_{ts}.vtclog")
+        self.fsync_interval_s = float(fsync_interval_s)
+        self.columns = log_columns(channels)
+        self.channels = max(1, int(channels))
+
+        self.metadata = {
+            "format": "vtclog",
+            "version": 2,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "columns": [{"name": n, "dtype": d} for n, d in self.columns],
+            "chunk_rows": CHUNK_ROWS,
+            "data_offset": DATA_OFFSET,
+            "rows": None,
+        }
+        self.metadata.update(metadata or {})
+
+        self.rows = 0
+        self.dropped_blocks = 0
+        self.error = None
+        self._meta_lock = threading.Lock()
+        self._chunk = np.zeros(1, dtype=chunk_dtype(self.columns))[0]
+        self._fill = 0
+
+        self.f = open(self.path, "wb")
+        self.f.write(MAGIC)
+        self._write_header()
+
+        self._q = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    # --- caller side ---
+
+    def write(self, t, cmd_v, meas_g, channels_g=None):
+        self.write_block(t, cmd_v, meas_g, channels_g)
+
+    def write_block(self, t, cmd_v, meas_g, channels_g=None):
+        """
+        Queue one block of rows. Arguments are arrays or scalars and are
+        broadcast against each other; `channels_g` is (n, channels) and
+        only used (and then required) by a multi-channel log.
+        """
+        cols = [
+            np.asarray(t, dtype=np.float64),
+            np.asarray(cmd_v, dtype=np.float32),
+            np.asarray(meas_g, dtype=np.float32),
+        ]
+        if self.channels > 1:
+            cols += list(np.asarray(channels_g, dtype=np.float32).T)
+        cols = np.broadcast_arrays(*cols)
+        try:
+            self._q.put_nowait(tuple(np.atleast_1d(c) for c in cols))
+        except queue.Full:
+            self.dropped_blocks += 1
+
+    def update_metadata(self, **items):
+        """
+        Merge items into the JSON header; it is rewritten on close().
+        """
+        with self._meta_lock:
+            self.metadata.update(items)
+
+    def close(self):
+        self._q.put(None)
+        self._thread.join()
+        try:
+            if self._fill:
+                for name, _ in self.columns:
+                    self._chunk[name][self._fill:] = np.nan
+                self.f.write(self._chunk.tobytes())
+            self.metadata["rows"] = self.rows
+            self.metadata["dropped_blocks"] = self.dropped_blocks
+            self._write_header()
+            self.f.flush()
+            os.fsync(self.f.fileno())
+        finally:
+            self.f.close()
+
+    # --- writer thread ---
+
+    def _write_header(self):
+        with self._meta_lock:
+            raw = json.dumps(self.metadata, default=str).encode()
+        if len(raw) > HEADER_BYTES:
+            raise ValueError("Log metadata does not fit in the header")
+        pos = self.f.tell()
+        self.f.seek(len(MAGIC))
+        self.f.write(raw.ljust(HEADER_BYTES, b" "))
+        if pos > DATA_OFFSET:
+            self.f.seek(pos)
+
+    def _append(self, *cols):
+        i = 0
+        n = len(cols[0])
+        while i < n:
+            k = min(n - i, CHUNK_ROWS - self._fill)
+            sl = slice(self._fill, self._fill + k)
+            for (name, _), col in zip(self.columns, cols):
+                self._chunk[name][sl] = col[i:i + k]
+            self._fill += k
+            i += k
+            if self._fill == CHUNK_ROWS:
+                self.f.write(self._chunk.tobytes())
+                self._fill = 0
+        self.rows += n
+
+    def _run(self):
+        last_sync = time.time()
+        done = False
+        while not done:
+            item = self._q.get()
+            # Group commit: drain everything queued, then one fsync
+            while True:
+                if item is None:
+                    done = True
+                    break
+                if self.error is None:
+                    try:
+                        self._append(*item)
+                    except OSError as e:
+                        # Keep draining so callers never block on a dead writer
+                        self.error = e
+                try:
+                    item = self._q.get_nowait()
+                except queue.Empty:
+                    break
+            now = time.time()
+            if self.error is None and not done and now - last_sync > self.fsync_interval_s:
+                try:
+                    self.f.flush()
+                    os.fsync(self.f.fileno())
+                except OSError as e:
+                    self.error = e
+                last_sync = now
+
+
+class BinaryLogReader:
+    """
+    Read-only view of a binary run log. The data section is a numpy.memmap
+    of chunk records laid out as the header's "columns" say, so only the
+    chunks actually read are paged in.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a vtclog file")
+            self.header = json.loads(f.read(HEADER_BYTES).decode().rstrip())
+
+        self.columns = [(c["name"], c["dtype"]) for c in self.header["columns"]]
+        dtype = chunk_dtype(self.columns)
+        n_chunks = (os.path.getsize(path) - DATA_OFFSET) // dtype.itemsize
+        self.chunks = np.memmap(path, dtype=dtype, mode="r",
+                                offset=DATA_OFFSET, shape=(max(n_chunks, 0),))
+
+        rows = self.header.get("rows")
+        if rows is None:
+            # Not closed cleanly: trust complete chunks, trim NaN padding
+            rows = n_chunks * CHUNK_ROWS
+            if n_chunks:
+                rows -= int(np.count_nonzero(np.isnan(self.chunks[-1]["t_s"])))
+        self.rows = min(int(rows), n_chunks * CHUNK_ROWS)
+
+    def __len__(self):
+        return self.rows
+
+    def read(self, start=0, stop=None, columns=None):
+        """
+        Return {column: array} for rows [start, stop).
+        """
+        stop = self.rows if stop is None else min(int(stop), self.rows)
+        start = max(0, min(int(start), stop))
+        names = columns or [n for n, _ in self.columns]
+        c0, c1 = start // CHUNK_ROWS, -(-stop // CHUNK_ROWS)
+        lo = start - c0 * CHUNK_ROWS
+        hi = lo + (stop - start)
+        return {n: self.chunks[c0:c1][n].reshape(-1)[lo:hi] for n in names}
+
+    def iter_blocks(self, rows_per_block=CHUNK_ROWS * 16, columns=None):
+        for start in range(0, self.rows, rows_per_block):
+            yield self.read(start, start + rows_per_block, columns)
+
+
+def export_csv(log_path, csv_path=None):
+    """
+    Convert a binary log to CSV (one column per log column: t_s, cmd_v,
+    meas_g, ...), block by block.
+    """
+    csv_path = csv_path or os.path.splitext(log_path)[0] + ".csv"
+    reader = BinaryLogReader(log_path)
+    names = [n for n, _ in reader.columns]
+    with open(csv_path, "w", newline="") as f:
+        f.write(",".join(names) + "\n")
+        for blk in reader.iter_blocks():
+            np.savetxt(f, np.column_stack([blk[n] for n in names]),
+                       fmt="%.6f", delimiter=",")
+    return csv_path
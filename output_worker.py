@@ -0,0 +1,485 @@
+# vtc/output_worker.py
+import threading
+import time
+from dataclasses import dataclass, replace
+from types import MappingProxyType
+from typing import Mapping
+
+import numpy as np
+
+from config import Calibration
+from acquisition import SampleRing
+from limits import AbortMonitor
+from timing import LoopTiming
+import waveform as wf
+
+DEFAULT_PARAMS = {
+    "manual": 2.5,
+    "amp": 2.0,
+    "freq": 10.0,
+    "dc": 2.5,
+    "f_start": 0.5,
+    "f_end": 50.0,
+    "dur": 10.0,
+    "noise": 0.2,
+    "shock_t0": 1.0,
+    "shock_peak": 4.5,
+    "shock_tau": 0.02,
+    "closed_loop": False,
+    "target_g": 0.5,
+    "res_peak": 0,
+}
+
+
+@dataclass(frozen=True)
+class ParamSnapshot:
+    """
+    One immutable, versioned set of output settings. The GUI publishes a
+    new snapshot when a setting changes; the output thread picks it up by
+    reading a single reference, so neither side takes a lock.
+    """
+    version: int
+    mode: str
+    params: Mapping
+    cal: Calibration
+
+
+class WaveformOutputWorker:
+    """
+    High-rate waveform output loop, separate from the Qt GUI timer.
+
+    If the DAQ supports hardware-paced AO scans, the worker keeps the
+    device's circular buffer topped up in half-buffer blocks and the sample
+    rate comes from the DAQ clock. Otherwise it falls back to writing one
+    sample at a time, paced with time.sleep.
+
+    Loop timing (tick lateness, overruns, stalls, achieved rate, DAC call
+    latency) is collected in `timing`; a DAC error stops the loop and is
+    kept in `error`. An optional RTProfile is applied to the output thread
+    and supplies the deadline wait.
+
+    Settings arrive as ParamSnapshots; amplitude, DC and frequency changes
+    are ramped over `ramp_s` by the generators.
+
+    Abort limits (AbortMonitor) are checked on every drive block before it
+    is queued and on every new block of feedback. A trip sets `fault` to
+    its cause and replaces the drive with a ramp from its current level to
+    0 V over RAMP_DOWN_S: in a scan, the samples already queued beyond
+    GUARD_S of the DAC are rewritten. The loop ends once the ramp has
+    played; `abort` then reports the cause and the measured latency.
+    """
+
+    def __init__(self, dac, sample_hz=5000, buffer_samples=1000, feedback=None,
+                 history_s=10.0, rt_profile=None, cmd_ring=None, ramp_s=0.0, limits=None):
+        self.dac = dac
+        self.rt_profile = rt_profile
+        self.sample_hz = max(1, int(sample_hz))
+        self.dt = 1.0 / self.sample_hz
+
+        # The refill logic works in halves, so keep the buffer length even
+        self.buffer_samples = max(2, int(buffer_samples) // 2 * 2)
+        self.streaming = bool(getattr(dac, "supports_ao_scan", False))
+        self.actual_hz = float(self.sample_hz)
+        self.underruns = 0
+        self.timing = LoopTiming(self.dt)
+        self.error = None
+
+        self.running = False
+        self.thread = None
+
+        self.start_time = None
+        self.last_queued = 0.0     # newest sample handed to the DAC
+
+        self.ramp_s = float(ramp_s)
+        self.gen = None
+        self.gen_key = None
+        self._gen_version = None
+
+        # Every output sample, timestamped with the time the DAC plays it,
+        # for consumers that need the drive alongside the response
+        if cmd_ring is None:
+            cmd_ring = SampleRing(self.sample_hz * history_s, self.sample_hz)
+        self.cmd_ring = cmd_ring
+
+        # Measured-response SampleRing for closed-loop generators and the
+        # abort limits, each reading through its own subscription
+        self.feedback = feedback
+        self._fb_sub = feedback.subscribe() if feedback is not None else None
+
+        self.limits = AbortMonitor(limits, self.sample_hz)
+        self._lim_sub = feedback.subscribe() if feedback is not None else None
+        self._ramp = None
+        self.fault = None
+        self.abort = None
+
+        self.settings = ParamSnapshot(0, "Manual", MappingProxyType(dict(DEFAULT_PARAMS)),
+                                      Calibration())
+
+    def update_settings(self, mode, params, cal):
+        """
+        Publish a new settings snapshot (call from one thread only).
+        """
+        self.settings = ParamSnapshot(
+            version=self.settings.version + 1,
+            mode=str(mode),
+            params=MappingProxyType(dict(params)),
+            cal=replace(cal),
+        )
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.underruns = 0
+        self.error = None
+        self.fault = None
+        self.abort = None
+        self._ramp = None
+        self.gen = None
+        self.start_time = time.perf_counter()
+        self.thread = threading.Thread(target=self._thread_main, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        # An abort ramp in progress ends the loop by itself once played
+        if self._ramp is None:
+            self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout=1.0)
+            self.thread = None
+        try:
+            self.dac.write(0.0)
+        except Exception:
+            pass
+
+    def _render_block(self, n):
+        """
+        Compute the next `n` calibrated output samples as one array.
+        A mode change (or toggling closed-loop control) starts a fresh
+        generator; a new snapshot is handed to the current one so its
+        phase carries on and its settings ramp.
+        """
+        snap = self.settings
+        p = snap.params
+        cal = snap.cal
+
+        key = wf.generator_key(snap.mode, p)
+        if self.gen is None or key != self.gen_key:
+            self.gen = wf.make_generator(snap.mode, p, self.actual_hz, self.ramp_s)
+            self.gen_key = key
+            self._gen_version = snap.version
+            if self._fb_sub is not None:
+                self._fb_sub.seek()
+        else:
+            if snap.version != self._gen_version:
+                self.gen.update(p)
+                self._gen_version = snap.version
+            self._feed_back()
+
+        lo, hi = getattr(self.dac, "ao_limits", (0.0, 5.0))
+        if getattr(self.gen, "calibrated", False):
+            # Pre-rendered profile: already calibrated DAC volts. Still
+            # clipped, so a stale or unvalidated file cannot leave the AO
+            # range (the block may be a read-only view of the file).
+            return np.clip(self.gen.render(n), lo, hi)
+        out = cal.DAC_OFFSET + cal.DAC_SCALE * self.gen.render(n)
+        return np.clip(out, lo, hi, out=out)
+
+    def _feed_back(self):
+        """
+        Hand the measured response (control signal, g) since the last
+        block to a closed-loop generator. Blocks containing lost samples
+        are skipped. Generators with observe_pair() instead get the
+        response together with the drive that was output at the same
+        instants (from cmd_ring), with lost samples left as NaN.
+        """
+        pair = hasattr(self.gen, "observe_pair")
+        if self.feedback is None or not (pair or hasattr(self.gen, "observe")):
+            return
+        block, _ = self._fb_sub.poll()
+        if not len(block.v):
+            return
+        if pair:
+            self.gen.observe_pair(block.t, self.cmd_ring.sample_at(block.t), block.v)
+        elif not np.isnan(block.v).any():
+            self.gen.observe(block.v)
+
+    def control_status(self):
+        """
+        Status string of a closed-loop generator, or None in open-loop modes.
+        """
+        return getattr(self.gen, "status", None)
+
+    def control_report(self):
+        """
+        Summary dict from generators that produce one (resonance search),
+        else None.
+        """
+        report = getattr(self.gen, "report", None)
+        return report() if report is not None else None
+
+    def _reset_limits(self):
+        now = time.perf_counter()
+        total = self.feedback.total if self.feedback is not None else 0
+        self.limits.reset(self.actual_hz, now, total)
+        if self._lim_sub is not None:
+            self._lim_sub.seek(total)
+
+    def _check_feedback(self, now):
+        """
+        Response limits on the feedback that arrived since the last call.
+        Returns None or (cause, time of the offending sample).
+        """
+        if self.feedback is None or not self.limits.enabled:
+            return None
+        block, _ = self._lim_sub.poll()
+        found = None
+        if len(block.v):
+            drive = self.cmd_ring.sample_at(block.t)
+            # Before the run started the output was held at 0 V
+            drive[block.t < self.cmd_ring.t_origin] = 0.0
+            found = self.limits.check_response(block.t, block.v, drive)
+        return found or self.limits.check_stale(now, self.feedback.total)
+
+    def _trip(self, cause, level, start, t_bad=None, i_bad=None):
+        """
+        Start the abort ramp from `level` volts at absolute output sample
+        `start`. The offending sample is given by time (response) or by
+        output sample index (drive).
+        """
+        ramp_n = max(1, int(round(self.limits.cfg.RAMP_DOWN_S * self.actual_hz)))
+        self._ramp = {"level": float(level), "k": 0, "n": ramp_n, "start": int(start),
+                      "t_bad": t_bad, "i_bad": i_bad, "t_detect": time.perf_counter()}
+        self.fault = cause
+
+    def _ramp_block(self, n):
+        r = self._ramp
+        k = r["k"] + 1 + np.arange(n)
+        r["k"] += n
+        return r["level"] * np.clip(1.0 - k / r["n"], 0.0, 1.0)
+
+    def _next_block(self, n):
+        """
+        The next `n` output samples: rendered and slew-checked, or the
+        abort ramp once one has started.
+        """
+        if self._ramp is not None:
+            return self._ramp_block(n)
+        block = self._render_block(n)
+        found = self.limits.check_drive(block)
+        if found is None:
+            return block
+        cause, i = found
+        start = self.cmd_ring.total
+        self._trip(cause, self.last_queued, start, i_bad=start + i)
+        return self._ramp_block(n)
+
+    def _abort_queued(self, view, pos, written, cause, t_bad):
+        """
+        Response trip during a scan: rewrite the queued samples from GUARD_S
+        ahead of the DAC position with the ramp (at most two writes, around
+        the buffer wrap) and mirror them in cmd_ring.
+        """
+        n = len(view)
+        guard = max(1, int(np.ceil(self.limits.cfg.GUARD_S * self.actual_hz)))
+        start = min(pos + guard, written)
+        self._trip(cause, view[(start - 1) % n], start, t_bad=t_bad)
+        if start >= written:
+            return
+        ramp = self._ramp_block(written - start)
+        i = start
+        while i < written:
+            a = i % n
+            m = min(written - i, n - a)
+            self.dac.write_ao_block(a, ramp[i - start:i - start + m])
+            i += m
+        self.cmd_ring.rewrite(start, ramp)
+
+    def _finish_abort(self):
+        """
+        Fill in `abort` from the output timeline in cmd_ring.
+        """
+        r = self._ramp
+        fs = self.cmd_ring.sample_hz
+        t_ramp = self.cmd_ring.t_origin + r["start"] / fs
+        t_bad = r["t_bad"]
+        if t_bad is None:
+            t_bad = self.cmd_ring.t_origin + r["i_bad"] / fs
+        # A drive trip replaces the offending sample before it is played
+        latency = max(t_ramp - t_bad, 0.0)
+        self.abort = {
+            "cause": self.fault,
+            "level_v": r["level"],
+            "detect_ms": max(r["t_detect"] - t_bad, 0.0) * 1e3,
+            "latency_ms": latency * 1e3,
+            "zero_ms": (latency + r["n"] / fs) * 1e3,
+        }
+
+    def _thread_main(self):
+        if self.rt_profile is not None:
+            self.rt_profile.enter_thread()
+        try:
+            if self.streaming:
+                self._run_stream()
+            else:
+                self._run()
+        finally:
+            if self.rt_profile is not None:
+                self.rt_profile.exit_thread()
+
+    def _wait_until(self, deadline):
+        if self.rt_profile is not None:
+            self.rt_profile.wait_until(deadline)
+        else:
+            time.sleep(max(0.0, deadline - time.perf_counter()))
+
+    def _run_stream(self):
+        n = self.buffer_samples
+        half = n // 2
+
+        try:
+            view = self.dac.create_ao_buffer(n)
+            self.cmd_ring.reset(self.sample_hz, time.perf_counter())
+            self._reset_limits()
+            self.last_queued = 0.0
+            block = self._next_block(n)
+            self.dac.write_ao_block(0, block)
+            t_origin = time.perf_counter()
+            self.actual_hz = self.dac.start_ao_scan(self.sample_hz)
+            self.cmd_ring.reset(self.actual_hz, t_origin)
+            self.cmd_ring.push(view[:n])
+            self.last_queued = float(view[n - 1])
+        except Exception as e:
+            self.error = e
+            self.running = False
+
+        # Samples [pos, written) are queued in the buffer but not yet output.
+        # Whenever the device crosses into the second-to-last queued half,
+        # the half it just left is refilled.
+        written = n
+        poll_s = half / self.actual_hz / 4.0
+
+        # A tick is one poll, due poll_s after the previous one; it overruns
+        # when the gap eats more than the half-buffer refill slack.
+        timing = self.timing
+        timing.reset(poll_s, overrun_s=half / self.actual_hz - poll_s)
+        deadline = time.perf_counter()
+
+        while self.running:
+            try:
+                t_call = time.perf_counter()
+                timing.tick(t_call, deadline)
+                pos = self.dac.ao_scan_position()
+                now = time.perf_counter()
+                timing.dac_call(now - t_call)
+                timing.delivered(pos, now)
+
+                if pos >= written:
+                    # The device has replayed stale samples; resync on the
+                    # half after the one it is in now.
+                    self.underruns += 1
+                    resync = (pos // half + 1) * half
+                    self.cmd_ring.skip(resync - written)
+                    written = resync
+                timing.margin((written - pos) / self.actual_hz)
+
+                if self._ramp is None:
+                    found = self._check_feedback(now)
+                    if found is not None:
+                        self._abort_queued(view, pos, written, *found)
+
+                while written - pos <= half:
+                    block = self._next_block(half)
+                    t_call = time.perf_counter()
+                    self.dac.write_ao_block(written % n, block)
+                    timing.dac_call(time.perf_counter() - t_call)
+                    self.cmd_ring.push(view[written % n:written % n + half])
+                    written += half
+                    self.last_queued = float(view[(written - 1) % n])
+
+                if self._ramp is not None and pos >= self._ramp["start"] + self._ramp["n"]:
+                    # Ramp played: the drive is at 0 V
+                    self.running = False
+                    break
+            except Exception as e:
+                self.error = e
+                self.running = False
+                break
+
+            deadline = time.perf_counter() + poll_s
+            self._wait_until(deadline)
+
+        if self._ramp is not None:
+            self._finish_abort()
+        try:
+            self.dac.stop_ao_scan()
+        except Exception:
+            pass
+        try:
+            self.dac.write(0.0)
+        except Exception:
+            pass
+
+    def _run(self):
+        # Fallback for DAQs without AO scans: render 10 ms blocks and pace
+        # the individual writes with time.sleep.
+        chunk = max(1, self.sample_hz // 100)
+        next_tick = time.perf_counter()
+        self.cmd_ring.reset(self.sample_hz, next_tick)
+        timing = self.timing
+        timing.reset(self.dt)
+        self._reset_limits()
+        self.last_queued = 0.0
+        sent = 0
+
+        while self.running:
+            if self._ramp is not None and self._ramp["k"] >= self._ramp["n"]:
+                # Ramp played: the drive is at 0 V
+                self.running = False
+                break
+            try:
+                if self._ramp is None:
+                    found = self._check_feedback(time.perf_counter())
+                    if found is not None:
+                        self._trip(found[0], self.last_queued, self.cmd_ring.total, t_bad=found[1])
+                block = self._next_block(chunk)
+            except Exception as e:
+                self.error = e
+                self.running = False
+                break
+            self.cmd_ring.push(block)
+            self.last_queued = float(block[-1])
+
+            for out_v in block:
+                t_call = time.perf_counter()
+                timing.tick(t_call, next_tick)
+                try:
+                    self.dac.write(out_v)
+                except Exception as e:
+                    self.error = e
+                    self.running = False
+                    break
+                now = time.perf_counter()
+                timing.dac_call(now - t_call)
+                sent += 1
+                timing.delivered(sent, now)
+
+                next_tick += self.dt
+                sleep_time = next_tick - now
+
+                if sleep_time > 0:
+                    self._wait_until(next_tick)
+                elif sleep_time < -self.dt:
+                    # More than a sample behind: give up on the missed
+                    # ticks rather than bursting to catch up
+                    next_tick = time.perf_counter()
+
+                if not self.running:
+                    break
+
+        if self._ramp is not None:
+            self._finish_abort()
+        try:
+            self.dac.write(0.0)
+        except Exception:
+            pass
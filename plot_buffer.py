@@ -0,0 +1,128 @@
+# vtc/plot_buffer.py
+import numpy as np
+
+
+class DoubledRing:
+    """
+    Preallocated ring of fixed-width rows that always hands out the newest
+    `n` rows as one contiguous numpy view (no copy).
+
+    Every row is stored twice, at i and i + capacity, so the most recent
+    rows never wrap in the doubled buffer.
+    """
+
+    def __init__(self, capacity, columns):
+        self.capacity = max(1, int(capacity))
+        self.data = np.full((columns, 2 * self.capacity), np.nan)
+        self.total = 0
+
+    def clear(self):
+        self.total = 0
+
+    def push(self, block):
+        """
+        Append a (columns, n) block.
+        """
+        block = np.asarray(block, dtype=float)
+        n = block.shape[1]
+        if n > self.capacity:
+            block = block[:, -self.capacity:]
+            self.total += n - self.capacity
+            n = self.capacity
+        if n == 0:
+            return
+        start = self.total % self.capacity
+        first = min(n, self.capacity - start)
+        for off in (0, self.capacity):
+            self.data[:, off + start:off + start + first] = block[:, :first]
+        rest = n - first
+        if rest:
+            self.data[:, :rest] = block[:, first:]
+            self.data[:, self.capacity:self.capacity + rest] = block[:, first:]
+        self.total += n
+
+    def view(self, n):
+        """
+        The newest min(n, stored) rows as a (columns, n) view.
+        """
+        n = min(int(n), self.total, self.capacity)
+        end = self.total % self.capacity + self.capacity
+        return self.data[:, end - n:end]
+
+
+class LivePlotBuffer:
+    """
+    Live-plot history with peak-preserving min/max decimation.
+
+    Raw samples go into a DoubledRing sized for the longest window. For the
+    selected window and plot width, samples are also folded incrementally
+    into fixed-size bins holding (t, min, max) per channel, so a redraw
+    never touches more than ~2 points per pixel however high the sample
+    rate. Short windows that already fit the pixel budget are drawn from
+    the raw ring directly.
+    """
+
+    def __init__(self, sample_hz, max_seconds=60.0, channels=2):
+        self.sample_hz = float(sample_hz)
+        self.channels = int(channels)
+        self.raw = DoubledRing(self.sample_hz * max_seconds, 1 + self.channels)
+
+        self.window_s = float(max_seconds)
+        self.width = 500
+        self._configure()
+
+    def clear(self):
+        self.raw.clear()
+        self._configure()
+
+    def set_view(self, window_s=None, width_px=None):
+        """
+        Change the time window and/or pixel width; re-bins the history.
+        """
+        if window_s is not None:
+            self.window_s = float(window_s)
+        if width_px is not None:
+            self.width = max(10, int(width_px))
+        self._configure()
+
+    def _configure(self):
+        window_n = self.window_s * self.sample_hz
+        self.bin_n = int(np.ceil(window_n / self.width))
+        self.bins = None
+        self._partial = None
+        if self.bin_n > 2:
+            self.bins = DoubledRing(self.width + 1, 1 + 2 * self.channels)
+            self._partial = np.zeros((1 + self.channels, 0))
+            self._fill_bins(self.raw.view(window_n))
+
+    def push(self, t, *values):
+        block = np.vstack(np.broadcast_arrays(t, *values))
+        self.raw.push(block)
+        if self.bins is not None:
+            self._fill_bins(block)
+
+    def _fill_bins(self, block):
+        block = np.concatenate([self._partial, block], axis=1)
+        k = self.bin_n
+        whole = block.shape[1] // k * k
+        if whole:
+            full = block[:, :whole].reshape(block.shape[0], -1, k)
+            t = full[0, :, 0]
+            vals = full[1:]
+            row = np.concatenate([t[None], vals.min(axis=2), vals.max(axis=2)])
+            self.bins.push(row)
+        self._partial = block[:, whole:].copy()
+
+    def curves(self):
+        """
+        Return (x, [y per channel]) ready for PlotDataItem.setData().
+        """
+        if self.bins is None:
+            v = self.raw.view(self.window_s * self.sample_hz)
+            return v[0], list(v[1:])
+
+        b = self.bins.view(self.width)
+        x = np.repeat(b[0], 2)
+        c = self.channels
+        ys = [np.column_stack([b[1 + i], b[1 + c + i]]).ravel() for i in range(c)]
+        return x, ys
@@ -0,0 +1,274 @@
+# vtc/random_control.py
+import numpy as np
+
+from config import RandomControl
+
+TWO_PI = 2.0 * np.pi
+
+
+def parse_asd(text):
+    """
+    Parse an ASD profile given as "f:g2/Hz" breakpoints, e.g.
+    "5:0.001, 10:0.01, 40:0.01, 50:0.001". Returns an (n, 2) array sorted
+    by frequency.
+    """
+    points = []
+    for item in str(text).replace(";", ",").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        f, a = item.split(":")
+        points.append((float(f), float(a)))
+    bp = np.array(sorted(points), dtype=float)
+    if len(bp) < 2:
+        raise ValueError("ASD profile needs at least two breakpoints")
+    if np.any(bp <= 0.0):
+        raise ValueError("ASD breakpoints must be positive")
+    return bp
+
+
+def asd_at(freqs, breakpoints):
+    """
+    Target ASD (g²/Hz) at `freqs`, interpolated log-log between the
+    breakpoints and zero outside them.
+    """
+    freqs = np.asarray(freqs, dtype=float)
+    out = np.zeros_like(freqs)
+    f_bp = np.log(breakpoints[:, 0])
+    a_bp = np.log(breakpoints[:, 1])
+    inside = (freqs >= breakpoints[0, 0]) & (freqs <= breakpoints[-1, 0])
+    out[inside] = np.exp(np.interp(np.log(freqs[inside]), f_bp, a_bp))
+    return out
+
+
+class DriveSynth:
+    """
+    Random drive synthesis from a one-sided PSD (V²/Hz).
+
+    Each frame is a random-phase spectrum turned into time with one inverse
+    FFT, shaped by a sqrt-Hann window and overlap-added at 50 %. The squared
+    windows sum to one, so the output variance is stationary. All frames
+    needed for a block are synthesized in one batched irfft.
+    """
+
+    def __init__(self, frame_len, sample_hz, seed=None):
+        self.N = max(4, int(frame_len) // 2 * 2)
+        self.hop = self.N // 2
+        self.df = float(sample_hz) / self.N
+        self.window = np.sin(np.pi * np.arange(self.N) / self.N)
+        self.rng = np.random.default_rng(seed)
+
+        self.mag = np.zeros(self.N // 2 + 1)
+        self.tail = np.zeros(self.hop)
+        self.pending = np.zeros(0)
+
+    def set_psd(self, psd):
+        mag = self.N * np.sqrt(np.asarray(psd) * self.df / 2.0)
+        mag[0] = 0.0
+        mag[-1] = 0.0
+        self.mag = mag
+
+    def render(self, n):
+        frames = -(-(n - len(self.pending)) // self.hop)
+        if frames > 0:
+            phase = self.rng.uniform(0.0, TWO_PI, (frames, len(self.mag)))
+            x = np.fft.irfft(self.mag * np.exp(1j * phase), n=self.N, axis=1)
+            x *= self.window
+            out = x[:, :self.hop].copy()
+            out[0] += self.tail
+            out[1:] += x[:-1, self.hop:]
+            self.tail = x[-1, self.hop:].copy()
+            self.pending = np.concatenate([self.pending, out.ravel()])
+        y, self.pending = self.pending[:n], self.pending[n:]
+        return y
+
+
+class WelchPSD:
+    """
+    Running Welch estimate of a one-sided PSD.
+
+    Samples are pushed in arbitrary blocks; every complete Hann-windowed,
+    50 %-overlapped frame is transformed in one batched rfft and folded into
+    an average over the last `averages` frames (linear until that many have
+    been seen, exponential after).
+    """
+
+    def __init__(self, frame_len, sample_hz, averages=8):
+        self.N = max(4, int(frame_len) // 2 * 2)
+        self.hop = self.N // 2
+        self.averages = max(1, int(averages))
+        self.freqs = np.fft.rfftfreq(self.N, 1.0 / sample_hz)
+        self.df = float(sample_hz) / self.N
+
+        self.window = np.hanning(self.N + 1)[:-1]
+        self.scale = 2.0 / (sample_hz * np.sum(self.window ** 2))
+
+        self.psd = np.zeros(len(self.freqs))
+        self.count = 0
+        self.pending = np.zeros(0)
+
+    def reset(self):
+        self.psd[:] = 0.0
+        self.count = 0
+        self.pending = np.zeros(0)
+
+    def push(self, x):
+        """
+        Add samples; returns the number of new frames averaged in.
+        """
+        self.pending = np.concatenate([self.pending, np.asarray(x, dtype=float)])
+        if len(self.pending) < self.N:
+            return 0
+
+        frames = np.lib.stride_tricks.sliding_window_view(self.pending, self.N)[::self.hop]
+        frames = frames - frames.mean(axis=1, keepdims=True)
+        spec = np.fft.rfft(frames * self.window, axis=1)
+        p = np.abs(spec) ** 2 * self.scale
+        p[:, 0] *= 0.5
+        p[:, -1] *= 0.5
+
+        for row in p:
+            self.count += 1
+            alpha = 1.0 / min(self.count, self.averages)
+            self.psd += alpha * (row - self.psd)
+
+        self.pending = self.pending[len(p) * self.hop:]
+        return len(p)
+
+
+class RandomControlGen:
+    """
+    Closed-loop random vibration control to a target ASD.
+
+    Implements the waveform block-generator interface (render / update)
+    plus observe(meas_g), which the output worker calls with the measured
+    acceleration. The drive PSD starts with the target's shape at the
+    "noise" RMS level and is equalized every UPDATE_FRAMES measured frames
+    by (target / measured) ** EQ_GAIN per line, from an AVERAGES-frame
+    Welch estimate. The tolerance lines are judged on a separate, longer
+    TOLERANCE_AVERAGES estimate: with only 16 degrees of freedom a line
+    strays outside ±3 dB often enough that some line of a typical profile
+    would alarm on nearly every check. Once that estimate has filled and
+    the overall level has come within ALARM_DB of the target with no more
+    than ABORT_FRACTION of the lines outside ABORT_DB, every line is
+    checked against the ALARM_DB / ABORT_DB tolerance lines; an abort
+    silences the drive.
+    """
+
+    def __init__(self, sample_hz, params, cfg=None, seed=None):
+        self.cfg = cfg or RandomControl()
+        self.sample_hz = float(sample_hz)
+
+        self.synth = DriveSynth(self.cfg.FRAME_LEN, sample_hz, seed=seed)
+        self.welch = WelchPSD(self.cfg.FRAME_LEN, sample_hz, self.cfg.AVERAGES)
+        self.tol = WelchPSD(self.cfg.FRAME_LEN, sample_hz, self.cfg.TOLERANCE_AVERAGES)
+        self.freqs = self.welch.freqs
+        self.df = self.welch.df
+
+        self.status = "EQUALIZING"
+        self.aborted = False
+        self.in_control = False
+        self.grms_target = 0.0
+        self.grms_measured = 0.0
+        self.lines_alarm = 0
+        self.lines_abort = 0
+        self._frames_since_eq = 0
+        self._asd_text = None
+        self.drive = None
+
+        self.dc = float(params["dc"])
+        self.update(params)
+
+        drive_rms = min(float(params["noise"]), self.cfg.MAX_DRIVE_RMS)
+        self.drive = self.target * (drive_rms ** 2 / max(self.grms_target ** 2, 1e-12))
+        self.synth.set_psd(self.drive)
+
+    @property
+    def measured(self):
+        return self.welch.psd
+
+    def update(self, p):
+        self.dc = float(p["dc"])
+        text = p.get("asd", "")
+        if text == self._asd_text:
+            return
+        self._asd_text = text
+        try:
+            bp = parse_asd(text)
+        except ValueError:
+            # Keep controlling to the previous profile while it is edited
+            if self.drive is None:
+                raise
+            return
+        self.target = asd_at(self.freqs, bp)
+        self.band = self.target > 0.0
+        self.grms_target = float(np.sqrt(np.sum(self.target) * self.df))
+        if self.drive is not None:
+            self.drive = np.where(self.band, self.drive, 0.0)
+            self.synth.set_psd(self.drive)
+
+    def render(self, n):
+        if self.aborted:
+            return np.full(n, self.dc)
+        return self.dc + self.synth.render(n)
+
+    def observe(self, meas_g):
+        if self.aborted:
+            return
+        self._frames_since_eq += self.welch.push(meas_g)
+        self.tol.push(meas_g)
+        if self.welch.count < self.cfg.AVERAGES // 2:
+            return
+        if self._frames_since_eq < self.cfg.UPDATE_FRAMES:
+            return
+        self._frames_since_eq = 0
+        self._check_tolerance()
+        if not self.aborted:
+            self._equalize()
+
+    def _equalize(self):
+        cfg = self.cfg
+        meas = self.welch.psd
+        ratio = np.ones_like(meas)
+        ok = self.band & (meas > 0.0)
+        ratio[ok] = self.target[ok] / meas[ok]
+
+        step = 10.0 ** (cfg.MAX_STEP_DB / 10.0)
+        drive = self.drive * np.clip(ratio ** cfg.EQ_GAIN, 1.0 / step, step)
+        drive[~self.band] = 0.0
+
+        rms = np.sqrt(np.sum(drive) * self.df)
+        if rms > cfg.MAX_DRIVE_RMS:
+            drive *= (cfg.MAX_DRIVE_RMS / rms) ** 2
+
+        self.drive = drive
+        self.synth.set_psd(drive)
+
+    def _check_tolerance(self):
+        cfg = self.cfg
+        meas = self.tol.psd[self.band]
+        target = self.target[self.band]
+        self.grms_measured = float(np.sqrt(np.sum(self.tol.psd) * self.df))
+
+        err_db = 10.0 * np.log10(np.maximum(meas, 1e-30) / target)
+        self.lines_alarm = int(np.count_nonzero(np.abs(err_db) > cfg.ALARM_DB))
+        self.lines_abort = int(np.count_nonzero(np.abs(err_db) > cfg.ABORT_DB))
+
+        level_db = 20.0 * np.log10(max(self.grms_measured, 1e-15) / max(self.grms_target, 1e-15))
+        too_many = self.lines_abort > cfg.ABORT_FRACTION * len(target)
+        if not self.in_control:
+            # Shape must be equalized too, or a resonant table aborts at once;
+            # and the estimate must have settled before lines are judged on it
+            self.in_control = (self.tol.count >= cfg.TOLERANCE_AVERAGES
+                               and abs(level_db) <= cfg.ALARM_DB and not too_many)
+            if not self.in_control:
+                self.status = "EQUALIZING"
+                return
+
+        if too_many:
+            self.status = "ABORT"
+            self.aborted = True
+        elif self.lines_alarm:
+            self.status = "ALARM"
+        else:
+            self.status = "OK"
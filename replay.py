@@ -0,0 +1,208 @@
+# vtc/replay.py
+import json
+import os
+import shutil
+
+import numpy as np
+
+from config import Replay
+from logging_utils import BinaryLogReader
+
+PYRAMID_VERSION = 1
+
+
+def pyramid_dir(log_path):
+    return os.path.splitext(log_path)[0] + ".pyramid"
+
+
+def _bin_rows(x, k):
+    """
+    Min/max of every `k` rows of x (rows, cols) -> (ceil(rows/k), cols, 2).
+    The last bin may be partial; NaN samples are ignored.
+    """
+    m = -(-len(x) // k)
+    pad = m * k - len(x)
+    if pad:
+        x = np.concatenate([x, np.full((pad,) + x.shape[1:], np.nan, x.dtype)])
+    x = x.reshape((m, k) + x.shape[1:])
+    return np.stack([np.fmin.reduce(x, axis=1), np.fmax.reduce(x, axis=1)], axis=-1)
+
+
+def _fold_bins(t, y, k):
+    """
+    Merge every `k` bins of a level: first time, min of mins, max of maxes.
+    """
+    m = -(-len(t) // k)
+    pad = m * k - len(t)
+    if pad:
+        t = np.concatenate([t, np.full(pad, np.nan)])
+        y = np.concatenate([y, np.full((pad,) + y.shape[1:], np.nan, y.dtype)])
+    y = y.reshape((m, k) + y.shape[1:])
+    return (t.reshape(m, k)[:, 0],
+            np.stack([np.fmin.reduce(y[..., 0], axis=1), np.fmax.reduce(y[..., 1], axis=1)], axis=-1))
+
+
+class ReplayData:
+    """
+    A finished run log, viewed through a min/max decimation pyramid.
+
+    The samples stay memory-mapped (BinaryLogReader). Level 1 of the
+    pyramid holds, for every BASE_BIN rows, the first time stamp and the
+    min/max of each signal column; each further level folds FACTOR bins
+    of the one below, up to a level of at most TOP_BINS bins. The level-1
+    times double as the time-to-row index. Levels are .npy files in
+    <log stem>.pyramid/ next to the log, memory-mapped when loaded, and
+    rebuilt when the log's size or mtime changes.
+
+    view() returns at most one point per pixel for any time range: raw
+    samples once the range has fewer rows than pixels, otherwise
+    (min, max) pairs from the finest level that is cheap to fold down to
+    half as many bins as pixels.
+    """
+
+    def __init__(self, log_path, cfg=None):
+        self.cfg = cfg or Replay()
+        self.path = log_path
+        self.dir = pyramid_dir(log_path)
+        self.reader = BinaryLogReader(log_path)
+        self.rows = len(self.reader)
+        self.signals = [n for n, _ in self.reader.columns if n != "t_s"]
+        self.sample_hz = self.reader.header.get("sample_hz")
+        self.base = max(1, int(self.cfg.BASE_BIN))
+        self.factor = max(2, int(self.cfg.FACTOR))
+
+        self.levels = []       # [(bin rows, t, y)], finest first
+        self.progress = 0.0
+        self.ready = False
+        self.t0 = float(self.reader.read(0, 1, ["t_s"])["t_s"][0]) if self.rows else 0.0
+
+    def _key(self):
+        st = os.stat(self.path)
+        return {"version": PYRAMID_VERSION, "size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                "rows": self.rows, "base": self.base, "factor": self.factor,
+                "top_bins": int(self.cfg.TOP_BINS), "signals": self.signals}
+
+    def load(self):
+        """
+        Use the cached pyramid, building it first if it is missing or
+        stale. Safe to run on a helper thread; `progress` goes 0..1 and
+        `ready` is set at the end.
+        """
+        key = self._key()
+        meta_path = os.path.join(self.dir, "meta.json")
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = None
+        if meta is None or meta.get("key") != key:
+            meta = self._build(key)
+
+        self.levels = []
+        for i, bin_rows in enumerate(meta["levels"], start=1):
+            t = np.load(os.path.join(self.dir, f"t{i}.npy"), mmap_mode="r")
+            y = np.load(os.path.join(self.dir, f"y{i}.npy"), mmap_mode="r")
+            self.levels.append((bin_rows, t, y))
+        self.progress = 1.0
+        self.ready = True
+        return self
+
+    def _build(self, key):
+        cfg = self.cfg
+        tmp = self.dir + ".tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+
+        # Level 1 straight from the memory-mapped log
+        step = max(self.base, int(cfg.BUILD_ROWS) // self.base * self.base)
+        bins = -(-self.rows // self.base)
+        nsig = len(self.signals)
+        t = np.lib.format.open_memmap(os.path.join(tmp, "t1.npy"), "w+", np.float64, (bins,))
+        y = np.lib.format.open_memmap(os.path.join(tmp, "y1.npy"), "w+", np.float32, (bins, nsig, 2))
+        for start in range(0, self.rows, step):
+            blk = self.reader.read(start, start + step)
+            b0 = start // self.base
+            tb = blk["t_s"][::self.base]
+            t[b0:b0 + len(tb)] = tb
+            y[b0:b0 + len(tb)] = _bin_rows(np.column_stack([blk[n] for n in self.signals]), self.base)
+            self.progress = 0.8 * min(start + step, self.rows) / max(self.rows, 1)
+        # Keep the index monotonic if time stamps are ever missing
+        if bins:
+            np.fmax.accumulate(t, out=t)
+            if np.isnan(t[0]):
+                t[np.isnan(t)] = self.t0
+        levels = [self.base]
+
+        # Coarser levels from the one below
+        while bins > cfg.TOP_BINS:
+            i = len(levels) + 1
+            prev_t, prev_y = t, y
+            bins = -(-len(prev_t) // self.factor)
+            t = np.lib.format.open_memmap(os.path.join(tmp, f"t{i}.npy"), "w+", np.float64, (bins,))
+            y = np.lib.format.open_memmap(os.path.join(tmp, f"y{i}.npy"), "w+", np.float32, (bins, nsig, 2))
+            chunk = max(self.factor, step // self.base // self.factor * self.factor)
+            for s in range(0, len(prev_t), chunk):
+                tb, yb = _fold_bins(np.asarray(prev_t[s:s + chunk]), np.asarray(prev_y[s:s + chunk]),
+                                    self.factor)
+                b0 = s // self.factor
+                t[b0:b0 + len(tb)] = tb
+                y[b0:b0 + len(tb)] = yb
+            levels.append(levels[-1] * self.factor)
+            self.progress = min(0.8 + 0.05 * len(levels), 0.99)
+        t.flush()
+        y.flush()
+        del t, y
+
+        meta = {"key": key, "levels": levels}
+        with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+        shutil.rmtree(self.dir, ignore_errors=True)
+        os.replace(tmp, self.dir)
+        return meta
+
+    @property
+    def duration(self):
+        if not self.ready or not self.rows:
+            return 0.0
+        last = self.reader.read(self.rows - 1, self.rows, ["t_s"])["t_s"][0]
+        return float(last) - self.t0
+
+    def row_at(self, t_rel):
+        """
+        First row at or after `t_rel` seconds into the run.
+        """
+        t = self.t0 + float(t_rel)
+        index = self.levels[0][1]
+        i = int(np.searchsorted(index, t, side="right")) - 1
+        if i < 0:
+            return 0
+        start = i * self.base
+        raw = self.reader.read(start, start + self.base, ["t_s"])["t_s"]
+        return start + int(np.searchsorted(raw, t))
+
+    def view(self, t_start, t_end, width_px):
+        """
+        (x, {signal: y}) for the time range, x in seconds from the start of
+        the run, at most `width_px` points per signal.
+        """
+        width_px = max(2, int(width_px))
+        r0 = self.row_at(max(t_start, 0.0))
+        r1 = min(self.row_at(max(t_end, 0.0)) + 1, self.rows)
+        if r1 <= r0:
+            return np.zeros(0), {n: np.zeros(0) for n in self.signals}
+
+        if r1 - r0 <= width_px:
+            blk = self.reader.read(r0, r1)
+            return blk["t_s"] - self.t0, {n: np.asarray(blk[n], dtype=float) for n in self.signals}
+
+        budget = width_px // 2
+        for bin_rows, t, y in self.levels:
+            b0, b1 = r0 // bin_rows, -(-r1 // bin_rows)
+            if b1 - b0 <= self.factor * budget or bin_rows == self.levels[-1][0]:
+                break
+        tb, yb = np.asarray(t[b0:b1]), np.asarray(y[b0:b1])
+        k = -(-len(tb) // budget)
+        if k > 1:
+            tb, yb = _fold_bins(tb, yb, k)
+        x = np.repeat(tb - self.t0, 2)
+        return x, {n: yb[:, i, :].reshape(-1).astype(float) for i, n in enumerate(self.signals)}
@@ -0,0 +1,612 @@
+# vtc/replication.py
+import hashlib
+import itertools
+import json
+import os
+import threading
+from fractions import Fraction
+
+import numpy as np
+from scipy.io import wavfile
+from scipy.signal import fftconvolve, resample_poly
+
+from config import Replication
+from spectrum import CrossSpectrum
+
+TIME_COLUMNS = ("t", "t_s", "time", "time_s")
+LAG_SAMPLES = 1 << 16   # drive / played-drive window the pass alignment is found in
+
+
+class ReplicationError(ValueError):
+    pass
+
+
+class MissingRate(ReplicationError):
+    pass
+
+
+def _source_key(path, *extra):
+    st = os.stat(path)
+    key = json.dumps([os.path.abspath(path), st.st_size, st.st_mtime_ns] + list(extra))
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+class Reference:
+    """
+    A memory-mapped field recording. `data` holds the file's samples (one
+    column per channel when there are several); read(a, b) returns rows
+    a..b of the chosen `column` as float g.
+    """
+
+    def __init__(self, path, data, sample_hz, column=0, gain=1.0):
+        self.path = path
+        self.data = data
+        self.sample_hz = float(sample_hz)
+        self.column = column
+        self.gain = float(gain)
+        if data.ndim > 1 and not 0 <= column < data.shape[1]:
+            raise ReplicationError(f"{os.path.basename(path)} has no column {column}")
+
+    def __len__(self):
+        return len(self.data)
+
+    def read(self, a, b):
+        x = self.data[a:b] if self.data.ndim == 1 else self.data[a:b, self.column]
+        return np.asarray(x, dtype=float) * self.gain
+
+
+def _csv_to_npy(path, cache_dir, chunk_rows=65536):
+    """
+    Convert a CSV recording once, `chunk_rows` lines at a time, into a
+    float32 .npy under `cache_dir`. Returns (npy path, column names,
+    sample rate from a time column or None).
+    """
+    npy = os.path.join(cache_dir, f"csv_{_source_key(path)}.npy")
+    info_path = npy[:-4] + ".json"
+    if os.path.exists(npy) and os.path.exists(info_path):
+        with open(info_path, "r", encoding="utf-8") as f:
+            info = json.load(f)
+        return npy, info["names"], info["sample_hz"]
+
+    with open(path, "r", newline="") as f:
+        first = f.readline()
+        rows = sum(1 for line in f if line.strip())
+    cells = [c.strip() for c in first.split(",")]
+    try:
+        [float(c) for c in cells]
+        header = False
+        names = [str(i) for i in range(len(cells))]
+        rows += 1
+    except ValueError:
+        header = True
+        names = cells
+    if not rows:
+        raise ReplicationError(f"{os.path.basename(path)} has no samples")
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = npy + ".tmp.npy"
+    out = np.lib.format.open_memmap(tmp, "w+", np.float32, (rows, len(names)))
+    sample_hz = None
+    with open(path, "r", newline="") as f:
+        if header:
+            f.readline()
+        start = 0
+        while True:
+            lines = [line for line in itertools.islice(f, chunk_rows) if line.strip()]
+            if not lines:
+                break
+            data = np.loadtxt(lines, delimiter=",", ndmin=2)
+            out[start:start + len(data)] = data
+            if start == 0 and names[0].lower() in TIME_COLUMNS and len(data) > 1:
+                sample_hz = (len(data) - 1) / float(data[-1, 0] - data[0, 0])
+            start += len(data)
+    out.flush()
+    del out
+    os.replace(tmp, npy)
+    with open(info_path, "w", encoding="utf-8") as f:
+        json.dump({"source": os.path.abspath(path), "names": names, "sample_hz": sample_hz}, f)
+    return npy, names, sample_hz
+
+
+def open_reference(path, sample_hz=None, column=None, cfg=None):
+    """
+    Open a field recording without reading it into memory: WAV (PCM or
+    float, integer samples scaled by WAV_FULL_SCALE_G), NPY (1-D or one
+    column per channel) or CSV (converted once to a cached NPY; a leading
+    t / t_s / time column gives the sample rate). `sample_hz` is needed
+    for NPY files unless a <stem>.json next to it has "sample_hz".
+    `column` picks the channel: an index, or a CSV column name.
+    """
+    cfg = cfg or Replication()
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".wav":
+        try:
+            rate, data = wavfile.read(path, mmap=True)
+        except ValueError as e:
+            raise ReplicationError(f"{os.path.basename(path)}: {e}")
+        if data.dtype.kind == "u":
+            raise ReplicationError("8-bit WAV files are not supported")
+        gain = cfg.WAV_FULL_SCALE_G
+        if data.dtype.kind == "i":
+            gain /= float(2 ** (8 * data.dtype.itemsize - 1))
+        return Reference(path, data, sample_hz or rate, int(column or 0), gain)
+
+    if ext == ".npy":
+        data = np.load(path, mmap_mode="r")
+        if sample_hz is None:
+            try:
+                with open(os.path.splitext(path)[0] + ".json", "r", encoding="utf-8") as f:
+                    sample_hz = json.load(f)["sample_hz"]
+            except (OSError, ValueError, KeyError):
+                raise MissingRate(
+                    f"{os.path.basename(path)}: give the sample rate (no <stem>.json with sample_hz)")
+        return Reference(path, data, sample_hz, int(column or 0))
+
+    if ext == ".csv":
+        npy, names, rate = _csv_to_npy(path, cfg.CACHE_DIR, cfg.CHUNK_SAMPLES // 4)
+        has_time = names[0].lower() in TIME_COLUMNS
+        if column is None:
+            column = 1 if has_time and len(names) > 1 else 0
+        elif not str(column).lstrip("-").isdigit():
+            if column not in names:
+                raise ReplicationError(f"{os.path.basename(path)} has no column '{column}'")
+            column = names.index(column)
+        sample_hz = sample_hz or rate
+        if not sample_hz:
+            raise MissingRate(f"{os.path.basename(path)}: give the sample rate (no time column)")
+        return Reference(path, np.load(npy, mmap_mode="r"), sample_hz, int(column))
+
+    raise ReplicationError("Recordings must be .wav, .csv or .npy")
+
+
+def resample_file(ref, sample_hz, out_path, chunk=1 << 18):
+    """
+    Resample a Reference to `sample_hz` with a polyphase filter
+    (scipy.signal.resample_poly), `chunk` input samples at a time, into
+    a float32 .npy at `out_path`. Each chunk is filtered with enough
+    neighbouring input on both sides that the result is the same as
+    resampling the whole file at once; chunk starts are multiples of the
+    decimation factor, so the output samples line up exactly.
+    """
+    ratio = Fraction(float(sample_hz) / ref.sample_hz).limit_denominator(1000)
+    up, down = ratio.numerator, ratio.denominator
+    n_in = len(ref)
+    n_out = -(-n_in * up // down)
+    tmp = out_path + ".tmp.npy"
+    out = np.lib.format.open_memmap(tmp, "w+", np.float32, (n_out,))
+
+    # resample_poly's filter spans 10 * max(up, down) upsampled samples each side
+    margin = -(-(10 * max(up, down)) // up) + 2
+    margin = -(-margin // down) * down
+    step = max(down, int(chunk) // down * down)
+    skip = margin * up // down
+    for a in range(0, n_in, step):
+        b = min(a + step, n_in)
+        seg = ref.read(max(a - margin, 0), min(b + margin, n_in))
+        if a < margin:
+            seg = np.concatenate([np.zeros(margin - a), seg])
+        if up == down:
+            y = seg
+        else:
+            y = resample_poly(seg, up, down)
+        o0 = a * up // down
+        o1 = n_out if b == n_in else b * up // down
+        out[o0:o1] = y[skip:skip + o1 - o0]
+    out.flush()
+    del out
+    os.replace(tmp, out_path)
+    return n_out, ref.sample_hz * up / down
+
+
+def prepare(path, sample_hz, cfg=None, column=None, source_hz=None, restart=False):
+    """
+    Set up (or reuse) the replication job for a recording at the output
+    rate: <CACHE_DIR>/twr_<key>/ with the resampled reference, the drive
+    (START_FRACTION of reference / INITIAL_G_PER_V to begin with, later
+    the corrected drive) and meta.json with the pass history. An existing
+    job keeps its refined drive unless `restart`. Returns the job dir.
+    """
+    cfg = cfg or Replication()
+    key = _source_key(path, column, source_hz, float(sample_hz), cfg.WAV_FULL_SCALE_G)
+    job_dir = os.path.join(cfg.CACHE_DIR, f"twr_{key}")
+    if not restart and os.path.exists(os.path.join(job_dir, "meta.json")):
+        return job_dir
+
+    ref = open_reference(path, source_hz, column, cfg)
+    os.makedirs(job_dir, exist_ok=True)
+    ref_path = os.path.join(job_dir, "reference.npy")
+    n, rate = resample_file(ref, sample_hz, ref_path, cfg.CHUNK_SAMPLES)
+
+    reference = np.load(ref_path, mmap_mode="r")
+    drive = np.lib.format.open_memmap(os.path.join(job_dir, "drive.tmp.npy"), "w+", np.float32, (n,))
+    sumsq = 0.0
+    for a in range(0, n, cfg.CHUNK_SAMPLES):
+        r = np.asarray(reference[a:a + cfg.CHUNK_SAMPLES], dtype=float)
+        sumsq += float(np.dot(r, r))
+        d = cfg.START_FRACTION * r / cfg.INITIAL_G_PER_V
+        drive[a:a + len(r)] = np.clip(d, -cfg.MAX_DRIVE_V, cfg.MAX_DRIVE_V)
+    drive.flush()
+    del drive, reference
+    if sumsq <= 0.0:
+        raise ReplicationError(f"{os.path.basename(path)} holds no signal")
+    os.replace(os.path.join(job_dir, "drive.tmp.npy"), os.path.join(job_dir, "drive.npy"))
+
+    meta = {
+        "source": os.path.abspath(path),
+        "column": column,
+        "source_hz": ref.sample_hz,
+        "sample_hz": float(sample_hz),
+        "resampled_hz": rate,
+        "samples": n,
+        "ref_rms_g": float(np.sqrt(sumsq / max(n, 1))),
+        "passes": [],
+    }
+    with open(os.path.join(job_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    return job_dir
+
+
+class ReplicationJob:
+    """
+    The files of one replication job, and the work done between passes.
+
+    finish_pass() takes the response recorded while the drive played: the
+    pass is aligned on the drive by cross-correlating the played drive
+    with the drive file, the RMS error against the reference is measured,
+    and unless it is within TOLERANCE_PCT the drive is corrected. The
+    correction is the error filtered by a regularized inverse of the H1
+    transfer function (Welch, FRAME samples, drive -> response) measured
+    in the same pass, limited to F_MIN_HZ..F_MAX_HZ and coherent lines,
+    scaled by GAIN and added to the drive. When a corrected drive comes
+    out worse than the drive it was corrected from (the table cannot
+    follow, or the drive clipped), that drive is restored and the gain
+    halved; the next pass plays it again and is corrected from there.
+    Everything runs in CHUNK_SAMPLES blocks over memory-mapped files.
+    """
+
+    def __init__(self, job_dir, cfg=None):
+        self.cfg = cfg or Replication()
+        self.dir = job_dir
+        with open(os.path.join(job_dir, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.sample_hz = self.meta["sample_hz"]
+        self.samples = self.meta["samples"]
+        self.reference = np.load(os.path.join(job_dir, "reference.npy"), mmap_mode="r")
+
+    def _path(self, name):
+        return os.path.join(self.dir, name)
+
+    def open_drive(self):
+        return np.load(self._path("drive.npy"), mmap_mode="r")
+
+    def open_record(self, n):
+        return np.lib.format.open_memmap(self._path("response.npy"), "w+", np.float32, (n,))
+
+    def save(self):
+        tmp = self._path("meta.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f, indent=2)
+        os.replace(tmp, self._path("meta.json"))
+
+    def _lag(self, drive, played):
+        """
+        Samples from the start of the recording to the start of the pass:
+        the peak of the cross-correlation of the played drive with the
+        first stretch of the drive that is not silent.
+        """
+        slack = len(played) - min(self.samples, LAG_SAMPLES)
+        head = np.asarray(drive[:LAG_SAMPLES], dtype=float)
+        live = np.flatnonzero(np.abs(head) > 1e-6)
+        w0 = int(live[0]) if len(live) else 0
+        d = head[w0:]
+        p = played[w0:w0 + len(d) + slack]
+        if len(d) < 2 or len(p) < len(d):
+            return 0
+        d = d - d.mean()
+        # Before the output started the played drive is unknown (NaN)
+        p = np.nan_to_num(p - np.nanmean(p))
+        nfft = 1 << int(np.ceil(np.log2(len(p) + len(d))))
+        c = np.fft.irfft(np.fft.rfft(p, nfft) * np.conj(np.fft.rfft(d, nfft)), nfft)
+        return int(np.argmax(c[:slack + 1]))
+
+    def _inverse_filter(self, spec):
+        """
+        FIR (FRAME taps, centred: FRAME/2 samples of delay) of the
+        regularized inverse of the measured transfer function.
+        """
+        cfg = self.cfg
+        f = spec.freqs
+        h = spec.gxy / np.maximum(spec.gxx, 1e-30)
+        coh = np.abs(spec.gxy) ** 2 / np.maximum(spec.gxx * spec.gyy, 1e-30)
+        band = (f >= cfg.F_MIN_HZ) & (f <= cfg.F_MAX_HZ) & (coh >= cfg.COHERENCE_MIN)
+        if not band.any():
+            return None
+        p = np.abs(h) ** 2
+        inv = np.where(band, np.conj(h) / (p + cfg.REGULARIZATION * np.median(p[band])), 0.0)
+        n = spec.N
+        return np.roll(np.fft.irfft(inv, n), n // 2) * np.hanning(n + 1)[:-1]
+
+    def _error(self, resp, lag, a, b):
+        y = np.asarray(resp[lag + a:lag + b], dtype=float)
+        r = np.asarray(self.reference[a:b], dtype=float)
+        e = r - y[:len(r)] if len(y) >= len(r) else r - np.concatenate([y, np.zeros(len(r) - len(y))])
+        return np.nan_to_num(e), r, y
+
+    def finish_pass(self, played, resp, lost, number):
+        """
+        Evaluate (and correct after) one pass. `played` is the drive as
+        output (DAC volts) from the start of the recording, `resp` the
+        recorded response (g), `lost` the number of output samples that
+        were not played. Returns the pass result dict; "done" is set once
+        no further pass is needed.
+        """
+        cfg = self.cfg
+        fs = self.sample_hz
+        result = {"pass": number}
+        if lost:
+            result.update(valid=False, note=f"{lost} output samples lost, pass repeated")
+        else:
+            drive = self.open_drive()
+            lag = self._lag(drive, played)
+            spec = CrossSpectrum(cfg.FRAME, fs, averages=2 ** 62)
+            se = s1 = sr = 0.0
+            for a in range(0, self.samples, cfg.CHUNK_SAMPLES):
+                b = min(a + cfg.CHUNK_SAMPLES, self.samples)
+                e, r, y = self._error(resp, lag, a, b)
+                spec.push(np.asarray(drive[a:b], dtype=float), y[:len(r)])
+                se += float(np.dot(e, e))
+                s1 += float(e.sum())
+                sr += float(np.dot(r, r))
+            n = max(self.samples, 1)
+            err_rms = np.sqrt(max(se / n - (s1 / n) ** 2, 0.0))
+            error_pct = 100.0 * err_rms / max(np.sqrt(sr / n), 1e-12)
+            result.update(valid=True, error_pct=float(error_pct), lag_s=lag / fs, frames=spec.count)
+            # "candidate": the drive just played is a correction not yet
+            # known to be better than the one it was made from
+            best = self.meta.get("best_error_pct")
+            gain = self.meta.get("gain", cfg.GAIN)
+            candidate = self.meta.get("candidate", False)
+            self.meta["candidate"] = False
+            if error_pct <= cfg.TOLERANCE_PCT:
+                result["converged"] = True
+            elif candidate and error_pct > best:
+                drive = None
+                os.replace(self._path("drive.best.npy"), self._path("drive.npy"))
+                self.meta["gain"] = gain / 2.0
+                result["note"] = f"worse than {best:.1f} %, back to the previous drive, gain {gain / 2.0:.2f}"
+            elif number < cfg.MAX_PASSES:
+                g = self._inverse_filter(spec)
+                if g is None:
+                    result["note"] = "no coherent lines in band, drive not corrected"
+                else:
+                    result["clipped"] = self._correct(drive, resp, lag, g, gain, s1 / n)
+                    self.meta.update(best_error_pct=float(error_pct), candidate=True)
+            drive = None
+
+        result["done"] = bool(result.get("converged")) or number >= cfg.MAX_PASSES
+        self.meta["passes"].append(result)
+        self.save()
+        return result
+
+    def _correct(self, drive, resp, lag, g, gain, offset):
+        """
+        drive += gain * (g convolved with the error less its mean
+        `offset`, the response's DC / sensor bias), chunk by chunk into
+        a new drive file; the current one is kept as drive.best.npy.
+        Returns the number of samples held at MAX_DRIVE_V.
+        """
+        cfg = self.cfg
+        half = len(g) // 2
+        tmp = self._path("drive.tmp.npy")
+        out = np.lib.format.open_memmap(tmp, "w+", np.float32, (self.samples,))
+        clipped = 0
+        for a in range(0, self.samples, cfg.CHUNK_SAMPLES):
+            b = min(a + cfg.CHUNK_SAMPLES, self.samples)
+            lo, hi = a - half + 1, b + half
+            e, _, _ = self._error(resp, lag, max(lo, 0), min(hi, self.samples))
+            e = np.concatenate([np.zeros(max(-lo, 0)), e - offset, np.zeros(max(hi - self.samples, 0))])
+            d = np.asarray(drive[a:b], dtype=float) + gain * fftconvolve(e, g, "valid")
+            clipped += int(np.count_nonzero(np.abs(d) > cfg.MAX_DRIVE_V))
+            out[a:b] = np.clip(d, -cfg.MAX_DRIVE_V, cfg.MAX_DRIVE_V)
+        out.flush()
+        del out
+        os.replace(self._path("drive.npy"), self._path("drive.best.npy"))
+        os.replace(tmp, self._path("drive.npy"))
+        return clipped
+
+
+class ReplicationGen:
+    """
+    Block generator for the "Replication" mode.
+
+    Plays the job's drive file (memory-mapped) on top of `dc`, after
+    SETTLE_S at DC so the start-up step has died away, recording the
+    response pair by pair (observe_pair) into a memory-mapped file until
+    SETTLE_S after the pass. Then it holds DC while a
+    helper thread runs ReplicationJob.finish_pass(), and plays the
+    corrected drive, until the error is within TOLERANCE_PCT or
+    MAX_PASSES passes have run; `status` is then "DONE". report() has
+    this run's pass results for the log.
+    """
+
+    def __init__(self, sample_hz, params, cfg=None):
+        self.cfg = cfg or Replication()
+        path = params.get("replication")
+        if not path:
+            raise ReplicationError("Load a recording first")
+        self.job = ReplicationJob(path, self.cfg)
+        if abs(self.job.sample_hz - sample_hz) > 1e-3 * sample_hz:
+            raise ReplicationError(
+                f"Recording was prepared for {self.job.sample_hz:g} Hz, output runs at {sample_hz:g} Hz")
+        self.dc = float(params["dc"])
+        self.total = self.job.samples
+        self.lead = int(self.cfg.SETTLE_S * sample_hz)
+        self.record_n = self.lead + self.total + self.lead
+        self.passes = []
+        self.error = None
+        self._start_pass()
+
+    def _start_pass(self):
+        self.drive = self.job.open_drive()
+        self.pos = -self.lead
+        self.rec_pos = 0
+        self.lost = 0
+        self._played = False
+        self.rec_resp = self.job.open_record(self.record_n)
+        self.rec_drive = np.full(min(self.total, LAG_SAMPLES) + self.record_n - self.total, np.nan)
+        self.state = "PLAY"
+
+    @property
+    def status(self):
+        if self.state == "PLAY":
+            text = f"PASS {len(self.passes) + 1}/{self.cfg.MAX_PASSES} {100 * max(self.pos, 0) / self.total:.0f}%"
+            last = [p for p in self.passes if p.get("valid")]
+            if last:
+                text += f" err {last[-1]['error_pct']:.1f}%"
+            return text
+        return self.state
+
+    def update(self, p):
+        self.dc = float(p["dc"])
+
+    def render(self, n):
+        if self.state != "PLAY" or self.pos >= self.total:
+            return np.full(n, self.dc)
+        a = self.pos
+        self.pos += n
+        block = np.zeros(n)
+        lo, hi = max(a, 0), min(a + n, self.total)
+        if hi > lo:
+            block[lo - a:hi - a] = self.drive[lo:hi]
+        return self.dc + block
+
+    def observe_pair(self, t, drive_v, meas_g):
+        """
+        Drive as played (volts) and response (g) at times `t`, in order.
+        """
+        if self.state != "PLAY":
+            return
+        m = min(len(t), self.record_n - self.rec_pos)
+        a = self.rec_pos
+        self.rec_resp[a:a + m] = meas_g[:m]
+        k = min(m, len(self.rec_drive) - a)
+        if k > 0:
+            self.rec_drive[a:a + k] = drive_v[:k]
+        # Once the output is playing, a NaN drive sample was not played (underrun)
+        d = drive_v[:m]
+        if not self._played:
+            ok = np.flatnonzero(~np.isnan(d))
+            self._played = bool(len(ok))
+            d = d[ok[0]:] if len(ok) else d[:0]
+        self.lost += int(np.count_nonzero(np.isnan(d)))
+        self.rec_pos += m
+        if self.rec_pos >= self.record_n and self.pos >= self.total:
+            self.state = "CORRECTING"
+            threading.Thread(target=self._finish_pass, daemon=True).start()
+
+    def _finish_pass(self):
+        try:
+            self.rec_resp.flush()
+            result = self.job.finish_pass(self.rec_drive, self.rec_resp, self.lost,
+                                          len(self.passes) + 1)
+        except Exception as e:
+            self.error = repr(e)
+            self.state = "DONE"
+            return
+        self.passes.append(result)
+        if result["done"]:
+            self.state = "DONE"
+        else:
+            self._start_pass()
+
+    def report(self):
+        """
+        Summary for the GUI / run log.
+        """
+        valid = [p for p in self.passes if p.get("valid")]
+        return {
+            "replication": self.job.dir,
+            "source": self.job.meta["source"],
+            "tolerance_pct": self.cfg.TOLERANCE_PCT,
+            "passes": self.passes,
+            "error_pct": valid[-1]["error_pct"] if valid else None,
+            "converged": bool(valid and valid[-1].get("converged")),
+            "error": self.error,
+        }
+
+
+def run_sim(job_dir, seconds_max=None, cfg=None):
+    """
+    Run a job's passes against the simulated table (SimDAQ, acquisition,
+    output worker) until it is done. Abort limits are off: the simulated
+    table needs no protection. Returns the report.
+    """
+    import time
+
+    from config import AbortLimits, Calibration, Runtime, SimPlant
+    from acquisition import AcquisitionWorker
+    from output_worker import DEFAULT_PARAMS, WaveformOutputWorker
+    from sim_daq import SimDAQ
+
+    rt = Runtime()
+    cal = Calibration()
+    dac = SimDAQ(plant=SimPlant(), sample_hz=rt.SAMPLE_HZ)
+    dac.connect()
+    acq = AcquisitionWorker(dac, rt.SAMPLE_HZ, rt.AI_BUFFER_SAMPLES, rt.AI_RING_SECONDS)
+    acq.set_calibration(cal)
+    acq.start()
+    out = WaveformOutputWorker(dac, rt.SAMPLE_HZ, rt.AO_BUFFER_SAMPLES, feedback=acq.ring,
+                               limits=AbortLimits(ENABLE=False))
+    out.update_settings("Replication", dict(DEFAULT_PARAMS, replication=job_dir), cal)
+    out.start()
+    t0 = time.perf_counter()
+    shown = None
+    try:
+        while out.running and out.control_status() != "DONE":
+            status = out.control_status()
+            if status != shown and status and not status.endswith("%"):
+                print(f"{time.perf_counter() - t0:7.1f} s  {status}")
+            shown = status
+            if seconds_max and time.perf_counter() - t0 > seconds_max:
+                break
+            time.sleep(0.05)
+    finally:
+        out.stop()
+        acq.stop()
+        dac.close()
+    report = out.control_report()
+    if out.error is not None and not report["error"]:
+        report["error"] = repr(out.error)
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    from config import Runtime
+
+    ap = argparse.ArgumentParser(description="Prepare a field recording for replication.")
+    ap.add_argument("recording", help=".wav, .csv or .npy")
+    ap.add_argument("--rate", type=float, help="sample rate of the recording (NPY / CSV without time)")
+    ap.add_argument("--column", help="channel index or CSV column name")
+    ap.add_argument("--restart", action="store_true", help="discard the refined drive")
+    ap.add_argument("--sim", action="store_true", help="run the passes against the simulated table")
+    args = ap.parse_args()
+
+    column = args.column
+    if column is not None and column.lstrip("-").isdigit():
+        column = int(column)
+    t0 = time.perf_counter()
+    job = prepare(args.recording, Runtime().SAMPLE_HZ, column=column, source_hz=args.rate,
+                  restart=args.restart)
+    meta = ReplicationJob(job).meta
+    print(f"{meta['samples'] / meta['sample_hz']:.1f} s at {meta['sample_hz']:g} Hz "
+          f"(from {meta['source_hz']:g} Hz), {len(meta['passes'])} earlier passes -> {job} "
+          f"({time.perf_counter() - t0:.2f} s)")
+    if args.sim:
+        report = run_sim(job)
+        for p in report["passes"]:
+            print(f"pass {p['pass']}: " + (f"error {p['error_pct']:.2f} %, lag {p['lag_s'] * 1e3:.1f} ms"
+                                          if p.get("valid") else p.get("note", "")))
+        print("converged" if report["converged"] else "not converged", report["error"] or "")
@@ -0,0 +1,229 @@
+# vtc/resonance.py
+import threading
+
+import numpy as np
+from scipy.signal import find_peaks
+
+from config import ResonanceSearch
+
+TWO_PI = 2.0 * np.pi
+
+
+def estimate_frf(x, y, sample_hz, f_lo, f_hi, bins_per_octave=48):
+    """
+    H1 transfer function y/x of a whole sweep record, from one FFT of each
+    signal with Gxy and Gxx summed into log-spaced bands between f_lo and
+    f_hi. Returns (freqs, H); freqs are the Gxx-weighted band centres.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    X = np.fft.rfft(x - x.mean())
+    Y = np.fft.rfft(y - y.mean())
+    f = np.fft.rfftfreq(len(x), 1.0 / sample_hz)
+
+    lo, hi = np.searchsorted(f, [f_lo, f_hi])
+    f, X, Y = f[lo:hi], X[lo:hi], Y[lo:hi]
+    if len(f) < 2:
+        return np.zeros(0), np.zeros(0, dtype=complex)
+
+    bands = int(np.ceil(np.log2(f_hi / f_lo) * bins_per_octave))
+    edges = f_lo * 2.0 ** (np.arange(bands + 1) / bins_per_octave)
+    starts = np.unique(np.searchsorted(f, edges))
+    starts = starts[starts < len(f)]
+
+    pxx = np.abs(X) ** 2
+    gxx = np.add.reduceat(pxx, starts)
+    gxy = np.add.reduceat(np.conj(X) * Y, starts)
+    fc = np.add.reduceat(f * pxx, starts)
+    ok = gxx > 0.0
+    return fc[ok] / gxx[ok], gxy[ok] / gxx[ok]
+
+
+def find_resonances(freqs, H, cfg=None):
+    """
+    Peaks of |H| with their Q. Q comes from the half-power bandwidth, or
+    from the phase slope at the peak (Q = -f0/2 * dphi/df) when a -3 dB
+    point lies outside the sweep. Returned largest first, as dicts with
+    freq_hz, gain, phase_deg, phase_slope (rad/Hz), q and zeta.
+    """
+    cfg = cfg or ResonanceSearch()
+    if len(freqs) < 3:
+        return []
+    mag = np.abs(H)
+    mag_db = 20.0 * np.log10(np.maximum(mag, 1e-12))
+    phase = np.unwrap(np.angle(H))
+    slope = np.gradient(phase, freqs)
+
+    idx, _ = find_peaks(mag_db, prominence=cfg.MIN_PROMINENCE_DB)
+    idx = idx[np.argsort(mag[idx])[::-1]][:cfg.MAX_PEAKS]
+
+    peaks = []
+    for p in idx:
+        f0 = freqs[p]
+        half = mag[p] / np.sqrt(2.0)
+        below_l = np.flatnonzero(mag[:p] < half)
+        below_r = np.flatnonzero(mag[p:] < half)
+        if len(below_l) and len(below_r):
+            i = below_l[-1]
+            j = p + below_r[0]
+            fl = np.interp(half, [mag[i], mag[i + 1]], [freqs[i], freqs[i + 1]])
+            fh = np.interp(half, [mag[j], mag[j - 1]], [freqs[j], freqs[j - 1]])
+            q = f0 / max(fh - fl, 1e-9)
+        elif slope[p] < 0.0:
+            q = -0.5 * f0 * slope[p]
+        else:
+            q = float("nan")
+        peaks.append({
+            "freq_hz": float(f0),
+            "gain": float(mag[p]),
+            "phase_deg": float(np.degrees(np.angle(H[p]))),
+            "phase_slope": float(slope[p]),
+            "q": float(q),
+            "zeta": float(0.5 / q) if q > 0 else float("nan"),
+        })
+    return peaks
+
+
+class ResonanceSearchGen:
+    """
+    Resonance search followed by a phase-tracking dwell.
+
+    SWEEP: a logarithmic sine sweep f_start..f_end over `dur` at the
+    (low) "amp" level. Drive and response come in time-aligned through
+    observe_pair() and are recorded until SETTLE_S after the sweep.
+    ANALYZING: the FRF and peaks are computed on a helper thread while
+    the drive holds DC. DWELL: a sine on peak "res_peak" (0 = largest).
+    Every update demodulates the last TRACK_WINDOW_S of drive and response
+    at the drive frequency and moves the frequency to hold the phase the
+    sweep measured at the peak, using the sweep's phase slope, so the
+    dwell follows the resonance as it drifts. Q is tracked as the sweep Q
+    scaled by the change in resonant gain.
+    """
+
+    def __init__(self, sample_hz, params, cfg=None):
+        self.cfg = cfg or ResonanceSearch()
+        self.sample_hz = float(sample_hz)
+        self.dt = 1.0 / self.sample_hz
+
+        self.state = "SWEEP"
+        self.status = "SWEEP"
+        self.peaks = []
+        self.frf = None
+        self.track = None
+        self.peak_index = 0
+
+        self.n = 0
+        self.phase = 0.0
+        self.freq = 0.0
+        self.update(params)
+        self.sweep_n = int(round(self.dur * self.sample_hz))
+        self._record = []
+        self._recorded = 0
+        self._settle_n = int(self.cfg.SETTLE_S * self.sample_hz)
+        self._win = np.zeros((3, 0))
+
+    def update(self, p):
+        self.amp = float(p["amp"])
+        self.dc = float(p["dc"])
+        if self.state == "SWEEP":
+            self.f_start = max(float(p["f_start"]), 0.01)
+            self.f_end = max(float(p["f_end"]), self.f_start * 1.01)
+            self.dur = max(float(p["dur"]), 1.0)
+        index = int(p["res_peak"])
+        if index != self.peak_index:
+            self.peak_index = index
+            if self.state == "DWELL":
+                self._dwell_on(index)
+
+    def current_freq(self):
+        return self.freq
+
+    def render(self, n):
+        if self.state == "SWEEP" and self.n < self.sweep_n:
+            k = self.n + np.arange(n)
+            f = self.f_start * (self.f_end / self.f_start) ** (np.minimum(k, self.sweep_n) / self.sweep_n)
+            w = TWO_PI * self.dt * f
+            ph = self.phase + np.cumsum(w) - w
+            self.phase = (self.phase + w.sum()) % TWO_PI
+            self.freq = float(f[-1])
+            self.status = f"SWEEP {self.freq:.1f} Hz"
+            self.n += n
+            # The sweep ends on a zero crossing of the block, not mid-cycle
+            return self.dc + self.amp * np.sin(ph) * (k < self.sweep_n)
+        if self.state == "DWELL":
+            w = TWO_PI * self.freq * self.dt
+            ph = self.phase + w * np.arange(n)
+            self.phase = (self.phase + w * n) % TWO_PI
+            self.n += n
+            return self.dc + self.amp * np.sin(ph)
+        self.n += n
+        return np.full(n, self.dc)
+
+    def observe_pair(self, t, drive_v, meas_g):
+        """
+        Aligned drive (volts) and response (g) samples at times `t`.
+        """
+        ok = ~(np.isnan(drive_v) | np.isnan(meas_g))
+        if self.state == "SWEEP":
+            self._record.append((drive_v[ok], meas_g[ok]))
+            self._recorded += len(t)
+            if self.n >= self.sweep_n and self._recorded >= self.sweep_n + self._settle_n:
+                self.state = self.status = "ANALYZING"
+                threading.Thread(target=self._analyze, daemon=True).start()
+        elif self.state == "DWELL":
+            self._track(t[ok], drive_v[ok], meas_g[ok])
+
+    def _analyze(self):
+        x = np.concatenate([r[0] for r in self._record])
+        y = np.concatenate([r[1] for r in self._record])
+        self._record = []
+        freqs, H = estimate_frf(x, y, self.sample_hz, self.f_start, self.f_end,
+                                self.cfg.BINS_PER_OCTAVE)
+        self.frf = (freqs, H)
+        self.peaks = find_resonances(freqs, H, self.cfg)
+        if self.peaks:
+            self._dwell_on(self.peak_index)
+        else:
+            self.state = self.status = "NO PEAK"
+
+    def _dwell_on(self, index):
+        peak = self.peaks[min(max(index, 0), len(self.peaks) - 1)]
+        self.target = peak
+        self.freq = peak["freq_hz"]
+        self._win = np.zeros((3, 0))
+        self.state = "DWELL"
+        self.status = f"DWELL {self.freq:.2f} Hz Q {peak['q']:.1f}"
+
+    def _track(self, t, x, y):
+        cfg = self.cfg
+        keep = int(cfg.TRACK_WINDOW_S * self.sample_hz)
+        self._win = np.concatenate([self._win, np.vstack([t, x, y])], axis=1)[:, -keep:]
+        if self._win.shape[1] < keep or not len(t):
+            return
+
+        tw, xw, yw = self._win
+        lo = np.exp(-1j * TWO_PI * self.freq * (tw - tw[0]))
+        X = np.dot(xw - xw.mean(), lo)
+        Y = np.dot(yw - yw.mean(), lo)
+        h = Y / X if abs(X) > 0.0 else 0.0
+        gain = abs(h)
+        phase = np.angle(h)
+
+        peak = self.target
+        err = np.angle(np.exp(1j * (phase - np.radians(peak["phase_deg"]))))
+        slope = min(peak["phase_slope"], -1e-6)
+        step = -cfg.TRACK_GAIN * err / slope
+        max_step = cfg.MAX_DRIFT_HZ_S * len(t) / self.sample_hz
+        self.freq = float(np.clip(self.freq + np.clip(step, -max_step, max_step),
+                                  self.f_start, self.f_end))
+
+        q = peak["q"] * gain / max(peak["gain"], 1e-12)
+        self.track = (float(t[-1]), self.freq, float(q), float(gain), float(np.degrees(phase)))
+        self.status = f"DWELL {self.freq:.2f} Hz Q {q:.1f}"
+
+    def report(self):
+        """
+        Small summary for the GUI / run log: peaks found and the latest
+        tracker point (perf_counter t, freq_hz, q, gain, phase_deg).
+        """
+        return {"peaks": self.peaks, "track": self.track}
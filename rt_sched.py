@@ -0,0 +1,121 @@
+# vtc/rt_sched.py
+import ctypes
+import ctypes.util
+import gc
+import os
+import time
+
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+
+
+class RTProfile:
+    """
+    Opt-in real-time profile for the output thread (Runtime.RT_*).
+
+    lock_memory() is process-wide and called once at startup.
+    enter_thread() / exit_thread() are called by the output thread itself:
+    SCHED_FIFO at RT_PRIORITY, pinned to RT_CPU, and the heap frozen with
+    automatic garbage collection off while it runs, so no allocation on
+    any thread starts a collection that holds the GIL against the output
+    loop. GC is process-wide, so while that is in effect a non-RT thread
+    (the GUI tick, or the engine's control loop) calls collect()
+    regularly: cheap young-generation collections every call and a full
+    one every RT_GC_FULL_S, so cyclic garbage does not pile up as locked
+    memory over a long run. wait_until() sleeps until RT_SPIN_US before
+    a deadline and then spins on perf_counter().
+
+    Every step is best effort: a missing privilege or an unsupported
+    platform is noted in `notes` and the rest still applies.
+    """
+
+    def __init__(self, rt):
+        self.enabled = bool(rt.RT_ENABLE)
+        self.priority = int(rt.RT_PRIORITY)
+        self.cpu = rt.RT_CPU
+        self.mlock = bool(rt.RT_MLOCK)
+        self.gc_off = bool(rt.RT_GC_OFF)
+        self.gc_full_s = float(rt.RT_GC_FULL_S)
+        self.spin_s = max(0.0, rt.RT_SPIN_US * 1e-6) if self.enabled else 0.0
+        self.notes = []
+        self._gc_was_enabled = None
+        self._gc_full_t = 0.0
+
+    def _note(self, text):
+        if text not in self.notes:
+            self.notes.append(text)
+
+    def lock_memory(self):
+        if not (self.enabled and self.mlock):
+            return
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            if libc.mlockall(MCL_CURRENT | MCL_FUTURE) != 0:
+                raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+            self._note("mlockall ok")
+        except (OSError, AttributeError, TypeError) as e:
+            self._note(f"mlockall failed: {e}")
+
+    def enter_thread(self):
+        """
+        Apply the profile to the calling thread.
+        """
+        if not self.enabled:
+            return
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self.priority))
+            self._note(f"SCHED_FIFO {self.priority}")
+        except (OSError, AttributeError) as e:
+            self._note(f"SCHED_FIFO failed: {e}")
+
+        if self.cpu is not None:
+            try:
+                os.sched_setaffinity(0, {int(self.cpu)})
+                self._note(f"pinned to CPU {self.cpu}")
+            except (OSError, AttributeError, ValueError) as e:
+                self._note(f"affinity failed: {e}")
+
+        if self.gc_off:
+            self._gc_was_enabled = gc.isenabled()
+            gc.collect()
+            gc.freeze()
+            gc.disable()
+            self._gc_full_t = time.monotonic()
+
+    def exit_thread(self):
+        if self._gc_was_enabled is None:
+            return
+        gc.unfreeze()
+        if self._gc_was_enabled:
+            gc.enable()
+        self._gc_was_enabled = None
+
+    def collect(self):
+        """
+        Run the collections automatic GC would have, from a thread other
+        than the output thread. Does nothing unless the profile holds GC off.
+        """
+        if self._gc_was_enabled is None:
+            return
+        now = time.monotonic()
+        if now - self._gc_full_t >= self.gc_full_s:
+            self._gc_full_t = now
+            gc.collect()
+        else:
+            gc.collect(1)
+
+    def wait_until(self, deadline):
+        """
+        Sleep, then spin for the last spin_s, until perf_counter() reaches
+        `deadline`.
+        """
+        remaining = deadline - time.perf_counter()
+        if remaining > self.spin_s:
+            time.sleep(remaining - self.spin_s)
+        while time.perf_counter() < deadline:
+            pass
+
+    def status_text(self):
+        if not self.enabled:
+            return "RT: off"
+        return "RT: " + ", ".join(self.notes) if self.notes else "RT: pending"
@@ -1,27 +1,42 @@
 # vtc/safety_gpio.py
+import time
+
 
 class SafetyController:
     """
     Software-only safety controller.
 
     In this configuration the amplifier's own E-stop handles hardware safety.
-    This class simply tracks an 'armed' state so the UI can gate when it is
-    allowed to send non-zero drive voltages. No GPIO is used.
+    This class tracks an 'armed' state so the UI can gate when it is
+    allowed to send non-zero drive voltages, and latches faults reported
+    by software (the output engine's abort limits). No GPIO is used.
     """
 
     def __init__(self, estop_pin=17, mute_pin=18, debounce_s=0.02):
         # Parameters are kept for API compatibility but unused.
         self.armed = False
         self.last_fault_time = None
+        self.fault_cause = None
 
     def is_fault(self) -> bool:
         """
-        Return False to indicate no Pi-side fault detection.
+        True while a tripped fault is latched (until the next arm()).
+
+        All hard safety is handled by the HPA-K amplifier E-stop; the
+        faults seen here are software trips.
+        """
+        return self.fault_cause is not None
 
-        All hard safety is handled by the HPA-K amplifier E-stop,
-        so from the controller's perspective there is never a fault.
+    def trip(self, cause) -> str:
         """
-        return False
+        Latch a fault with its cause and disarm. The first cause is kept
+        until the fault is cleared.
+        """
+        if self.fault_cause is None:
+            self.fault_cause = str(cause)
+            self.last_fault_time = time.time()
+        self.armed = False
+        return "FAULT"
 
     def mute(self) -> str:
         """
@@ -33,7 +48,9 @@ class SafetyController:
 
     def arm(self) -> str:
         """
-        Software arm: allow the UI to start sending waveforms.
+        Software arm: clear a latched fault and allow the UI to start
+        sending waveforms.
         """
+        self.fault_cause = None
         self.armed = True
         return "ARMED"
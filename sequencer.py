@@ -0,0 +1,220 @@
+# vtc/sequencer.py
+import hashlib
+import json
+import os
+from dataclasses import asdict
+
+import numpy as np
+
+from config import Runtime
+from output_worker import DEFAULT_PARAMS
+import waveform as wf
+
+# Modes a profile step may use: open-loop generators only, since a
+# closed-loop drive depends on the response and cannot be rendered ahead
+PROFILE_MODES = ("Manual", "Sine", "Sine Sweep", "Random Noise", "Sine on Random",
+                 "Resonance Dwell", "Shock")
+SINE_MODES = ("Sine", "Sine Sweep", "Sine on Random", "Resonance Dwell")
+
+STEP_KEYS = {"mode", "duration", "repeat", "label"}
+CHUNK_SAMPLES = 65536
+
+
+class ProfileError(ValueError):
+    pass
+
+
+def load_profile(path):
+    """
+    Read a profile from .json, or .yaml / .yml (needs PyYAML).
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    if str(path).lower().endswith((".yaml", ".yml")):
+        try:
+            import yaml
+        except ImportError:
+            raise ProfileError("YAML profiles need PyYAML (pip install pyyaml)")
+        profile = yaml.safe_load(text)
+    else:
+        profile = json.loads(text)
+    return validate_profile(profile)
+
+
+def validate_profile(profile):
+    """
+    Check the structure of a profile and expand it into a flat list of
+    steps, each {"mode", "duration", "label", "params"} with the
+    generator params filled in from DEFAULT_PARAMS. Levels are checked
+    against the DAC range when the profile is compiled.
+
+    Format:
+        name: Qualification A
+        steps:
+          - {mode: Sine Sweep, duration: 60, amp: 1.0, f_start: 5, f_end: 50}
+          - {mode: Resonance Dwell, duration: 600, freq: 27.5, amp: 0.8}
+          - {mode: Shock, duration: 2, repeat: 3, shock_peak: 2.0}
+          - {mode: Random Noise, duration: 120, noise: 0.3}
+    """
+    if not isinstance(profile, dict) or not isinstance(profile.get("steps"), list):
+        raise ProfileError("A profile needs a 'steps' list")
+    if not profile["steps"]:
+        raise ProfileError("The profile has no steps")
+
+    steps = []
+    for i, step in enumerate(profile["steps"], start=1):
+        if not isinstance(step, dict):
+            raise ProfileError(f"Step {i}: expected a mapping")
+        mode = step.get("mode")
+        if mode not in PROFILE_MODES:
+            raise ProfileError(f"Step {i}: mode must be one of {', '.join(PROFILE_MODES)}")
+        unknown = set(step) - STEP_KEYS - set(DEFAULT_PARAMS)
+        if unknown:
+            raise ProfileError(f"Step {i}: unknown keys {', '.join(sorted(unknown))}")
+        if step.get("closed_loop"):
+            raise ProfileError(f"Step {i}: closed-loop steps cannot be pre-rendered")
+        try:
+            duration = float(step["duration"])
+            repeat = int(step.get("repeat", 1))
+            params = dict(DEFAULT_PARAMS)
+            params.update({k: float(v) for k, v in step.items()
+                           if k in DEFAULT_PARAMS and k != "closed_loop"})
+        except KeyError:
+            raise ProfileError(f"Step {i}: missing 'duration'")
+        except (TypeError, ValueError):
+            raise ProfileError(f"Step {i}: values must be numbers")
+        if duration <= 0.0 or repeat < 1:
+            raise ProfileError(f"Step {i}: duration and repeat must be positive")
+        if mode == "Sine Sweep" and "dur" not in step:
+            params["dur"] = duration
+
+        label = str(step.get("label", mode))
+        for _ in range(repeat):
+            steps.append({"mode": mode, "duration": duration, "label": label, "params": params})
+    return {"name": str(profile.get("name", "")), "steps": steps}
+
+
+def compile_profile(profile, sample_hz, cal, cache_dir, ao_limits=(0.0, 5.0)):
+    """
+    Render a validated profile into calibrated DAC volts, CHUNK_SAMPLES at a
+    time, straight into a .npy file under `cache_dir`, and write its step
+    index next to it. Steps follow each other sample for sample, and
+    sine-type steps continue the previous sine's phase. Any sample outside
+    `ao_limits` rejects the profile. Returns the .npy path; an identical
+    profile / rate / calibration is reused from the cache.
+    """
+    key = json.dumps([profile, float(sample_hz), asdict(cal), list(ao_limits)], sort_keys=True)
+    digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f"profile_{digest}.npy")
+    index_path = path[:-4] + ".json"
+    if os.path.exists(path) and os.path.exists(index_path):
+        return path
+
+    counts = [int(round(s["duration"] * sample_hz)) for s in profile["steps"]]
+    tmp = path + ".tmp"
+    out = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.float32, shape=(sum(counts),))
+    lo, hi = ao_limits
+
+    index = []
+    start = 0
+    phase = 0.0
+    try:
+        for i, (step, count) in enumerate(zip(profile["steps"], counts), start=1):
+            gen = wf.make_generator(step["mode"], step["params"], sample_hz)
+            if step["mode"] in SINE_MODES:
+                gen.phase = phase
+            for off in range(0, count, CHUNK_SAMPLES):
+                n = min(CHUNK_SAMPLES, count - off)
+                v = cal.DAC_OFFSET + cal.DAC_SCALE * gen.render(n)
+                bad = np.flatnonzero((v < lo) | (v > hi))
+                if len(bad):
+                    t = (start + off + bad[0]) / sample_hz
+                    raise ProfileError(
+                        f"Step {i} ({step['label']}) leaves the DAC range "
+                        f"{lo:g}..{hi:g} V at t={t:.3f} s ({v[bad[0]]:.3f} V)")
+                out[start + off:start + off + n] = v
+            if step["mode"] in SINE_MODES:
+                phase = gen.phase
+            index.append({"label": step["label"], "mode": step["mode"],
+                          "start": start, "samples": count})
+            start += count
+        out.flush()
+    except Exception:
+        del out
+        os.remove(tmp)
+        raise
+    del out
+    os.replace(tmp, path)
+
+    with open(index_path, "w", encoding="utf-8") as f:
+        json.dump({"name": profile["name"], "sample_hz": float(sample_hz),
+                   "samples": start, "steps": index}, f, indent=2)
+    return path
+
+
+class ProfilePlayer:
+    """
+    Block generator that streams a compiled profile.
+
+    The samples are already calibrated, clipped DAC volts, so render(n) is
+    a slice copy (`calibrated` tells the output worker not to scale them
+    again). Profiles longer than Runtime.PROFILE_MEMMAP_S stay memory-mapped
+    and are paged in as they play. After the last sample the final level
+    is held and `status` becomes "DONE".
+    """
+
+    calibrated = True
+
+    def __init__(self, sample_hz, params):
+        path = params["profile"]
+        with open(path[:-4] + ".json", "r", encoding="utf-8") as f:
+            self.index = json.load(f)
+        if abs(self.index["sample_hz"] - sample_hz) > 1e-3 * sample_hz:
+            raise ProfileError(
+                f"Profile was compiled for {self.index['sample_hz']:g} Hz, output runs at {sample_hz:g} Hz")
+        mmap = self.index["samples"] > Runtime().PROFILE_MEMMAP_S * sample_hz
+        self.samples = np.load(path, mmap_mode="r" if mmap else None)
+        self.pos = 0
+        self.status = self._status()
+
+    def update(self, p):
+        pass
+
+    def _status(self):
+        if self.pos >= len(self.samples):
+            return "DONE"
+        steps = self.index["steps"]
+        for i, step in enumerate(steps):
+            if self.pos < step["start"] + step["samples"]:
+                return f"STEP {i + 1}/{len(steps)} {step['label']}"
+        return "DONE"
+
+    def render(self, n):
+        block = np.asarray(self.samples[self.pos:self.pos + n], dtype=float)
+        if len(block) < n:
+            hold = block[-1] if len(block) else float(self.samples[-1])
+            block = np.concatenate([block, np.full(n - len(block), hold)])
+        self.pos += n
+        self.status = self._status()
+        return block
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    from calibration import load_calibration
+
+    ap = argparse.ArgumentParser(description="Validate and compile a test profile.")
+    ap.add_argument("profile")
+    args = ap.parse_args()
+
+    rt = Runtime()
+    t0 = time.perf_counter()
+    prof = load_profile(args.profile)
+    path = compile_profile(prof, rt.SAMPLE_HZ, load_calibration(rt.CALIBRATION_FILE),
+                           rt.PROFILE_CACHE)
+    total = sum(s["duration"] for s in prof["steps"])
+    print(f"{len(prof['steps'])} steps, {total:.1f} s -> {path} "
+          f"({time.perf_counter() - t0:.2f} s)")
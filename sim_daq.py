@@ -0,0 +1,335 @@
+# vtc/sim_daq.py
+import threading
+import time
+
+import numpy as np
+from scipy.signal import bilinear, lfilter
+
+from daq_backend import DAQBackend
+
+
+class TablePlant:
+    """
+    Amplifier / shaker / table model used by the simulator.
+
+    The drive (volts about INPUT_BIAS_V) commands an acceleration of
+    GAIN_G_PER_V g/V; the payload is a base-excited mass-spring-damper
+    (FN_HZ, ZETA) whose acceleration is measured by an accelerometer
+    (SENSOR_V_PER_G, SENSOR_BIAS_V) with white noise, a pure LATENCY_S
+    delay and an ADC that clips to ±ADC_RANGE_V and quantizes to ADC_BITS.
+    With channels > 1 there is one accelerometer per channel, seeing the
+    payload scaled by CHANNEL_GAINS with its own noise, and process()
+    returns (n, channels). process() is stateful and vectorized, so it can
+    be driven with blocks of any size, in or out of real time.
+    """
+
+    def __init__(self, cfg, sample_hz, seed=None, channels=1):
+        self.cfg = cfg
+        self.sample_hz = float(sample_hz)
+        self.rng = np.random.default_rng(seed)
+        self.channels = max(1, int(channels))
+        self.channel_gains = np.resize(np.asarray(cfg.CHANNEL_GAINS, dtype=float), self.channels)
+
+        w = 2.0 * np.pi * cfg.FN_HZ
+        b = [2.0 * cfg.ZETA * w, w * w]
+        a = [1.0, 2.0 * cfg.ZETA * w, w * w]
+        self.b, self.a = bilinear(b, a, fs=self.sample_hz)
+        self.zi = np.zeros(max(len(self.a), len(self.b)) - 1)
+
+        self.delay = np.zeros(int(round(cfg.LATENCY_S * self.sample_hz)))
+        self.lsb = 2.0 * cfg.ADC_RANGE_V / (2 ** cfg.ADC_BITS)
+
+    def process(self, drive_v):
+        cfg = self.cfg
+        u = (np.asarray(drive_v, dtype=float) - cfg.INPUT_BIAS_V) * cfg.GAIN_G_PER_V
+        if len(self.delay):
+            u = np.concatenate([self.delay, u])
+            self.delay, u = u[len(u) - len(self.delay):], u[:len(u) - len(self.delay)]
+        accel_g, self.zi = lfilter(self.b, self.a, u, zi=self.zi)
+        if self.channels > 1:
+            accel_g = accel_g[:, None] * self.channel_gains
+        accel_g = accel_g + cfg.NOISE_G * self.rng.standard_normal(accel_g.shape)
+
+        v = cfg.SENSOR_BIAS_V + cfg.SENSOR_V_PER_G * accel_g
+        v = np.clip(v, -cfg.ADC_RANGE_V, cfg.ADC_RANGE_V - self.lsb)
+        return np.round(v / self.lsb) * self.lsb
+
+
+class LoopbackWire:
+    """
+    AO wired back to the AI channels, for loopback calibration: the DAC's
+    gain and offset error, a pipeline delay, each channel's divider
+    (ADC_GAINS) and ADC noise. process() is stateful, like TablePlant's.
+    """
+
+    def __init__(self, cfg, sample_hz, seed=None, channels=1):
+        self.cfg = cfg
+        self.rng = np.random.default_rng(seed)
+        self.gains = np.resize(np.asarray(cfg.ADC_GAINS, dtype=float), max(1, int(channels)))
+        self.delay = np.zeros(int(round(cfg.DELAY_S * sample_hz)))
+
+    def process(self, drive_v):
+        cfg = self.cfg
+        v = cfg.DAC_OFFSET_V + cfg.DAC_GAIN * np.asarray(drive_v, dtype=float)
+        if len(self.delay):
+            v = np.concatenate([self.delay, v])
+            self.delay, v = v[len(v) - len(self.delay):], v[:len(v) - len(self.delay)]
+        v = v[:, None] * self.gains
+        return v + cfg.NOISE_V * self.rng.standard_normal(v.shape)
+
+
+class SimDAQ(DAQBackend):
+    """
+    Simulated DAQ backend for hardware-free runs, CI and benchmarks.
+
+    Scans are clocked from time.perf_counter(): the AO position advances at
+    the scan rate whether or not the caller keeps the buffer topped up,
+    exactly like the hardware. With record=True every sample the "device"
+    takes from the AO buffer is kept in `played`, so stale (not refilled)
+    samples show up in the output history.
+
+    Internally the table is simulated on its own timeline at `sample_hz`:
+    each step looks up the AO level at that instant (scan buffer or last
+    write()) and runs it through a TablePlant. AI reads and AI scans sample
+    that timeline, one value per `ai_channels` entry. Without a plant, AI
+    loops back the AO output on every channel: ideally, or through a
+    LoopbackWire when `loopback` (config.SimLoopback) is given.
+    """
+
+    supports_ao_scan = True
+    supports_ai_scan = True
+    simulated = True
+
+    def __init__(self, plant=None, sample_hz=5000, ao_limits=(0.0, 5.0),
+                 record=False, seed=None, ai_channels=(0,), loopback=None):
+        self.ao_limits = tuple(ao_limits)
+        self.ai_channels = tuple(ai_channels)
+        nch = len(self.ai_channels)
+        self.sample_hz = float(sample_hz)
+        self.record = bool(record)
+        self.played = []
+        self.level = 0.0
+
+        self.plant = TablePlant(plant, sample_hz, seed, nch) if plant is not None else None
+        if self.plant is None and loopback is not None:
+            self.plant = LoopbackWire(loopback, sample_hz, seed, nch)
+        self._lock = threading.Lock()
+        self._t0 = None
+        self._sim_pos = 0
+        self._history = np.zeros((int(self.sample_hz * 2.0), nch))
+
+        self._ao_view = None
+        self._scan_rate = None
+        self._scan_t0 = None
+        self._scan_pos = 0
+
+        self._ai_view = None
+        self._ai_rate = None
+        self._ai_t0 = None
+        self._ai_pos = 0
+
+    def connect(self):
+        self._t0 = time.perf_counter()
+        self.write(0.0)
+
+    # --- simulated table ---
+
+    def _ao_at(self, t):
+        """
+        AO output at perf_counter() times `t`.
+        """
+        if self._scan_t0 is None:
+            return np.full(len(t), self.level)
+        idx = np.maximum((t - self._scan_t0) * self._scan_rate, 0).astype(np.int64)
+        return self._ao_view[idx % len(self._ao_view)]
+
+    def _advance(self):
+        """
+        Run the table up to now. Call with the lock held.
+        """
+        if self._t0 is None:
+            self._t0 = time.perf_counter()
+        pos = int((time.perf_counter() - self._t0) * self.sample_hz)
+        if pos > self._sim_pos:
+            cap = len(self._history)
+            first = max(self._sim_pos, pos - cap)
+            idx = np.arange(first, pos)
+            drive = self._ao_at(self._t0 + idx / self.sample_hz)
+            meas = self.plant.process(drive) if self.plant is not None else drive
+            self._history[idx % cap] = meas.reshape(len(idx), -1)
+            self._sim_pos = pos
+
+    def _measured_at(self, t):
+        idx = np.rint((np.asarray(t) - self._t0) * self.sample_hz).astype(np.int64)
+        idx = np.clip(idx, self._sim_pos - len(self._history), self._sim_pos - 1)
+        return self._history[idx % len(self._history)]
+
+    # --- AO ---
+
+    def write(self, volts: float):
+        lo, hi = self.ao_limits
+        with self._lock:
+            self._advance()
+            self.level = max(lo, min(hi, float(volts)))
+
+    # --- AO scan ---
+
+    def create_ao_buffer(self, samples: int) -> np.ndarray:
+        self._ao_view = np.full(int(samples), max(self.ao_limits[0], 0.0))
+        return self._ao_view
+
+    def write_ao_block(self, start: int, samples):
+        lo, hi = self.ao_limits
+        stop = start + len(samples)
+        np.clip(samples, lo, hi, out=self._ao_view[start:stop])
+
+    def start_ao_scan(self, rate_hz: float) -> float:
+        if self._ao_view is None:
+            raise RuntimeError("AO scan buffer not allocated.")
+        with self._lock:
+            self._advance()
+            self._scan_rate = float(rate_hz)
+            self._scan_t0 = time.perf_counter()
+            self._scan_pos = 0
+        return self._scan_rate
+
+    def ao_scan_position(self) -> int:
+        if self._scan_t0 is None:
+            raise RuntimeError("AO scan is not running.")
+        with self._lock:
+            self._advance()
+            pos = int((time.perf_counter() - self._scan_t0) * self._scan_rate)
+            if pos > self._scan_pos:
+                if self.record:
+                    idx = np.arange(self._scan_pos, pos) % len(self._ao_view)
+                    self.played.append(self._ao_view[idx])
+                self._scan_pos = pos
+        return pos
+
+    def stop_ao_scan(self):
+        with self._lock:
+            if self._scan_t0 is not None:
+                self._advance()
+                last = max(self._scan_pos - 1, 0) % len(self._ao_view)
+                self.level = float(self._ao_view[last])
+            self._scan_t0 = None
+            self._ao_view = None
+
+    # --- AI ---
+
+    def read(self) -> float:
+        with self._lock:
+            self._advance()
+            return float(self._measured_at(time.perf_counter())[0])
+
+    # --- AI scan ---
+
+    def create_ai_buffer(self, samples: int) -> np.ndarray:
+        self._ai_view = np.zeros(int(samples) * len(self.ai_channels))
+        return self._ai_view
+
+    def start_ai_scan(self, rate_hz: float) -> float:
+        if self._ai_view is None:
+            raise RuntimeError("AI scan buffer not allocated.")
+        with self._lock:
+            self._advance()
+            self._ai_rate = float(rate_hz)
+            self._ai_t0 = time.perf_counter()
+            self._ai_pos = 0
+        return self._ai_rate
+
+    def ai_scan_position(self) -> int:
+        if self._ai_t0 is None:
+            raise RuntimeError("AI scan is not running.")
+        with self._lock:
+            self._advance()
+            pos = int((time.perf_counter() - self._ai_t0) * self._ai_rate)
+            if pos > self._ai_pos:
+                # Only the last buffer-full survives, as on the hardware
+                scans = self._ai_view.reshape(-1, len(self.ai_channels))
+                first = max(self._ai_pos, pos - len(scans))
+                idx = np.arange(first, pos)
+                t = self._ai_t0 + idx / self._ai_rate
+                scans[idx % len(scans)] = self._measured_at(t)
+                self._ai_pos = pos
+        return pos
+
+    def stop_ai_scan(self):
+        self._ai_t0 = None
+        self._ai_view = None
+
+    def close(self):
+        self.stop_ai_scan()
+        self.stop_ao_scan()
+        self.write(0.0)
+
+
+def bench_control(mode, params, seconds=20.0, sample_hz=5000, block=500, seed=0):
+    """
+    Run a generator closed-loop against TablePlant as fast as possible
+    (no real-time pacing), reproducibly for a given seed. Returns the
+    final status and the mean compute time per block.
+    """
+    from config import Calibration, SimPlant
+    from channels import channel_gains
+    import waveform as wf
+
+    cal = Calibration()
+    gain = channel_gains(cal, 1)[0]
+    plant = TablePlant(SimPlant(), sample_hz, seed=seed)
+    gen = wf.make_generator(mode, params, sample_hz)
+    np.random.seed(seed)
+
+    blocks = int(seconds * sample_hz / block)
+    t0 = time.perf_counter()
+    for i in range(blocks):
+        gen_n = i * block
+        drive = np.clip(cal.DAC_OFFSET + cal.DAC_SCALE * gen.render(block), 0.0, 5.0)
+        meas_v = plant.process(drive)
+        if hasattr(gen, "observe_pair"):
+            t = (gen_n + np.arange(block)) / sample_hz
+            gen.observe_pair(t, drive, meas_v * gain)
+        elif hasattr(gen, "observe"):
+            gen.observe(meas_v * gain)
+    per_block = (time.perf_counter() - t0) / blocks
+    return getattr(gen, "status", None), per_block
+
+
+def bench_output(mode, params, seconds=5.0, sample_hz=5000, buffer_samples=1000):
+    """
+    Stream a mode through WaveformOutputWorker into a SimDAQ in real time
+    and report the achieved rate and underruns.
+    """
+    from config import Calibration
+    from output_worker import WaveformOutputWorker
+
+    dac = SimDAQ(sample_hz=sample_hz, record=True)
+    dac.connect()
+    worker = WaveformOutputWorker(dac, sample_hz, buffer_samples)
+    worker.update_settings(mode, params, Calibration())
+    worker.start()
+    time.sleep(seconds)
+    worker.stop()
+    played = sum(len(b) for b in dac.played)
+    return worker.actual_hz, worker.underruns, played / seconds
+
+
+if __name__ == "__main__":
+    import argparse
+    from config import RandomControl
+    from output_worker import DEFAULT_PARAMS
+
+    ap = argparse.ArgumentParser(description="Benchmark control loops and output against the simulated table.")
+    ap.add_argument("--mode", default="Sine")
+    ap.add_argument("--closed-loop", action="store_true")
+    ap.add_argument("--seconds", type=float, default=5.0, help="real-time output run")
+    ap.add_argument("--control-seconds", type=float, default=60.0, help="simulated closed-loop run")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    params = dict(DEFAULT_PARAMS, closed_loop=args.closed_loop,
+                  asd=RandomControl().PROFILE)
+    status, per_block = bench_control(args.mode, params, args.control_seconds, seed=args.seed)
+    print(f"control: status={status} {per_block * 1e3:.3f} ms/block")
+    rate, underruns, played_hz = bench_output(args.mode, params, args.seconds)
+    print(f"output: {rate:.1f} Hz clock, {played_hz:.1f} Hz played, {underruns} underruns")
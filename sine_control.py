@@ -0,0 +1,133 @@
+# vtc/sine_control.py
+import numpy as np
+from scipy.signal import lfilter
+
+from config import SineControl
+
+TWO_PI = 2.0 * np.pi
+
+
+class ToneTracker:
+    """
+    Streaming amplitude detector at a known frequency.
+
+    The input is DC-blocked (one-pole high-pass at f/20), mixed down with a
+    local oscillator at `freq` and smoothed by two one-pole low-passes, i.e.
+    a sliding Goertzel-style single-bin DFT with exponential memory. Every
+    stage is a first-order recursion run through lfilter, so the cost is
+    O(1) per sample whatever the block size, and the filter state carries
+    over between blocks.
+    """
+
+    def __init__(self, sample_hz, bandwidth_hz=2.0):
+        self.dt = 1.0 / float(sample_hz)
+        self.bandwidth_hz = float(bandwidth_hz)
+        self.phase = 0.0
+        self.amplitude = 0.0
+
+        self._x_prev = 0.0
+        self._hp_prev = 0.0
+        self._lp_prev = np.zeros(2, dtype=complex)
+
+    def process(self, x, freq):
+        """
+        Feed a block of samples; returns the current peak amplitude.
+        """
+        x = np.asarray(x, dtype=float)
+        n = len(x)
+        if n == 0:
+            return self.amplitude
+        freq = max(float(freq), 1e-3)
+
+        a = np.exp(-TWO_PI * freq / 20.0 * self.dt)
+        zi = [a * (self._hp_prev - self._x_prev)]
+        ac, _ = lfilter([a, -a], [1.0, -a], x, zi=zi)
+        self._x_prev = x[-1]
+        self._hp_prev = ac[-1]
+
+        w = TWO_PI * freq * self.dt
+        y = ac * np.exp(-1j * (self.phase + w * np.arange(n)))
+        self.phase = (self.phase + w * n) % TWO_PI
+
+        bw = min(self.bandwidth_hz, freq / 8.0)
+        a = np.exp(-TWO_PI * bw * self.dt)
+        for i in range(2):
+            y, _ = lfilter([1.0 - a], [1.0, -a], y, zi=[a * self._lp_prev[i]])
+            self._lp_prev[i] = y[-1]
+
+        self.amplitude = 2.0 * abs(y[-1])
+        return self.amplitude
+
+
+class SineControlGen:
+    """
+    Closed-loop wrapper around a sine-type block generator.
+
+    The wrapped generator keeps producing the waveform; this object owns
+    its amplitude. observe(meas_g) tracks the response amplitude at the
+    current drive frequency and moves the drive towards `target_g`,
+    correcting LOOP_GAIN of the dB error per update and never faster than
+    COMPRESSION_DB_S. The "amp" parameter becomes the drive limit. Once
+    locked, the error is checked against ALARM_DB / ABORT_DB; an abort
+    silences the drive.
+    """
+
+    def __init__(self, sample_hz, params, inner, cfg=None):
+        self.cfg = cfg or SineControl()
+        self.sample_hz = float(sample_hz)
+        self.inner = inner
+        self.tracker = ToneTracker(sample_hz, self.cfg.TRACK_BW_HZ)
+
+        self.status = "LOCKING"
+        self.aborted = False
+        self.locked = False
+        self.measured_g = 0.0
+        self.error_db = 0.0
+        self._abort_time = 0.0
+
+        self.update(params)
+        self.drive_amp = self.limit * self.cfg.START_FRACTION
+
+    def update(self, p):
+        self.inner.update(p)
+        self.limit = max(float(p["amp"]), 0.0)
+        self.target_g = max(float(p["target_g"]), 1e-6)
+
+    def render(self, n):
+        if self.aborted:
+            return np.full(n, self.inner.level("dc"))
+        self.drive_amp = min(self.drive_amp, self.limit)
+        self.inner.hold("amp", self.drive_amp)
+        return self.inner.render(n)
+
+    def observe(self, meas_g):
+        if self.aborted or not len(meas_g):
+            return
+        cfg = self.cfg
+        dt = len(meas_g) / self.sample_hz
+
+        self.measured_g = self.tracker.process(meas_g, self.inner.current_freq())
+        self.error_db = 20.0 * np.log10(self.target_g / max(self.measured_g, 1e-9))
+
+        max_step = cfg.COMPRESSION_DB_S * dt
+        step = np.clip(cfg.LOOP_GAIN * self.error_db, -max_step, max_step)
+        self.drive_amp = min(self.drive_amp * 10.0 ** (step / 20.0), self.limit)
+        self.drive_amp = max(self.drive_amp, 1e-6)
+
+        err = abs(self.error_db)
+        if not self.locked:
+            self.locked = err <= cfg.ALARM_DB
+            if not self.locked:
+                self.status = "LOCKING"
+                return
+
+        if err > cfg.ABORT_DB:
+            self._abort_time += dt
+            if self._abort_time >= cfg.ABORT_HOLD_S:
+                self.status = "ABORT"
+                self.aborted = True
+                return
+        else:
+            self._abort_time = 0.0
+
+        self.status = "ALARM" if err > cfg.ALARM_DB else "OK"
@@ -0,0 +1,158 @@
+# vtc/spectrum.py
+import threading
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+
+@dataclass
+class SpectrumResult:
+    """
+    One published set of spectra. `psd` is the response PSD in g²/Hz,
+    `h1_mag` / `h1_phase_deg` the drive-to-response transfer function in
+    g/V and `coherence` the ordinary coherence, all on `freqs`.
+    """
+    freqs: np.ndarray
+    psd: np.ndarray
+    h1_mag: np.ndarray
+    h1_phase_deg: np.ndarray
+    coherence: np.ndarray
+    frames: int
+
+
+class CrossSpectrum:
+    """
+    Incremental Welch estimate of Gxx, Gyy and Gxy for a drive x and a
+    response y.
+
+    Samples are pushed in arbitrary blocks. Each time a Hann-windowed,
+    50 %-overlapped frame completes it is transformed and folded into the
+    averages (linear until `averages` frames, exponential after), so the
+    cost is one FFT pair per frame.
+    """
+
+    def __init__(self, frame_len, sample_hz, averages=16):
+        self.N = max(4, int(frame_len) // 2 * 2)
+        self.hop = self.N // 2
+        self.averages = max(1, int(averages))
+        self.freqs = np.fft.rfftfreq(self.N, 1.0 / sample_hz)
+
+        self.window = np.hanning(self.N + 1)[:-1]
+        scale = np.full(len(self.freqs), 2.0 / (sample_hz * np.sum(self.window ** 2)))
+        scale[0] *= 0.5
+        scale[-1] *= 0.5
+        self.scale = scale
+        self.reset()
+
+    def reset(self):
+        nb = len(self.freqs)
+        self.gxx = np.zeros(nb)
+        self.gyy = np.zeros(nb)
+        self.gxy = np.zeros(nb, dtype=complex)
+        self.count = 0
+        self.pending = np.zeros((2, 0))
+
+    def push(self, x, y):
+        """
+        Add matching drive/response samples; returns the number of frames
+        added. A NaN in either stream (lost or missing samples) discards
+        the partial frame rather than averaging across the gap.
+        """
+        block = np.vstack([x, y])
+        bad = np.flatnonzero(np.isnan(block).any(axis=0))
+        if len(bad):
+            self.pending = np.zeros((2, 0))
+            block = block[:, bad[-1] + 1:]
+        self.pending = np.concatenate([self.pending, block], axis=1)
+
+        added = 0
+        while self.pending.shape[1] >= self.N:
+            frame = self.pending[:, :self.N]
+            frame = (frame - frame.mean(axis=1, keepdims=True)) * self.window
+            X, Y = np.fft.rfft(frame, axis=1)
+
+            self.count += 1
+            alpha = 1.0 / min(self.count, self.averages)
+            self.gxx += alpha * (np.abs(X) ** 2 * self.scale - self.gxx)
+            self.gyy += alpha * (np.abs(Y) ** 2 * self.scale - self.gyy)
+            self.gxy += alpha * (np.conj(X) * Y * self.scale - self.gxy)
+
+            self.pending = self.pending[:, self.hop:]
+            added += 1
+        return added
+
+    def result(self):
+        tiny = 1e-30
+        h1 = self.gxy / np.maximum(self.gxx, tiny)
+        coh = np.abs(self.gxy) ** 2 / np.maximum(self.gxx * self.gyy, tiny)
+        return SpectrumResult(
+            freqs=self.freqs,
+            psd=self.gyy.copy(),
+            h1_mag=np.abs(h1),
+            h1_phase_deg=np.degrees(np.angle(h1)),
+            coherence=np.clip(coh, 0.0, 1.0),
+            frames=self.count,
+        )
+
+
+class SpectrumWorker:
+    """
+    Background thread feeding a CrossSpectrum from the sample stream.
+
+    The response is the control signal from the acquisition ring (g); the
+    drive is looked up in the output worker's command ring at the same
+    timestamps. After every poll that completed a frame, a new
+    SpectrumResult is published by a single reference assignment, so the
+    Qt thread only ever redraws precomputed arrays.
+    """
+
+    def __init__(self, response_ring, drive_ring, frame_len=4096,
+                 averages=16, poll_s=0.1):
+        self.response_ring = response_ring
+        self.drive_ring = drive_ring
+        self.frame_len = frame_len
+        self.averages = averages
+        self.poll_s = float(poll_s)
+
+        self.result = None
+        self.running = False
+        self.thread = None
+        self._reset = True
+
+    def reset(self):
+        """
+        Restart the averages (e.g. at the start of a run).
+        """
+        self._reset = True
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout=1.0)
+            self.thread = None
+
+    def _run(self):
+        spec = None
+        sub = self.response_ring.subscribe()
+        while self.running:
+            if self._reset or spec is None:
+                self._reset = False
+                spec = CrossSpectrum(self.frame_len, self.response_ring.sample_hz, self.averages)
+                sub.seek()
+                self.result = None
+
+            block, _ = sub.poll()
+            if len(block.v):
+                drive = self.drive_ring.sample_at(block.t)
+                if spec.push(drive, block.v):
+                    self.result = spec.result()
+
+            time.sleep(self.poll_s)
@@ -0,0 +1,218 @@
+# vtc/srs.py
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+from scipy.signal import lfilter
+
+from config import ShockSRS
+from random_control import asd_at
+
+
+def srs_freqs(cfg):
+    return np.geomspace(cfg.F_MIN_HZ, cfg.F_MAX_HZ, max(2, int(cfg.POINTS)))
+
+
+def smallwood_coeffs(freqs, sample_hz, q):
+    """
+    Smallwood ramp-invariant filter coefficients for the absolute
+    acceleration of a base-excited SDOF system, one row per natural
+    frequency. Returns (b, a), each (n, 3).
+    """
+    freqs = np.asarray(freqs, dtype=float)
+    dt = 1.0 / sample_hz
+    zeta = 0.5 / q
+    wn = 2.0 * np.pi * freqs
+    wd = wn * np.sqrt(1.0 - zeta ** 2)
+    E = np.exp(-zeta * wn * dt)
+    K = wd * dt
+    C = E * np.cos(K)
+    sp = E * np.sin(K) / K
+
+    b = np.column_stack([1.0 - sp, 2.0 * (sp - C), E ** 2 - sp])
+    a = np.column_stack([np.ones_like(freqs), -2.0 * C, E ** 2])
+    return b, a
+
+
+def srs_batch(accel, sample_hz, freqs, q):
+    """
+    Positive and negative peak absolute acceleration of the SDOF response
+    to `accel` at each natural frequency in `freqs`.
+    """
+    b, a = smallwood_coeffs(freqs, sample_hz, q)
+    pos = np.empty(len(freqs))
+    neg = np.empty(len(freqs))
+    for i in range(len(freqs)):
+        y = lfilter(b[i], a[i], accel)
+        pos[i] = y.max()
+        neg[i] = y.min()
+    return pos, neg
+
+
+def _warm():
+    return os.getpid()
+
+
+@dataclass
+class SRSResult:
+    """
+    SRS of one captured shock, in g. `neg` holds the (negative) minimum
+    response; maximax is max(pos, -neg).
+    """
+    freqs: np.ndarray
+    pos: np.ndarray
+    neg: np.ndarray
+    q: float
+    peak_g: float
+    compute_s: float
+
+    @property
+    def maximax(self):
+        return np.maximum(self.pos, -self.neg)
+
+
+def tolerance_band(freqs, reference, tolerance_db):
+    """
+    Lower / upper limits around the reference SRS breakpoints (Hz:g,
+    log-log interpolated), NaN outside the reference.
+    """
+    ref = asd_at(freqs, reference)
+    ref[ref <= 0.0] = np.nan
+    k = 10.0 ** (tolerance_db / 20.0)
+    return ref / k, ref * k
+
+
+def check_tolerance(result, reference, tolerance_db):
+    """
+    Summary of the maximax SRS against the tolerance band: pass/fail and
+    the frequency and amount (dB) of the worst excursion.
+    """
+    lo, hi = tolerance_band(result.freqs, reference, tolerance_db)
+    mm = np.maximum(result.maximax, 1e-12)
+    inside = ~np.isnan(lo)
+    if not inside.any():
+        return {"passed": None, "worst_hz": None, "worst_db": None}
+    over = np.where(inside, 20.0 * np.log10(mm / hi), -np.inf)
+    under = np.where(inside, 20.0 * np.log10(lo / mm), -np.inf)
+    excess = np.maximum(over, under)
+    i = int(np.argmax(excess))
+    return {"passed": bool(excess[i] <= 0.0), "worst_hz": float(result.freqs[i]),
+            "worst_db": float(excess[i])}
+
+
+class ShockCapture:
+    """
+    Cuts the measured shock out of the sample stream.
+
+    arm() starts watching the drive (command ring) for the pulse: the
+    first sample more than `threshold_v` away from `level_v`. Once the
+    response ring holds POST_S past that instant, poll() returns the
+    response (control signal, g) from PRE_S before to POST_S after it,
+    with the pre-pulse mean removed. One capture per arm().
+    """
+
+    def __init__(self, drive_ring, response_ring, cfg=None):
+        self.drive_ring = drive_ring
+        self.response_ring = response_ring
+        self.cfg = cfg or ShockSRS()
+        self._sub = drive_ring.subscribe()
+        self.armed = False
+        self.t_pulse = None
+
+    def arm(self, level_v, threshold_v):
+        self.level_v = float(level_v)
+        self.threshold_v = abs(float(threshold_v))
+        self._sub.seek()
+        self.t_pulse = None
+        self.armed = True
+
+    def disarm(self):
+        self.armed = False
+
+    def poll(self):
+        if not self.armed:
+            return None
+        cfg = self.cfg
+        if self.t_pulse is None:
+            block, _ = self._sub.poll()
+            hit = np.flatnonzero(np.abs(block.v - self.level_v) > self.threshold_v)
+            if not len(hit):
+                return None
+            self.t_pulse = float(block.t[hit[0]])
+
+        ring = self.response_ring
+        if ring.total == 0 or ring.t_origin + ring.total / ring.sample_hz < self.t_pulse + cfg.POST_S:
+            return None
+        self.armed = False
+
+        n_pre = int(cfg.PRE_S * ring.sample_hz)
+        n = n_pre + int(cfg.POST_S * ring.sample_hz)
+        t = self.t_pulse + (np.arange(n) - n_pre) / ring.sample_hz
+        accel = ring.sample_at(t)
+        accel = accel[~np.isnan(accel)]
+        pre = accel[:n_pre]
+        return accel - (pre.mean() if len(pre) else 0.0)
+
+
+class SRSWorker:
+    """
+    Computes SRS on a process pool so the Qt thread never waits on it.
+
+    start() spawns the pool and touches every worker once, so interpreter
+    start-up and the numpy/scipy imports are paid before the pulse, not
+    after it. submit() pads the record with 1/F_MIN_HZ of zeros (so the
+    residual response is included) and splits the natural frequencies
+    into one batch per worker; result() returns the SRSResult once every
+    batch is back, else None.
+    """
+
+    def __init__(self, sample_hz, cfg=None):
+        self.cfg = cfg or ShockSRS()
+        self.sample_hz = float(sample_hz)
+        self.freqs = srs_freqs(self.cfg)
+        self.workers = int(self.cfg.WORKERS) or os.cpu_count() or 1
+        self.pool = None
+        self._pending = None
+
+    def start(self):
+        if self.pool is not None:
+            return
+        self.pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        for _ in range(self.workers):
+            self.pool.submit(_warm)
+
+    def stop(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+        self._pending = None
+
+    def submit(self, accel):
+        self.start()
+        accel = np.asarray(accel, dtype=float)
+        padded = np.concatenate([accel, np.zeros(int(self.sample_hz / self.cfg.F_MIN_HZ))])
+        batches = np.array_split(np.arange(len(self.freqs)), self.workers)
+        futures = [self.pool.submit(srs_batch, padded, self.sample_hz, self.freqs[idx], self.cfg.Q)
+                   for idx in batches if len(idx)]
+        peak = float(np.max(np.abs(accel))) if len(accel) else 0.0
+        self._pending = (futures, peak, time.perf_counter())
+
+    def result(self):
+        if self._pending is None:
+            return None
+        futures, peak, t0 = self._pending
+        if not all(f.done() for f in futures):
+            return None
+        self._pending = None
+        parts = [f.result() for f in futures]
+        return SRSResult(
+            freqs=self.freqs,
+            pos=np.concatenate([p[0] for p in parts]),
+            neg=np.concatenate([p[1] for p in parts]),
+            q=self.cfg.Q,
+            peak_g=peak,
+            compute_s=time.perf_counter() - t0,
+        )
@@ -0,0 +1,454 @@
+# vtc/telemetry.py
+import asyncio
+import json
+import socket
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from config import Telemetry
+
+POLICIES = ("drop_oldest", "drop_newest", "disconnect")
+
+
+def _encode(msg):
+    return (json.dumps(msg, separators=(",", ":")) + "\n").encode()
+
+
+def _rounded(x, digits):
+    return [None if v != v else v for v in np.round(x, digits).tolist()]
+
+
+def decimate_minmax(x, k):
+    """
+    Min and max of every `k` samples of x (len(x) a multiple of k), NaN
+    samples ignored.
+    """
+    x = np.asarray(x, dtype=float).reshape(-1, k)
+    return np.fmin.reduce(x, axis=1), np.fmax.reduce(x, axis=1)
+
+
+class _Client:
+    """
+    One connected client: its own message backlog, drop policy and writer
+    task. offer() never waits, so a slow client only ever loses its own
+    messages.
+    """
+
+    def __init__(self, writer, policy, queue_len, send_buffer=None):
+        self.writer = writer
+        sock = writer.get_extra_info("socket")
+        if send_buffer:
+            # Bounds what the kernel and the transport hold for a stalled
+            # client; beyond that its backlog and drop policy take over
+            if sock is not None:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, int(send_buffer))
+            writer.transport.set_write_buffer_limits(high=int(send_buffer))
+        self.peer = writer.get_extra_info("peername")
+        self.policy = policy
+        self.queue_len = max(1, int(queue_len))
+        self.queue = deque()
+        self.status = None          # latest status message, never queued behind samples
+        self.wake = asyncio.Event()
+        self.sent = 0
+        self.dropped = 0
+        self.closed = False
+
+    def offer(self, data):
+        """
+        Queue a sample message; False if the policy says to disconnect.
+        """
+        if len(self.queue) >= self.queue_len:
+            if self.policy == "disconnect":
+                return False
+            self.dropped += 1
+            if self.policy == "drop_newest":
+                return True
+            self.queue.popleft()
+        self.queue.append(data)
+        self.wake.set()
+        return True
+
+    def set_status(self, data):
+        self.status = data
+        self.wake.set()
+
+    async def run(self):
+        try:
+            while not self.closed:
+                await self.wake.wait()
+                self.wake.clear()
+                while self.status is not None or self.queue:
+                    if self.status is not None:
+                        data, self.status = self.status, None
+                    else:
+                        data = self.queue.popleft()
+                    self.writer.write(data)
+                    # Waits only on this client's socket buffer
+                    await self.writer.drain()
+                    self.sent += 1
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.wake.set()
+            self.writer.close()
+
+
+class TelemetryServer:
+    """
+    Streams the run to any number of TCP clients (newline-delimited JSON),
+    from an asyncio loop on its own thread.
+
+    Every SEND_PERIOD_S the pump reads what is new in the response ring
+    (the control signal, g) with the drive that produced it from the
+    command ring (`delay_s` earlier, Calibration.DELAY_S), folds it into
+    POINTS_HZ min/max bins and encodes one "samples" message that is
+    offered to every client. Every STATUS_PERIOD_S each client gets a
+    "status" message: the latest publish_status() dict, metrics over the
+    last METRICS_S and the number of messages it has lost. A client may
+    send one JSON line {"policy": ..., "queue": n} to choose its own drop
+    policy and backlog.
+
+    The pump reads through its own subscription to the response ring
+    (views, no copies), so neither a slow client nor a slow server can
+    hold up acquisition; samples it falls too far behind on are counted
+    in `lost_samples`.
+    """
+
+    def __init__(self, drive_ring, response_ring=None, cfg=None, delay_s=0.0):
+        self.cfg = cfg or Telemetry()
+        self.drive_ring = drive_ring
+        self.delay_s = float(delay_s)
+        self.response_ring = response_ring
+        self.clients = []
+        self.port = None
+        self.pump_max_s = 0.0
+        self.lost_samples = 0
+        self._status = {}
+        self._loop = None
+        self._stopping = None
+        self._handlers = set()
+        self._ready = threading.Event()
+        self.thread = None
+        self.error = None
+        self.t_ref = time.perf_counter()
+
+    @property
+    def source(self):
+        return self.response_ring if self.response_ring is not None else self.drive_ring
+
+    def publish_status(self, status):
+        """
+        Called from the GUI thread; picked up by the next status message.
+        """
+        self._status = dict(status)
+
+    def start(self, timeout=5.0):
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self._thread_main, daemon=True)
+        self.thread.start()
+        self._ready.wait(timeout)
+        if self.error is not None:
+            raise self.error
+
+    def stop(self):
+        if self._loop is not None and self._stopping is not None:
+            self._loop.call_soon_threadsafe(self._stopping.set)
+        if self.thread is not None:
+            self.thread.join(timeout=2.0)
+            self.thread = None
+
+    def _thread_main(self):
+        try:
+            asyncio.run(self._main())
+        except Exception as e:
+            self.error = e
+            self._ready.set()
+
+    async def _main(self):
+        cfg = self.cfg
+        self._loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        server = await asyncio.start_server(self._on_connect, cfg.HOST, cfg.PORT)
+        self.port = server.sockets[0].getsockname()[1]
+        self._ready.set()
+
+        pump = asyncio.create_task(self._pump())
+        await self._stopping.wait()
+        pump.cancel()
+        server.close()
+        for c in list(self.clients):
+            c.close()
+        # Let the connection handlers finish rather than cancelling them
+        if self._handlers:
+            await asyncio.wait(self._handlers, timeout=1.0)
+        await server.wait_closed()
+
+    async def _on_connect(self, reader, writer):
+        cfg = self.cfg
+        if len(self.clients) >= cfg.MAX_CLIENTS:
+            writer.write(_encode({"type": "error", "message": "too many clients"}))
+            writer.close()
+            return
+        client = _Client(writer, cfg.POLICY, cfg.QUEUE_MESSAGES, cfg.SEND_BUFFER_BYTES)
+        self.clients.append(client)
+        handler = asyncio.current_task()
+        self._handlers.add(handler)
+        ring = self.source
+        client.set_status(_encode({
+            "type": "hello", "sample_hz": ring.sample_hz, "points_hz": self._points_hz(),
+            "policy": client.policy, "queue": client.queue_len,
+            "response": "meas_g" if self.response_ring is not None else None,
+        }))
+        task = asyncio.create_task(client.run())
+        try:
+            while not client.closed:
+                line = await reader.readline()
+                if not line:
+                    break
+                self._configure(client, line)
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            client.close()
+            self.clients.remove(client)
+            self._handlers.discard(handler)
+        await task
+
+    @staticmethod
+    def _configure(client, line):
+        try:
+            req = json.loads(line)
+        except ValueError:
+            return
+        if not isinstance(req, dict):
+            return
+        if req.get("policy") in POLICIES:
+            client.policy = req["policy"]
+        if isinstance(req.get("queue"), int) and req["queue"] > 0:
+            client.queue_len = req["queue"]
+
+    def _points_hz(self):
+        ring = self.source
+        return ring.sample_hz / max(1, int(round(ring.sample_hz / self.cfg.POINTS_HZ)))
+
+    async def _pump(self):
+        cfg = self.cfg
+        sub = self.source.subscribe()
+        last_status = 0.0
+        while True:
+            await asyncio.sleep(cfg.SEND_PERIOD_S)
+            t0 = time.perf_counter()
+            data = self._samples_message(sub)
+            if data is not None:
+                for c in list(self.clients):
+                    if not c.offer(data):
+                        c.close()
+            if t0 - last_status >= cfg.STATUS_PERIOD_S:
+                last_status = t0
+                metrics = self._metrics()
+                for c in list(self.clients):
+                    c.set_status(_encode({"type": "status", "t": t0 - self.t_ref,
+                                          "status": self._status, "metrics": metrics,
+                                          "dropped": c.dropped, "sent": c.sent}))
+            self.pump_max_s = max(self.pump_max_s, time.perf_counter() - t0)
+
+    def _samples_message(self, sub):
+        """
+        Everything new on subscription `sub`, as whole min/max bins; a
+        partial bin is left for the next call. Returns the encoded message
+        or None.
+        """
+        ring = self.source
+        block, dropped = sub.poll()
+        self.lost_samples += dropped
+        k = max(1, int(round(ring.sample_hz / self.cfg.POINTS_HZ)))
+        n = len(block.t) // k * k
+        sub.seek(block.start + n)
+        if n == 0:
+            return None
+        t = block.t[:n]
+        resp = block.v[:n]
+        if self.response_ring is not None:
+            drive = self.drive_ring.sample_at(t - self.delay_s)
+        else:
+            drive, resp = resp, None
+
+        msg = {"type": "samples", "t0": round(float(t[0]) - self.t_ref, 6),
+               "dt": k / ring.sample_hz}
+        lo, hi = decimate_minmax(drive, k)
+        msg["cmd_min"], msg["cmd_max"] = _rounded(lo, 4), _rounded(hi, 4)
+        if resp is not None:
+            lo, hi = decimate_minmax(resp, k)
+            msg["meas_min"], msg["meas_max"] = _rounded(lo, 4), _rounded(hi, 4)
+        return _encode(msg)
+
+    def _metrics(self):
+        def stats(x):
+            x = x[~np.isnan(x)]
+            if not len(x):
+                return None, None
+            return float(np.sqrt(np.mean((x - x.mean()) ** 2))), float(np.max(np.abs(x - x.mean())))
+
+        ring = self.source
+        block = ring.latest(int(self.cfg.METRICS_S * ring.sample_hz))
+        out = {"window_s": self.cfg.METRICS_S, "clients": len(self.clients),
+               "lost_samples": self.lost_samples}
+        if self.response_ring is not None:
+            out["meas_rms_g"], out["meas_peak_g"] = stats(np.asarray(block.v, dtype=float))
+            out["cmd_rms_v"], _ = stats(self.drive_ring.sample_at(block.t - self.delay_s))
+        else:
+            out["cmd_rms_v"], _ = stats(np.asarray(block.v, dtype=float))
+        return out
+
+
+async def read_messages(host, port, policy=None, queue=None, on_message=None, read_delay_s=0.0,
+                        recv_buffer=None):
+    """
+    Reference client: connect, optionally choose policy / backlog, and call
+    on_message(dict) for every message until the server closes. A
+    `read_delay_s` pause after each message (with a small `recv_buffer`)
+    simulates a slow reader.
+    """
+    sock = socket.create_connection((host, port))
+    if recv_buffer:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, int(recv_buffer))
+    # A slow reader also keeps little in its stream buffer, so the server sees it
+    limit = max(int(recv_buffer), 1 << 13) if recv_buffer else 1 << 22
+    reader, writer = await asyncio.open_connection(sock=sock, limit=limit)
+    req = {k: v for k, v in (("policy", policy), ("queue", queue)) if v is not None}
+    if req:
+        writer.write(_encode(req))
+        await writer.drain()
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if on_message is not None:
+                on_message(json.loads(line))
+            if read_delay_s:
+                await asyncio.sleep(read_delay_s)
+    finally:
+        writer.close()
+
+
+def load_test(clients=20, slow=5, seconds=20.0, sample_hz=5000, cfg=None):
+    """
+    Run the simulated table (SimDAQ, acquisition, sine output) with a
+    server on localhost and `clients` readers, `slow` of which read one
+    message per second. Returns acquisition / output health and the
+    per-client message and drop counts.
+    """
+    from config import Calibration, Runtime
+    from acquisition import AcquisitionWorker
+    from output_worker import DEFAULT_PARAMS, WaveformOutputWorker
+    from sim_daq import SimDAQ
+
+    cfg = cfg or Telemetry()
+    cfg.HOST, cfg.PORT, cfg.MAX_CLIENTS = "127.0.0.1", 0, max(cfg.MAX_CLIENTS, clients)
+    rt = Runtime()
+    cal = Calibration()
+
+    dac = SimDAQ(sample_hz=sample_hz)
+    dac.connect()
+    acq = AcquisitionWorker(dac, sample_hz, rt.AI_BUFFER_SAMPLES, rt.AI_RING_SECONDS)
+    acq.set_calibration(cal)
+    acq.start()
+    out = WaveformOutputWorker(dac, sample_hz, rt.AO_BUFFER_SAMPLES, feedback=acq.ring)
+    out.update_settings("Sine", dict(DEFAULT_PARAMS), cal)
+    out.start()
+
+    server = TelemetryServer(out.cmd_ring, acq.ring, cfg)
+    server.start()
+    served = []
+    counts = [{"samples": 0, "status": 0, "dropped": 0, "slow": i < slow} for i in range(clients)]
+
+    def counter(c):
+        def on_message(msg):
+            if msg["type"] in ("samples", "status"):
+                c[msg["type"]] += 1
+            if msg["type"] == "status":
+                c["dropped"] = msg["dropped"]
+        return on_message
+
+    async def run_clients():
+        tasks = [asyncio.create_task(read_messages(
+            "127.0.0.1", server.port, on_message=counter(c), read_delay_s=1.0 if c["slow"] else 0.0,
+            queue=10 if c["slow"] else None, recv_buffer=4096 if c["slow"] else None))
+            for c in counts]
+        await asyncio.sleep(seconds)
+        served.extend({"queue": c.queue_len, "sent": c.sent, "dropped": c.dropped}
+                      for c in list(server.clients))
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    try:
+        asyncio.run(run_clients())
+    finally:
+        server.stop()
+        out.stop()
+        acq.stop()
+        dac.close()
+    return {
+        "ai_overruns": acq.overruns,
+        "ai_lost_samples": acq.lost_samples,
+        "output_underruns": out.underruns,
+        "output_overruns": out.timing.overruns,
+        "pump_max_ms": server.pump_max_s * 1e3,
+        "clients": counts,
+        "served": served,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Telemetry reference client and load test.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    cl = sub.add_parser("client", help="print the stream of a running controller")
+    cl.add_argument("--host", default=Telemetry().HOST)
+    cl.add_argument("--port", type=int, default=Telemetry().PORT)
+    cl.add_argument("--policy", choices=POLICIES)
+    lt = sub.add_parser("loadtest", help="many clients against the simulated table")
+    lt.add_argument("--clients", type=int, default=20)
+    lt.add_argument("--slow", type=int, default=5, help="clients that read one message a second")
+    lt.add_argument("--seconds", type=float, default=20.0)
+    args = ap.parse_args()
+
+    if args.cmd == "client":
+        def show(msg):
+            if msg["type"] == "samples":
+                peak = max((abs(v) for v in msg.get("meas_max", []) + msg.get("meas_min", [])
+                            if v is not None), default=float("nan"))
+                print(f"t={msg['t0']:.2f} s  {len(msg['cmd_min'])} bins  meas peak {peak:.3f} g")
+            else:
+                print(json.dumps(msg))
+        try:
+            asyncio.run(read_messages(args.host, args.port, policy=args.policy, on_message=show))
+        except KeyboardInterrupt:
+            pass
+    else:
+        res = load_test(args.clients, args.slow, args.seconds)
+        fast = [c for c in res["clients"] if not c["slow"]]
+        slow = [c for c in res["clients"] if c["slow"]]
+        print(f"acquisition: {res['ai_overruns']} overruns, {res['ai_lost_samples']} lost samples; "
+              f"output: {res['output_underruns']} underruns, {res['output_overruns']} late ticks; "
+              f"pump max {res['pump_max_ms']:.1f} ms")
+        # Slow clients asked for a backlog of 10 messages
+        for name, group, served in (("fast", fast, [c for c in res["served"] if c["queue"] != 10]),
+                                    ("slow", slow, [c for c in res["served"] if c["queue"] == 10])):
+            if group:
+                print(f"{len(group)} {name} clients: received "
+                      f"{min(c['samples'] for c in group)}..{max(c['samples'] for c in group)} sample msgs, "
+                      f"server dropped {min(c['dropped'] for c in served)}.."
+                      f"{max(c['dropped'] for c in served)}")
@@ -0,0 +1,132 @@
+# vtc/timing.py
+import time
+
+
+class LoopTiming:
+    """
+    Cheap timing statistics for the output loop.
+
+    Tick errors (how late each tick ran against its deadline) go into a
+    histogram with power-of-two microsecond bins, so recording one is an
+    int() and a bit_length(). A tick later than `overrun_s` counts as an
+    overrun and the longest gap between ticks beyond the nominal period is
+    kept as the worst stall. DAC call latency is kept as count / total /
+    max, and the achieved sample rate is samples delivered over elapsed
+    time.
+
+    Written by the output thread only; readers just take the numbers, a
+    slightly stale snapshot is fine for display.
+    """
+
+    BINS = 24  # bin i counts errors < 2**i µs; the last bin is open-ended
+
+    def __init__(self, period_s=1.0, overrun_s=None):
+        self.reset(period_s, overrun_s)
+
+    def reset(self, period_s=None, overrun_s=None):
+        if period_s is not None:
+            self.period_s = float(period_s)
+            self.overrun_s = float(overrun_s) if overrun_s is not None else self.period_s
+        self.hist = [0] * self.BINS
+        self.ticks = 0
+        self.overruns = 0
+        self.max_error_s = 0.0
+        self.longest_stall_s = 0.0
+        self.min_margin_s = None
+        self.samples = 0
+        self.dac_calls = 0
+        self.dac_total_s = 0.0
+        self.dac_max_s = 0.0
+        self.t_start = time.perf_counter()
+        self.t_last = self.t_start
+        self._t_prev_tick = None
+
+    def tick(self, now, deadline):
+        """
+        Record one tick that ran at `now` against `deadline`. Returns True
+        if it was an overrun.
+        """
+        err = now - deadline
+        us = int(err * 1e6)
+        self.hist[min(us.bit_length(), self.BINS - 1) if us > 0 else 0] += 1
+        self.ticks += 1
+        if err > self.max_error_s:
+            self.max_error_s = err
+
+        if self._t_prev_tick is not None:
+            gap = now - self._t_prev_tick - self.period_s
+            if gap > self.longest_stall_s:
+                self.longest_stall_s = gap
+        self._t_prev_tick = now
+
+        if err > self.overrun_s:
+            self.overruns += 1
+            return True
+        return False
+
+    def margin(self, seconds):
+        """
+        Record how much output was still queued ahead of the device.
+        """
+        if self.min_margin_s is None or seconds < self.min_margin_s:
+            self.min_margin_s = seconds
+
+    def dac_call(self, seconds):
+        self.dac_calls += 1
+        self.dac_total_s += seconds
+        if seconds > self.dac_max_s:
+            self.dac_max_s = seconds
+
+    def delivered(self, samples, now):
+        """
+        Set the total number of samples delivered so far.
+        """
+        self.samples = int(samples)
+        self.t_last = now
+
+    @property
+    def achieved_hz(self):
+        elapsed = self.t_last - self.t_start
+        return self.samples / elapsed if elapsed > 0 else 0.0
+
+    def percentile_us(self, q):
+        """
+        Upper bin edge (µs) below which fraction `q` of tick errors fall.
+        """
+        want = q * self.ticks
+        seen = 0
+        for i, count in enumerate(self.hist):
+            seen += count
+            if count and seen >= want:
+                return 2 ** i
+        return 0
+
+    def summary(self):
+        """
+        Plain dict for the run-log metadata.
+        """
+        return {
+            "period_us": self.period_s * 1e6,
+            "ticks": self.ticks,
+            "overruns": self.overruns,
+            "max_tick_error_us": self.max_error_s * 1e6,
+            "p99_tick_error_us": self.percentile_us(0.99),
+            "tick_error_hist_us": {f"<{2 ** i}": c for i, c in enumerate(self.hist) if c},
+            "longest_stall_ms": self.longest_stall_s * 1e3,
+            "min_margin_ms": None if self.min_margin_s is None else self.min_margin_s * 1e3,
+            "samples": self.samples,
+            "achieved_hz": self.achieved_hz,
+            "dac_calls": self.dac_calls,
+            "dac_mean_us": self.dac_total_s / self.dac_calls * 1e6 if self.dac_calls else 0.0,
+            "dac_max_us": self.dac_max_s * 1e6,
+        }
+
+    def status_text(self):
+        text = (f"Out: {self.achieved_hz:.0f} Hz   overruns {self.overruns}   "
+                f"stall {self.longest_stall_s * 1e3:.1f} ms   "
+                f"p99 late {self.percentile_us(0.99)} µs")
+        if self.dac_calls:
+            text += f"   DAC {self.dac_total_s / self.dac_calls * 1e6:.0f}/{self.dac_max_s * 1e6:.0f} µs"
+        if self.min_margin_s is not None:
+            text += f"   margin {self.min_margin_s * 1e3:.1f} ms"
+        return text
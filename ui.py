@@ -1,163 +1,34 @@
 # vtc/ui.py
 import sys
+import threading
 import time
 import os
-import threading
+from dataclasses import asdict
 
+import numpy as np
 from PyQt5 import QtWidgets, QtCore
 import pyqtgraph as pg
 
-from config import Calibration, GPIOPins, Runtime
-from dac_uldaq import DacULDAQ
+from calibration import CalibrationError, load_calibration
+from config import (AbortLimits, Calibration, GPIOPins, Runtime, RandomControl, Replay, Replication,
+                    ResonanceSearch, ShockSRS, Telemetry)
+from daq_backend import make_daq
 from safety_gpio import SafetyController
-import waveform as wf
-from logging_utils import CSVLogger
-from export_utils import list_usb_mounts, export_files
-
-
-class WaveformOutputWorker:
-    """
-    High-rate waveform output loop, separate from the Qt GUI timer.
-    This helps with timing jitter and makes the DAC output much smoother.
-    """
-
-    def __init__(self, dac, sample_hz=5000):
-        self.dac = dac
-        self.sample_hz = max(1, int(sample_hz))
-        self.dt = 1.0 / self.sample_hz
-
-        self.running = False
-        self.thread = None
-        self.lock = threading.Lock()
-
-        self.start_time = None
-        self.last_command = 0.0
-
-        self.mode = "Manual"
-        self.params = {
-            "manual": 2.5,
-            "amp": 2.0,
-            "freq": 10.0,
-            "dc": 2.5,
-            "f_start": 0.5,
-            "f_end": 50.0,
-            "dur": 10.0,
-            "noise": 0.2,
-            "shock_t0": 1.0,
-            "shock_peak": 4.5,
-            "shock_tau": 0.02,
-        }
-
-        self.cal = Calibration()
-
-    def update_settings(self, mode, params, cal):
-        with self.lock:
-            self.mode = str(mode)
-            self.params = dict(params)
-            self.cal = cal
-
-    def start(self):
-        if self.running:
-            return
-        self.running = True
-        self.start_time = time.perf_counter()
-        self.thread = threading.Thread(target=self._run, daemon=True)
-        self.thread.start()
-
-    def stop(self):
-        self.running = False
-        if self.thread is not None:
-            self.thread.join(timeout=1.0)
-            self.thread = None
-        try:
-            self.dac.write(0.0)
-        except Exception:
-            pass
-        self.last_command = 0.0
-
-    def get_last_command(self):
-        with self.lock:
-            return float(self.last_command)
-
-    def _compute_cmd_voltage(self, mode, t, p):
-        if mode == "Manual":
-            return wf.manual(p["manual"])
-
-        if mode == "Sine":
-            return wf.sine(t, amp=p["amp"], freq_hz=p["freq"], dc=p["dc"])
-
-        if mode == "Sine Sweep":
-            return wf.sine_sweep(
-                t,
-                amp=p["amp"],
-                f_start=p["f_start"],
-                f_end=p["f_end"],
-                dur=p["dur"],
-                dc=p["dc"],
-            )
-
-        if mode == "Random Noise":
-            return wf.random_noise(dc=p["dc"], std=p["noise"])
-
-        if mode == "Sine on Random":
-            return wf.sine_on_random(
-                t,
-                amp_sine=p["amp"],
-                freq_hz=p["freq"],
-                dc=p["dc"],
-                rand_std=p["noise"],
-            )
-
-        if mode == "Resonance Dwell":
-            return wf.resonance_dwell(t, amp=p["amp"], freq_hz=p["freq"], dc=p["dc"])
-
-        if mode == "Shock":
-            return wf.shock(
-                t,
-                t0=p["shock_t0"],
-                peak=p["shock_peak"],
-                dc=p["dc"],
-                tau=p["shock_tau"],
-            )
-
-        return wf.manual(p["dc"])
-
-    def _run(self):
-        next_tick = time.perf_counter()
-
-        while self.running:
-            with self.lock:
-                mode = self.mode
-                p = dict(self.params)
-                cal = self.cal
-
-            t = time.perf_counter() - self.start_time
-            cmd_v = self._compute_cmd_voltage(mode, t, p)
-
-            out_v = cal.DAC_OFFSET + cal.DAC_SCALE * cmd_v
-            out_v = max(0.0, min(5.0, out_v))
-
-            try:
-                self.dac.write(out_v)
-            except Exception:
-                self.running = False
-                break
-
-            with self.lock:
-                self.last_command = out_v
-
-            next_tick += self.dt
-            sleep_time = next_tick - time.perf_counter()
-
-            if sleep_time > 0:
-                time.sleep(sleep_time)
-            else:
-                next_tick = time.perf_counter()
-
-        try:
-            self.dac.write(0.0)
-        except Exception:
-            pass
+from logging_utils import BinaryLogger
+from export_utils import ExportWorker, list_runs, list_usb_mounts, run_files
+from output_worker import WaveformOutputWorker
+from acquisition import AcquisitionWorker
+from channels import channel_gains
+from random_control import parse_asd
+from plot_buffer import LivePlotBuffer
+from spectrum import SpectrumWorker
+from srs import SRSWorker, ShockCapture, check_tolerance, tolerance_band
+from telemetry import TelemetryServer
+from sequencer import load_profile, compile_profile
+from replay import ReplayData
+from replication import MissingRate, ReplicationJob, prepare as prepare_replication
+from rt_sched import RTProfile
+from engine_process import EngineProcess
 
 
 class VTCApp:
@@ -168,19 +39,39 @@ class VTCApp:
     def __init__(self):
         self.app = QtWidgets.QApplication(sys.argv)
 
-        self.cal = Calibration()
         self.gpio = GPIOPins()
         self.rt = Runtime()
-
-        self.dac = DacULDAQ()
-        self.dac.connect()
+        # Problems found while starting up, shown once the window is up
+        self._startup_warnings = []
+        try:
+            self.cal = load_calibration(self.rt.CALIBRATION_FILE)
+        except CalibrationError as e:
+            self._startup_warnings.append(
+                ("Calibration", f"Calibration file not loaded; running on the default calibration.\n\n{e}"))
+            self.cal = Calibration()
+        self.rc = RandomControl()
+        # Fails early if per-channel calibration does not match the channels
+        channel_gains(self.cal, len(self.rt.AI_CHANNELS))
 
         self.safety = SafetyController(
             estop_pin=self.gpio.ESTOP_PIN,
             mute_pin=self.gpio.MUTE_PIN,
         )
 
-        self.logger = CSVLogger(self.rt.LOG_PATH)
+        # One binary log per run, opened on Start and closed on Stop
+        self.logger = None
+        self.last_log_path = None
+
+        # USB export running in the background, if any
+        self.export = None
+
+        # Resonance search results of the current run, saved with its log
+        self._res_peaks = None
+        self._res_track = []
+
+        # Last shock response spectrum and its tolerance check
+        self._srs_result = None
+        self._srs_check = None
 
         self.sample_hz = int(self.rt.SAMPLE_HZ)
         self.gui_hz = max(1, int(self.rt.GUI_HZ))
@@ -189,18 +80,62 @@ class VTCApp:
         self.running = False
         self.t0 = None
         self.last_t = 0.0
+        self.last_meas = 0.0
+        self.last_chans = None
         self._status = "INIT"
 
         self.output_params = {}
-        self.output_worker = WaveformOutputWorker(
-            dac=self.dac,
-            sample_hz=self.sample_hz,
-        )
+        self._published = None
+        self.profile_file = None
+        self.replication_cfg = Replication()
+        self.replication_job = None
+        self.engine = None
+        if self.rt.ENGINE_PROCESS:
+            self._start_engine_process()
+        else:
+            self._start_engine_local()
+
+        # Measured samples for the plot, label and log
+        self._ai_sub = self.acq.ring.subscribe()
 
-        self.xdata = []
-        self.ycmd = []
-        self.ymeas = []
-        self.max_points = 3000
+        # Response PSD / H1 / coherence, computed off the Qt thread
+        self.spectrum = SpectrumWorker(
+            response_ring=self.acq.ring,
+            drive_ring=self.output_worker.cmd_ring,
+            frame_len=self.rt.SPECTRUM_FRAME,
+            averages=self.rt.SPECTRUM_AVERAGES,
+        )
+        self.spectrum.start()
+
+        # Shock response spectrum of the measured pulse, on a process pool
+        self.srs_cfg = ShockSRS()
+        self.srs = SRSWorker(self.acq.actual_hz, self.srs_cfg)
+        self.shock_capture = ShockCapture(self.output_worker.cmd_ring, self.acq.ring,
+                                          self.srs_cfg)
+
+        # Stream to remote monitoring clients, if enabled
+        self.telemetry_cfg = Telemetry()
+        self.telemetry = None
+        self._telemetry_t = 0.0
+        if self.telemetry_cfg.ENABLE:
+            self.telemetry = TelemetryServer(self.output_worker.cmd_ring, self.acq.ring,
+                                             self.telemetry_cfg, delay_s=self.cal.DELAY_S)
+            try:
+                self.telemetry.start()
+            except OSError as e:
+                self._startup_warnings.append(("Telemetry", f"Telemetry server not started: {e}"))
+                self.telemetry = None
+
+        # Past run opened in the Replay tab (pyramid built on a helper thread)
+        self.replay_cfg = Replay()
+        self.replay = None
+        self._replay_error = None
+        self._replay_shown = False
+
+        # Full-rate plot history (cmd, meas) with min/max decimation
+        plot_hz = self.acq.actual_hz
+        self.plot_buf = LivePlotBuffer(plot_hz, max(self.rt.PLOT_WINDOWS_S), channels=2)
+        self._plot_width = 0
 
         self._build_ui()
         self._refresh_output_settings()
@@ -209,10 +144,61 @@ class VTCApp:
         self.timer = QtCore.QTimer()
         self.timer.timeout.connect(self._update)
         self.timer.start(self.gui_dt_ms)
+        QtCore.QTimer.singleShot(0, self._show_startup_warnings)
+
+    def _show_startup_warnings(self):
+        for title, text in self._startup_warnings:
+            QtWidgets.QMessageBox.warning(self.win, title, text)
+        self._startup_warnings = []
+
+    def _start_engine_local(self):
+        # Lock memory before the DAQ and workers allocate their buffers
+        self.rt_profile = RTProfile(self.rt)
+        self.rt_profile.lock_memory()
+
+        self.dac = make_daq(self.rt)
+        self.dac.connect()
+
+        # Continuous AI scan (or, without one, polled dac.read()) feeding
+        # the sample rings every consumer subscribes to
+        self.acq = AcquisitionWorker(
+            dac=self.dac,
+            sample_hz=self.sample_hz,
+            buffer_samples=self.rt.AI_BUFFER_SAMPLES,
+            ring_seconds=self.rt.AI_RING_SECONDS,
+            strategy=self.rt.CONTROL_STRATEGY,
+            weights=self.rt.CONTROL_WEIGHTS,
+            rms_s=self.rt.CONTROL_RMS_S,
+            poll_hz=self.rt.AI_POLL_HZ,
+        )
+        self.acq.set_calibration(self.cal)
+        self.acq.start()
+
+        self.output_worker = WaveformOutputWorker(
+            dac=self.dac,
+            sample_hz=self.sample_hz,
+            buffer_samples=self.rt.AO_BUFFER_SAMPLES,
+            feedback=self.acq.ring,
+            history_s=self.rt.AI_RING_SECONDS,
+            rt_profile=self.rt_profile,
+            ramp_s=self.rt.PARAM_RAMP_S,
+            limits=AbortLimits(),
+        )
+
+    def _start_engine_process(self):
+        # Same objects, backed by the engine process and shared memory
+        self.engine = EngineProcess(self.rt, self.cal)
+        self.dac = self.engine.dac
+        self.acq = self.engine.acq
+        self.output_worker = self.engine.output
+        self.rt_profile = self.engine.rt_profile
 
     def _build_ui(self):
         self.win = QtWidgets.QMainWindow()
-        self.win.setWindowTitle("Vibration Table Controller")
+        title = "Vibration Table Controller"
+        if getattr(self.dac, "simulated", False):
+            title += " (SIMULATED DAQ)"
+        self.win.setWindowTitle(title)
         self.win.resize(1024, 600)
 
         central = QtWidgets.QWidget()
@@ -257,7 +243,11 @@ class VTCApp:
             "Random Noise",
             "Sine on Random",
             "Resonance Dwell",
+            "Resonance Search",
             "Shock",
+            "Random Control",
+            "Profile",
+            "Replication",
         ])
         controls.addWidget(self.cmb_mode, row, 1, 1, 2)
         row += 1
@@ -363,6 +353,64 @@ class VTCApp:
         controls.addWidget(self.spin_tau, row, 3)
         row += 1
 
+        self.chk_closed = QtWidgets.QCheckBox("Closed-loop sine")
+        self.lbl_target = QtWidgets.QLabel("Target (g pk):")
+        self.spin_target = QtWidgets.QDoubleSpinBox()
+        self.spin_target.setRange(0.001, 50.0)
+        self.spin_target.setDecimals(3)
+        self.spin_target.setSingleStep(0.05)
+        self.spin_target.setValue(0.5)
+
+        controls.addWidget(self.chk_closed, row, 0, 1, 2)
+        controls.addWidget(self.lbl_target, row, 2)
+        controls.addWidget(self.spin_target, row, 3)
+        row += 1
+
+        self.lbl_asd = QtWidgets.QLabel("ASD profile (Hz:g²/Hz):")
+        self.edit_asd = QtWidgets.QLineEdit(self.rc.PROFILE)
+        controls.addWidget(self.lbl_asd, row, 0)
+        controls.addWidget(self.edit_asd, row, 1, 1, 3)
+        row += 1
+
+        self.lbl_srs_ref = QtWidgets.QLabel("SRS reference (Hz:g):")
+        self.edit_srs_ref = QtWidgets.QLineEdit(self.srs_cfg.REFERENCE)
+        self.edit_srs_ref.editingFinished.connect(self._redraw_srs)
+        controls.addWidget(self.lbl_srs_ref, row, 0)
+        controls.addWidget(self.edit_srs_ref, row, 1, 1, 3)
+        row += 1
+
+        self.lbl_res_peak = QtWidgets.QLabel("Dwell on peak #:")
+        self.spin_res_peak = QtWidgets.QSpinBox()
+        self.spin_res_peak.setRange(0, ResonanceSearch().MAX_PEAKS - 1)
+        self.spin_res_peak.setValue(0)
+        controls.addWidget(self.lbl_res_peak, row, 0)
+        controls.addWidget(self.spin_res_peak, row, 1)
+        row += 1
+
+        self.btn_profile = QtWidgets.QPushButton("Load profile…")
+        self.btn_profile.clicked.connect(self._on_load_profile)
+        self.lbl_profile = QtWidgets.QLabel("Profile: none")
+        controls.addWidget(self.btn_profile, row, 0)
+        controls.addWidget(self.lbl_profile, row, 1, 1, 3)
+        row += 1
+
+        self.btn_recording = QtWidgets.QPushButton("Load recording…")
+        self.btn_recording.clicked.connect(self._on_load_recording)
+        self.lbl_recording = QtWidgets.QLabel("Recording: none")
+        controls.addWidget(self.btn_recording, row, 0)
+        controls.addWidget(self.lbl_recording, row, 1, 1, 3)
+        row += 1
+
+        # A new settings snapshot is published only when a setting changes
+        for spin in (self.spin_manual, self.spin_amp, self.spin_freq, self.spin_dc,
+                     self.spin_fstart, self.spin_fend, self.spin_dur, self.spin_noise,
+                     self.spin_t0, self.spin_peak, self.spin_tau, self.spin_target,
+                     self.spin_res_peak):
+            spin.valueChanged.connect(self._refresh_output_settings)
+        self.cmb_mode.currentTextChanged.connect(self._refresh_output_settings)
+        self.chk_closed.toggled.connect(self._refresh_output_settings)
+        self.edit_asd.editingFinished.connect(self._refresh_output_settings)
+
         layout.addLayout(controls)
 
         btn_row = QtWidgets.QHBoxLayout()
@@ -382,13 +430,27 @@ class VTCApp:
         btn_row.addWidget(self.btn_start)
         btn_row.addWidget(self.btn_stop)
         btn_row.addWidget(self.btn_export)
+        self.export_bar = QtWidgets.QProgressBar()
+        self.export_bar.setRange(0, 1000)
+        self.export_bar.setMinimumWidth(260)
+        self.export_bar.hide()
+        btn_row.addWidget(self.export_bar)
         btn_row.addStretch(1)
 
+        btn_row.addWidget(QtWidgets.QLabel("Window:"))
+        self.cmb_window = QtWidgets.QComboBox()
+        self.cmb_window.addItems([f"{w:g} s" for w in self.rt.PLOT_WINDOWS_S])
+        self.cmb_window.setCurrentIndex(len(self.rt.PLOT_WINDOWS_S) // 2)
+        self.cmb_window.setMinimumHeight(40)
+        self.cmb_window.currentIndexChanged.connect(self._on_window_changed)
+        self.plot_buf.set_view(window_s=self.rt.PLOT_WINDOWS_S[self.cmb_window.currentIndex()])
+        btn_row.addWidget(self.cmb_window)
+
         layout.addLayout(btn_row)
 
         self.plot = pg.PlotWidget()
         self.plot.setLabel("bottom", "Time", units="s")
-        self.plot.setLabel("left", "Voltage", units="V")
+        self.plot.setLabel("left", "Command (V) / response (g)")
         self.plot.showGrid(x=True, y=True, alpha=0.3)
 
         self.curve_cmd = self.plot.plot(pen=pg.mkPen(width=2))
@@ -398,13 +460,274 @@ class VTCApp:
 
         legend = self.plot.addLegend(offset=(10, 10))
         legend.addItem(self.curve_cmd, "Command (V)")
-        legend.addItem(self.curve_meas, "Measured (V)")
+        legend.addItem(self.curve_meas, "Measured (g)")
 
-        layout.addWidget(self.plot, stretch=1)
+        self.tabs = QtWidgets.QTabWidget()
+        self.tabs.addTab(self.plot, "Time")
+        self.tabs.addTab(self._build_spectrum_tab(), "Spectrum")
+        self.tabs.addTab(self._build_srs_tab(), "SRS")
+        self.tabs.addTab(self._build_replay_tab(), "Replay")
+        self.tabs.currentChanged.connect(self._on_tab_changed)
+        layout.addWidget(self.tabs, stretch=1)
 
-        self.lbl_meas = QtWidgets.QLabel("Meas: 0.000 V, 0.000 g")
+        self.lbl_meas = QtWidgets.QLabel("Meas: 0.000 g")
         layout.addWidget(self.lbl_meas)
 
+        self.lbl_timing = QtWidgets.QLabel("Out: --")
+        layout.addWidget(self.lbl_timing)
+
+    def _build_spectrum_tab(self):
+        self.spec_view = pg.GraphicsLayoutWidget()
+        fmax = self.rt.SPECTRUM_FMAX_HZ
+
+        self.plot_psd = self.spec_view.addPlot(row=0, col=0)
+        self.plot_psd.setLabel("left", "Response PSD", units="g²/Hz")
+        self.plot_psd.setLogMode(y=True)
+
+        self.plot_h1 = self.spec_view.addPlot(row=0, col=1)
+        self.plot_h1.setLabel("left", "|H1|", units="g/V")
+        self.plot_h1.setLogMode(y=True)
+
+        self.plot_phase = self.spec_view.addPlot(row=1, col=1)
+        self.plot_phase.setLabel("left", "Phase", units="deg")
+        self.plot_phase.setYRange(-180, 180)
+
+        self.plot_coh = self.spec_view.addPlot(row=1, col=0)
+        self.plot_coh.setLabel("left", "Coherence")
+        self.plot_coh.setYRange(0, 1)
+
+        self.curve_psd = self.plot_psd.plot(pen=pg.mkPen(width=2))
+        self.curve_h1 = self.plot_h1.plot(pen=pg.mkPen(width=2))
+        self.curve_phase = self.plot_phase.plot(pen=pg.mkPen(width=2))
+        self.curve_coh = self.plot_coh.plot(pen=pg.mkPen(width=2))
+
+        for p in (self.plot_psd, self.plot_h1, self.plot_phase, self.plot_coh):
+            p.setLabel("bottom", "Frequency", units="Hz")
+            p.showGrid(x=True, y=True, alpha=0.3)
+            p.setXRange(0, fmax)
+            if p is not self.plot_psd:
+                p.setXLink(self.plot_psd)
+
+        self._spec_drawn = None
+        return self.spec_view
+
+    def _build_srs_tab(self):
+        self.plot_srs = pg.PlotWidget()
+        self.plot_srs.setLogMode(x=True, y=True)
+        self.plot_srs.setLabel("bottom", "Natural frequency", units="Hz")
+        self.plot_srs.setLabel("left", f"SRS (Q={self.srs_cfg.Q:g})", units="g")
+        self.plot_srs.showGrid(x=True, y=True, alpha=0.3)
+
+        legend = self.plot_srs.addLegend(offset=(10, 10))
+        self.curve_srs = self.plot_srs.plot(pen=pg.mkPen(width=2))
+        self.curve_srs_pos = self.plot_srs.plot(pen=pg.mkPen((100, 180, 255), width=1))
+        self.curve_srs_neg = self.plot_srs.plot(pen=pg.mkPen((255, 160, 80), width=1))
+        self.curve_srs_ref = self.plot_srs.plot(pen=pg.mkPen((0, 200, 0), width=1))
+        tol = pg.mkPen((0, 200, 0), width=1, style=QtCore.Qt.DashLine)
+        self.curve_srs_lo = self.plot_srs.plot(pen=tol)
+        self.curve_srs_hi = self.plot_srs.plot(pen=tol)
+        legend.addItem(self.curve_srs, "Maximax")
+        legend.addItem(self.curve_srs_pos, "Positive")
+        legend.addItem(self.curve_srs_neg, "Negative")
+        legend.addItem(self.curve_srs_ref, "Reference")
+        legend.addItem(self.curve_srs_lo, f"Tolerance ±{self.srs_cfg.TOLERANCE_DB:g} dB")
+        return self.plot_srs
+
+    def _build_replay_tab(self):
+        tab = QtWidgets.QWidget()
+        box = QtWidgets.QVBoxLayout(tab)
+        row = QtWidgets.QHBoxLayout()
+        self.cmb_replay = QtWidgets.QComboBox()
+        self.cmb_replay.setMinimumHeight(40)
+        self.cmb_replay.setMinimumWidth(320)
+        self.btn_replay = QtWidgets.QPushButton("Open run")
+        self.btn_replay.setMinimumHeight(40)
+        self.btn_replay.clicked.connect(self._on_open_replay)
+        self.lbl_replay = QtWidgets.QLabel("")
+        row.addWidget(self.cmb_replay)
+        row.addWidget(self.btn_replay)
+        row.addWidget(self.lbl_replay, stretch=1)
+        box.addLayout(row)
+
+        self.plot_replay = pg.PlotWidget()
+        self.plot_replay.setLabel("bottom", "Run time", units="s")
+        self.plot_replay.showGrid(x=True, y=True, alpha=0.3)
+        self.plot_replay.setAutoVisible(y=True)
+        self.replay_legend = self.plot_replay.addLegend(offset=(10, 10))
+        self.replay_curves = {}
+        box.addWidget(self.plot_replay, stretch=1)
+
+        # Pan / zoom redraws are coalesced to one per REDRAW_MS
+        self.replay_timer = QtCore.QTimer()
+        self.replay_timer.setSingleShot(True)
+        self.replay_timer.setInterval(self.replay_cfg.REDRAW_MS)
+        self.replay_timer.timeout.connect(self._redraw_replay)
+        self.plot_replay.sigXRangeChanged.connect(lambda *_: self.replay_timer.start())
+        self.plot_replay.getViewBox().sigResized.connect(lambda *_: self.replay_timer.start())
+        self.replay_tab = tab
+        return tab
+
+    def _on_tab_changed(self, _index):
+        if self.tabs.currentWidget() is not self.replay_tab:
+            return
+        # The run being logged is still open, so it is not offered
+        current = self.logger.path if self.logger is not None else None
+        selected = self.cmb_replay.currentData()
+        self.cmb_replay.clear()
+        for path in list_runs(self.rt.LOG_PATH):
+            if path != current:
+                self.cmb_replay.addItem(os.path.basename(path), path)
+        i = self.cmb_replay.findData(selected)
+        if i >= 0:
+            self.cmb_replay.setCurrentIndex(i)
+
+    def _on_open_replay(self):
+        path = self.cmb_replay.currentData()
+        if not path:
+            return
+        try:
+            data = ReplayData(path, self.replay_cfg)
+        except (OSError, ValueError) as e:
+            QtWidgets.QMessageBox.warning(self.win, "Replay", str(e))
+            return
+        self.replay = data
+        self._replay_error = None
+        self._replay_shown = False
+        self.btn_replay.setEnabled(False)
+        threading.Thread(target=self._load_replay, args=(data,), daemon=True).start()
+
+    def _load_replay(self, data):
+        try:
+            data.load()
+        except Exception as e:
+            self._replay_error = e
+
+    def _poll_replay(self):
+        data = self.replay
+        if data is None or self._replay_shown:
+            return
+        if self._replay_error is not None:
+            self.replay = None
+            self.btn_replay.setEnabled(True)
+            self.lbl_replay.setText(f"Cannot open run: {self._replay_error}")
+            return
+        if not data.ready:
+            self.lbl_replay.setText(f"Indexing {os.path.basename(data.path)}: {data.progress:.0%}")
+            return
+
+        self._replay_shown = True
+        self.btn_replay.setEnabled(True)
+        for curve in self.replay_curves.values():
+            self.plot_replay.removeItem(curve)
+        self.replay_legend.clear()
+        self.replay_curves = {}
+        for i, name in enumerate(data.signals):
+            if name == "cmd_v":
+                pen = pg.mkPen(width=2)
+            elif name in ("meas_g", "meas_v"):
+                pen = pg.mkPen(style=QtCore.Qt.DashLine, width=2)
+            else:
+                pen = pg.mkPen(pg.intColor(i, hues=len(data.signals) + 2), width=1)
+            curve = self.plot_replay.plot(pen=pen)
+            self.replay_curves[name] = curve
+            self.replay_legend.addItem(curve, name)
+
+        duration = max(data.duration, 1e-3)
+        min_range = 10.0 / data.sample_hz if data.sample_hz else 1e-3
+        self.plot_replay.setLimits(xMin=0.0, xMax=duration, minXRange=min_range)
+        self.plot_replay.setXRange(0.0, duration, padding=0)
+        self._redraw_replay()
+
+    def _redraw_replay(self):
+        data = self.replay
+        if data is None or not self._replay_shown:
+            return
+        vb = self.plot_replay.getViewBox()
+        x0, x1 = vb.viewRange()[0]
+        x, ys = data.view(x0, x1, int(vb.width()) or 800)
+        for name, curve in self.replay_curves.items():
+            curve.setData(x, ys[name])
+        self.lbl_replay.setText(
+            f"{os.path.basename(data.path)}: {data.rows:,} rows, {data.duration:.1f} s "
+            f"(showing {x1 - x0:.3g} s, {len(x)} points)")
+
+    def _srs_reference(self):
+        try:
+            return parse_asd(self.edit_srs_ref.text())
+        except ValueError as e:
+            raise ValueError(f"SRS reference: {e}")
+
+    def _redraw_srs(self):
+        """
+        Draw the last SRS against the reference and its tolerance band, and
+        re-check it (the reference may have been edited).
+        """
+        res = self._srs_result
+        if res is None:
+            return
+        self.curve_srs.setData(res.freqs, np.maximum(res.maximax, 1e-6))
+        self.curve_srs_pos.setData(res.freqs, np.maximum(res.pos, 1e-6))
+        self.curve_srs_neg.setData(res.freqs, np.maximum(-res.neg, 1e-6))
+        try:
+            ref = self._srs_reference()
+        except ValueError:
+            self._srs_check = None
+            for curve in (self.curve_srs_ref, self.curve_srs_lo, self.curve_srs_hi):
+                curve.setData([], [])
+            return
+        lo, hi = tolerance_band(res.freqs, ref, self.srs_cfg.TOLERANCE_DB)
+        ok = ~np.isnan(lo)
+        self.curve_srs_ref.setData(res.freqs[ok], np.sqrt(lo * hi)[ok])
+        self.curve_srs_lo.setData(res.freqs[ok], lo[ok])
+        self.curve_srs_hi.setData(res.freqs[ok], hi[ok])
+        self._srs_check = check_tolerance(res, ref, self.srs_cfg.TOLERANCE_DB)
+
+    def _srs_text(self):
+        res, check = self._srs_result, self._srs_check
+        text = f"SRS: peak {res.peak_g:.2f} g in {res.compute_s * 1e3:.0f} ms"
+        if check and check["passed"] is not None:
+            text += (f", {'PASS' if check['passed'] else 'FAIL'} "
+                     f"(worst {check['worst_db']:+.1f} dB at {check['worst_hz']:.0f} Hz)")
+        return text
+
+    def _arm_shock_capture(self):
+        """
+        Watch the drive for the pulse of a Shock generator about to start.
+        The trigger is half the pulse height, or of the headroom to the
+        DAC rail if the pulse will clip.
+        """
+        p = self.output_params
+        level = self.cal.DAC_OFFSET + self.cal.DAC_SCALE * p["dc"]
+        height = self.cal.DAC_SCALE * p["shock_peak"]
+        room = 5.0 - level if height > 0 else level
+        self._srs_result = None
+        self._srs_check = None
+        self.shock_capture.arm(level, 0.5 * min(abs(height), max(room, 0.0)))
+
+    def _poll_shock(self):
+        record = self.shock_capture.poll()
+        if record is not None and len(record):
+            self.srs.submit(record)
+        res = self.srs.result()
+        if res is not None:
+            self._srs_result = res
+            self._redraw_srs()
+
+    def _redraw_spectrum(self):
+        if self.tabs.currentWidget() is not self.spec_view:
+            return
+        res = self.spectrum.result
+        if res is None or res is self._spec_drawn:
+            return
+        self._spec_drawn = res
+
+        band = (res.freqs > 0) & (res.freqs <= self.rt.SPECTRUM_FMAX_HZ)
+        f = res.freqs[band]
+        self.curve_psd.setData(f, np.maximum(res.psd[band], 1e-12))
+        self.curve_h1.setData(f, np.maximum(res.h1_mag[band], 1e-6))
+        self.curve_phase.setData(f, res.h1_phase_deg[band])
+        self.curve_coh.setData(f, res.coherence[band])
+
     def _collect_output_params(self):
         return {
             "manual": self.spin_manual.value(),
@@ -418,15 +741,28 @@ class VTCApp:
             "shock_t0": self.spin_t0.value(),
             "shock_peak": self.spin_peak.value(),
             "shock_tau": self.spin_tau.value(),
+            "asd": self.edit_asd.text(),
+            "closed_loop": self.chk_closed.isChecked(),
+            "target_g": self.spin_target.value(),
+            "res_peak": self.spin_res_peak.value(),
+            "profile": self.profile_file or "",
+            "replication": self.replication_job or "",
         }
 
-    def _refresh_output_settings(self):
-        self.output_params = self._collect_output_params()
-        self.output_worker.update_settings(
-            mode=self.cmb_mode.currentText(),
-            params=self.output_params,
-            cal=self.cal,
-        )
+    def _refresh_output_settings(self, *_):
+        mode = self.cmb_mode.currentText()
+        params = self._collect_output_params()
+        if (mode, params) == self._published:
+            return
+        new_mode = self._published is None or self._published[0] != mode
+        self._published = (mode, params)
+        self.output_params = params
+        self.output_worker.update_settings(mode=mode, params=params, cal=self.cal)
+        if mode == "Shock":
+            self.srs.start()
+            if self.running and new_mode:
+                # Switching to Shock starts a new generator, and with it a pulse
+                self._arm_shock_capture()
 
     def _on_arm(self):
         status = self.safety.arm()
@@ -439,6 +775,7 @@ class VTCApp:
     def _on_mute(self):
         self.output_worker.stop()
         self.running = False
+        self._close_log()
         self.safety.mute()
         self._set_status("MUTED")
         self._update_status_labels()
@@ -456,16 +793,184 @@ class VTCApp:
             self._update_status_labels()
             return
 
+        if self.cmb_mode.currentText() == "Profile" and self.profile_file is None:
+            QtWidgets.QMessageBox.warning(self.win, "Profile", "Load a test profile first.")
+            return
+        if self.cmb_mode.currentText() == "Replication" and self.replication_job is None:
+            QtWidgets.QMessageBox.warning(self.win, "Replication", "Load a recording first.")
+            return
+        if self.cmb_mode.currentText() == "Random Control":
+            try:
+                parse_asd(self.edit_asd.text())
+            except ValueError as e:
+                QtWidgets.QMessageBox.warning(self.win, "ASD profile", str(e))
+                return
+        if self.cmb_mode.currentText() == "Shock":
+            try:
+                self._srs_reference()
+            except ValueError as e:
+                QtWidgets.QMessageBox.warning(self.win, "SRS reference", str(e))
+                return
+
         self._refresh_output_settings()
         self.t0 = time.perf_counter()
+        self.plot_buf.clear()
+        self.spectrum.reset()
+        self._ai_sub.seek()
         self.running = True
+        if self.cmb_mode.currentText() == "Shock":
+            self._arm_shock_capture()
+        self._open_log()
         self.output_worker.start()
         self._set_status("RUNNING")
         self._update_status_labels()
 
+    def _on_load_profile(self):
+        path, _ = QtWidgets.QFileDialog.getOpenFileName(
+            self.win, "Load test profile", "", "Profiles (*.yaml *.yml *.json)"
+        )
+        if not path:
+            return
+        QtWidgets.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+        try:
+            profile = load_profile(path)
+            self.profile_file = compile_profile(
+                profile, self.sample_hz, self.cal, self.rt.PROFILE_CACHE,
+                ao_limits=getattr(self.dac, "ao_limits", (0.0, 5.0)),
+            )
+        except (OSError, ValueError) as e:
+            QtWidgets.QMessageBox.warning(self.win, "Profile", str(e))
+            return
+        finally:
+            QtWidgets.QApplication.restoreOverrideCursor()
+        total = sum(step["duration"] for step in profile["steps"])
+        name = profile["name"] or os.path.basename(path)
+        self.lbl_profile.setText(f"Profile: {name} ({len(profile['steps'])} steps, {total:.0f} s)")
+        self.cmb_mode.setCurrentText("Profile")
+        self._refresh_output_settings()
+
+    def _on_load_recording(self):
+        path, _ = QtWidgets.QFileDialog.getOpenFileName(
+            self.win, "Load field recording", "", "Recordings (*.wav *.csv *.npy)"
+        )
+        if not path:
+            return
+        rate = None
+        while True:
+            QtWidgets.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+            try:
+                job = prepare_replication(path, self.sample_hz, self.replication_cfg, source_hz=rate)
+                break
+            except MissingRate as e:
+                error = e
+            except (OSError, ValueError) as e:
+                QtWidgets.QMessageBox.warning(self.win, "Replication", str(e))
+                return
+            finally:
+                QtWidgets.QApplication.restoreOverrideCursor()
+            rate, ok = QtWidgets.QInputDialog.getDouble(
+                self.win, "Replication", f"{error}\n\nSample rate (Hz):", 1000.0, 1.0, 1e6, 1)
+            if not ok:
+                return
+        self.replication_job = job
+        meta = ReplicationJob(job, self.replication_cfg).meta
+        self.lbl_recording.setText(
+            f"Recording: {os.path.basename(path)} ({meta['samples'] / meta['sample_hz']:.0f} s, "
+            f"{meta['ref_rms_g']:.3f} g RMS, {len(meta['passes'])} earlier passes)")
+        self.cmb_mode.setCurrentText("Replication")
+        self._refresh_output_settings()
+
+    def _open_log(self):
+        self._close_log()
+        self.logger = BinaryLogger(
+            self.rt.LOG_PATH,
+            metadata={
+                "sample_hz": self.acq.actual_hz,
+                "mode": self.cmb_mode.currentText(),
+                "params": self.output_params,
+                "calibration": asdict(self.cal),
+                "ai_channels": list(self.rt.AI_CHANNELS),
+                "control_strategy": self.rt.CONTROL_STRATEGY,
+            },
+            channels=self.acq.channels,
+        )
+        self.last_log_path = self.logger.path
+        self._res_peaks = None
+        self._res_track = []
+
+    def _close_log(self):
+        if self.logger is None:
+            return
+        # Record whether the drive was actually delivered on time
+        error = self.output_worker.error
+        self.logger.update_metadata(
+            output_timing=self.output_worker.timing.summary(),
+            output_underruns=self.output_worker.underruns,
+            output_error=None if error is None else repr(error),
+            abort=self.output_worker.abort,
+            rt_profile=list(self.rt_profile.notes) if self.rt_profile.enabled else None,
+        )
+        if self._res_peaks is not None:
+            self.logger.update_metadata(resonance_peaks=self._res_peaks)
+        report = self.output_worker.control_report()
+        if report and "replication" in report:
+            self.logger.update_metadata(replication=report)
+        if self._res_track:
+            self._write_resonance_csv(self._sidecar_path(self.logger.path, "_resonance.csv"))
+        if self._srs_result is not None:
+            self.logger.update_metadata(srs={
+                "q": self._srs_result.q,
+                "peak_g": self._srs_result.peak_g,
+                "reference": self.edit_srs_ref.text(),
+                "tolerance_db": self.srs_cfg.TOLERANCE_DB,
+                **(self._srs_check or {}),
+            })
+            self._write_srs_csv(self._sidecar_path(self.logger.path, "_srs.csv"))
+        try:
+            self.logger.close()
+        except Exception:
+            pass
+        self.logger = None
+
+    @staticmethod
+    def _sidecar_path(log_path, suffix):
+        return os.path.splitext(log_path)[0] + suffix
+
+    def _write_resonance_csv(self, path):
+        """
+        Tracked resonance frequency and Q over the run.
+        """
+        with open(path, "w", newline="") as f:
+            f.write("t_s,freq_hz,q,gain_g_per_v,phase_deg\n")
+            np.savetxt(f, np.array(self._res_track), fmt="%.6f", delimiter=",")
+
+    def _write_srs_csv(self, path):
+        res = self._srs_result
+        try:
+            lo, hi = tolerance_band(res.freqs, self._srs_reference(), self.srs_cfg.TOLERANCE_DB)
+        except ValueError:
+            lo = hi = np.full(len(res.freqs), np.nan)
+        with open(path, "w", newline="") as f:
+            f.write("freq_hz,pos_g,neg_g,maximax_g,lower_g,upper_g\n")
+            np.savetxt(f, np.column_stack([res.freqs, res.pos, res.neg, res.maximax, lo, hi]),
+                       fmt="%.6g", delimiter=",")
+
+    def _record_resonance(self):
+        report = self.output_worker.control_report()
+        if not report or "peaks" not in report:
+            return
+        if report["peaks"]:
+            self._res_peaks = report["peaks"]
+        track = report["track"]
+        if track is not None:
+            t = track[0] - self.t0
+            if not self._res_track or t > self._res_track[-1][0]:
+                self._res_track.append((t,) + tuple(track[1:]))
+
     def _on_stop(self):
         self.output_worker.stop()
         self.running = False
+        self._close_log()
         try:
             self.dac.write(0.0)
         except Exception:
@@ -478,6 +983,12 @@ class VTCApp:
         self._update_status_labels()
 
     def _on_export(self):
+        # While an export runs, the same button cancels it
+        if self.export is not None and self.export.running:
+            self.export.cancel()
+            self.btn_export.setEnabled(False)
+            return
+
         mounts = list_usb_mounts()
         if not mounts:
             QtWidgets.QMessageBox.warning(
@@ -487,35 +998,130 @@ class VTCApp:
             )
             return
 
-        item, ok = QtWidgets.QInputDialog.getItem(
-            self.win, "Select USB mount", "Mount point:", mounts, 0, False
-        )
-        if not ok or not item:
+        # The run being logged right now is still open, so it is not offered
+        current = self.logger.path if self.logger is not None else None
+        runs = [p for p in list_runs(self.rt.LOG_PATH) if p != current]
+        if not runs:
+            QtWidgets.QMessageBox.warning(self.win, "Export", "No run has been logged yet.")
             return
 
-        dest = item
-
-        png_path = os.path.splitext(self.logger.path)[0] + ".png"
-        pixmap = self.plot.grab()
-        pixmap.save(png_path)
-
-        exported = export_files(dest, [self.logger.path, png_path])
+        choice = self._export_dialog(mounts, runs)
+        if choice is None:
+            return
+        dest, selected, compress = choice
+
+        files = []
+        for log_path in selected:
+            if log_path == self.last_log_path:
+                self.plot.grab().save(os.path.splitext(log_path)[0] + ".png")
+            files.extend(run_files(log_path))
+
+        self.export = ExportWorker(dest, files, compress=compress, csv=self.rt.EXPORT_CSV,
+                                   chunk_bytes=int(self.rt.EXPORT_CHUNK_MB) << 20)
+        self.export.start()
+        self.btn_export.setText("Cancel export")
+        self.export_bar.setValue(0)
+        self.export_bar.setFormat("Preparing")
+        self.export_bar.show()
+
+    def _export_dialog(self, mounts, runs):
+        """
+        Pick the USB mount, the runs (last run preselected) and compression.
+        Returns (mount, [log paths], compress) or None.
+        """
+        dlg = QtWidgets.QDialog(self.win)
+        dlg.setWindowTitle("Export to USB")
+        form = QtWidgets.QVBoxLayout(dlg)
+
+        form.addWidget(QtWidgets.QLabel("Mount point:"))
+        cmb_mount = QtWidgets.QComboBox()
+        cmb_mount.addItems(mounts)
+        cmb_mount.setMinimumHeight(40)
+        form.addWidget(cmb_mount)
+
+        form.addWidget(QtWidgets.QLabel("Runs:"))
+        lst = QtWidgets.QListWidget()
+        lst.setSelectionMode(QtWidgets.QAbstractItemView.MultiSelection)
+        for path in runs:
+            mb = os.path.getsize(path) / 1e6
+            item = QtWidgets.QListWidgetItem(f"{os.path.basename(path)}   {mb:.1f} MB")
+            item.setData(QtCore.Qt.UserRole, path)
+            lst.addItem(item)
+            if path == self.last_log_path:
+                item.setSelected(True)
+        if not lst.selectedItems():
+            lst.item(0).setSelected(True)
+        form.addWidget(lst)
+
+        chk_gzip = QtWidgets.QCheckBox("Compress (gzip)")
+        chk_gzip.setChecked(self.rt.EXPORT_COMPRESS)
+        form.addWidget(chk_gzip)
+
+        buttons = QtWidgets.QDialogButtonBox(
+            QtWidgets.QDialogButtonBox.Ok | QtWidgets.QDialogButtonBox.Cancel)
+        buttons.accepted.connect(dlg.accept)
+        buttons.rejected.connect(dlg.reject)
+        form.addWidget(buttons)
+        dlg.resize(520, 480)
+
+        if dlg.exec_() != QtWidgets.QDialog.Accepted:
+            return None
+        selected = [it.data(QtCore.Qt.UserRole) for it in lst.selectedItems()]
+        if not selected:
+            return None
+        return cmb_mount.currentText(), selected, chk_gzip.isChecked()
+
+    def _poll_export(self):
+        job = self.export
+        if job is None:
+            return
+        if job.running:
+            self.export_bar.setValue(int(1000 * job.fraction()))
+            self.export_bar.setFormat(f"{job.status}  %p%")
+            return
 
-        QtWidgets.QMessageBox.information(
-            self.win, "Export", f"Exported {len(exported)} file(s) to {dest}"
-        )
+        self.export = None
+        self.export_bar.hide()
+        self.btn_export.setText("Export to USB")
+        self.btn_export.setEnabled(True)
+        if job.state == "FAILED":
+            QtWidgets.QMessageBox.warning(self.win, "Export", job.status)
+        else:
+            QtWidgets.QMessageBox.information(self.win, "Export", job.status)
 
     def _update(self):
-        self._refresh_output_settings()
-
+        if self.engine is not None:
+            self.engine.poll()
+        self.rt_profile.collect()
+        self._poll_export()
+        self._poll_replay()
+
+        if self.running and self.output_worker.fault is not None:
+            # Abort limit tripped in the output engine; it ramps the drive down itself
+            self.safety.trip(self.output_worker.fault)
         fault = self.safety.is_fault()
-        self.lbl_fault.setText(f"Fault: {'YES' if fault else 'NO'}")
+        control = self.output_worker.control_status() if self.running else None
+        if control == "ABORT":
+            fault = True
+        if self.running and self.output_worker.error is not None:
+            fault = True
+            self.lbl_timing.setText(f"Output stopped: {self.output_worker.error!r}")
+        self._show_fault(fault)
+        self._publish_telemetry(fault, control)
+
+        if control == "DONE":
+            # Profile finished
+            self._on_stop()
+            return
 
         if fault:
-            self.output_worker.stop()
-            self.running = False
-            self._set_status("FAULT")
-            self._update_status_labels()
+            # A tripped fault stays latched until re-armed; act on it once
+            if self.running or self._status != "FAULT":
+                self.output_worker.stop()
+                self.running = False
+                self._close_log()
+                self._set_status("FAULT")
+                self._update_status_labels()
             return
 
         if not self.running:
@@ -523,6 +1129,7 @@ class VTCApp:
                 self.dac.write(0.0)
             except Exception:
                 pass
+            self._ai_sub.seek()
             return
 
         if self.t0 is None:
@@ -531,32 +1138,111 @@ class VTCApp:
         t = time.perf_counter() - self.t0
         self.last_t = t
 
-        out_v = self.output_worker.get_last_command()
-
-        meas_v = 0.0
-        try:
-            raw_v = self.dac.read()
-            meas_v = raw_v * self.cal.ADC_SCALE
-        except Exception:
-            pass
-
-        meas_g = meas_v * self.cal.G_PER_V
-
-        self.xdata.append(t)
-        self.ycmd.append(out_v)
-        self.ymeas.append(meas_v)
-
-        if len(self.xdata) > self.max_points:
-            self.xdata = self.xdata[-self.max_points:]
-            self.ycmd = self.ycmd[-self.max_points:]
-            self.ymeas = self.ymeas[-self.max_points:]
-
-        self.curve_cmd.setData(self.xdata, self.ycmd)
-        self.curve_meas.setData(self.xdata, self.ymeas)
+        t_meas, g_meas, g_chans = self._read_feedback()
+        out_v = self._command_at(t_meas)
+        meas_g = float(g_meas[-1]) if len(g_meas) else self.last_meas
+        self.last_meas = meas_g
+
+        self.plot_buf.push(t_meas - self.t0, out_v, g_meas)
+        self._redraw_plot()
+        self._redraw_spectrum()
+
+        if g_chans is not None and len(g_chans):
+            self.last_chans = g_chans[-1]
+
+        text = f"Meas: {meas_g:.3f} g"
+        if self.last_chans is not None:
+            text += "   ch: " + " / ".join(f"{g:.3f}" for g in self.last_chans)
+            if self.acq.control_channel is not None:
+                text += f" (control ch {self.acq.control_channel})"
+        if self.acq.running:
+            text += f"   AI overruns: {self.acq.overruns}"
+        else:
+            text += "   AI scan stopped"
+        if control is not None:
+            text += f"   Control: {control}"
+        if self._srs_result is not None:
+            text += "   " + self._srs_text()
+        self.lbl_meas.setText(text)
+        self.lbl_timing.setText(
+            self.output_worker.timing.status_text() + "   " + self.rt_profile.status_text()
+        )
 
-        self.lbl_meas.setText(f"Meas: {meas_v:.3f} V, {meas_g:.3f} g")
+        if self.logger is not None:
+            self.logger.write_block(t_meas - self.t0, out_v, g_meas, g_chans)
+        self._record_resonance()
+        self._poll_shock()
 
-        self.logger.write(t, out_v, meas_v)
+    def _show_fault(self, fault):
+        cause = self.safety.fault_cause
+        if cause is None:
+            self.lbl_fault.setText(f"Fault: {'YES' if fault else 'NO'}")
+            return
+        abort = self.output_worker.abort
+        if abort is not None and abort.get("cause") == cause:
+            cause += f" (0 V in {abort['zero_ms']:.0f} ms)"
+        self.lbl_fault.setText(f"Fault: {cause}")
+
+    def _publish_telemetry(self, fault, control):
+        now = time.perf_counter()
+        if self.telemetry is None or now - self._telemetry_t < self.telemetry_cfg.STATUS_PERIOD_S:
+            return
+        self._telemetry_t = now
+        timing = self.output_worker.timing.summary()
+        self.telemetry.publish_status({
+            "status": self._status,
+            "armed": bool(getattr(self.safety, "armed", False)),
+            "fault": bool(fault),
+            "fault_cause": self.safety.fault_cause,
+            "running": self.running,
+            "mode": self.cmb_mode.currentText(),
+            "control": control,
+            "log": os.path.basename(self.logger.path) if self.logger is not None else None,
+            "ai_overruns": self.acq.overruns,
+            "output_hz": timing.get("achieved_hz"),
+            "output_overruns": timing.get("overruns"),
+        })
+
+    def _on_window_changed(self, index):
+        self.plot_buf.set_view(window_s=self.rt.PLOT_WINDOWS_S[index])
+        self._redraw_plot()
+
+    def _redraw_plot(self):
+        width = self.plot.getPlotItem().vb.width()
+        if int(width) != self._plot_width and width > 0:
+            self._plot_width = int(width)
+            self.plot_buf.set_view(width_px=width)
+
+        x, (ycmd, ymeas) = self.plot_buf.curves()
+        self.curve_cmd.setData(x, ycmd, connect="finite")
+        self.curve_meas.setData(x, ymeas, connect="finite")
+        if len(x):
+            window = self.rt.PLOT_WINDOWS_S[self.cmb_window.currentIndex()]
+            self.plot.setXRange(x[-1] - window, x[-1], padding=0)
+
+    def _command_at(self, t):
+        """
+        DAC volts output at perf_counter() times `t` less the AO -> AI
+        delay, i.e. the command that produced the samples measured at `t`.
+        """
+        return self.output_worker.cmd_ring.sample_at(np.asarray(t) - self.cal.DELAY_S)
+
+    def _read_feedback(self):
+        """
+        Return (t, meas_g, channels_g) for the feedback samples since the
+        last call, with t in perf_counter() seconds: the control signal and,
+        with several AI channels, the matching (n, channels) rows (else None).
+        The arrays are views into the sample rings.
+        """
+        block, _ = self._ai_sub.poll()
+        chans = None
+        if self.acq.channels > 1:
+            chans, _ = self.acq.channel_ring.read(block.start, self._ai_sub.cursor)
+            chans = chans.v
+            if len(chans) != len(block.v):
+                # Channel history lost (ring overrun): log NaN rather than misalign
+                chans = np.full((len(block.v), self.acq.channels), np.nan)
+        return block.t, block.v, chans
 
     def _set_status(self, status: str):
         self._status = status
@@ -574,17 +1260,30 @@ class VTCApp:
             except Exception:
                 pass
             try:
-                self.dac.write(0.0)
+                self.spectrum.stop()
             except Exception:
                 pass
             try:
-                self.dac.close()
+                self.srs.stop()
+            except Exception:
+                pass
+            if self.export is not None:
+                self.export.cancel()
+            if self.telemetry is not None:
+                self.telemetry.stop()
+            try:
+                self.acq.stop()
             except Exception:
                 pass
             try:
-                self.logger.close()
+                self.dac.write(0.0)
+            except Exception:
+                pass
+            try:
+                self.dac.close()
             except Exception:
                 pass
+            self._close_log()
 
 
 if __name__ == "__main__":
@@ -1,6 +1,10 @@
 # vtc/waveform.py
 import numpy as np
 
+from random_control import RandomControlGen
+from resonance import ResonanceSearchGen
+from sine_control import SineControlGen
+
 def manual(value_v: float):
     return float(value_v)
 
@@ -25,3 +29,267 @@ def shock(t, t0=1.0, peak=4.5, dc=2.5, tau=0.02):
     if t < t0: 
         return float(dc)
     return float(dc + peak*np.exp(-(t - t0)/tau))
+
+
+# --- Block API ---
+#
+# Generator objects render N samples per call with one vectorized numpy
+# expression. Each keeps its own sample counter and phase accumulator, so
+# settings can change between blocks without a phase jump. Closed-loop
+# generators also have observe(meas_g), fed with the measured response.
+# Level-type settings (amplitude, DC, frequency) are Ramps, so a new value
+# is approached linearly over ramp_samples instead of stepping.
+
+TWO_PI = 2.0 * np.pi
+
+
+class Ramp:
+    """
+    A setting that moves linearly to each new target, one step per sample.
+    track(n) returns the value at each of the next `n` samples: a plain
+    float while it is steady, an array while it is ramping.
+    """
+
+    def __init__(self, value):
+        self.value = float(value)
+        self.target = self.value
+        self.step = 0.0
+
+    def set(self, target, samples):
+        target = float(target)
+        if target == self.target:
+            return
+        self.target = target
+        if samples <= 0:
+            self.hold(target)
+        else:
+            self.step = (target - self.value) / samples
+
+    def hold(self, value):
+        self.value = self.target = float(value)
+        self.step = 0.0
+
+    def track(self, n):
+        if self.step == 0.0:
+            return self.value
+        v = self.value + self.step * np.arange(1, n + 1)
+        if self.step > 0.0:
+            np.minimum(v, self.target, out=v)
+        else:
+            np.maximum(v, self.target, out=v)
+        self.value = float(v[-1])
+        if self.value == self.target:
+            self.step = 0.0
+        return v
+
+
+class BlockGenerator:
+    """
+    Base class: render(n) returns the next `n` command samples (volts) as a
+    float array; update(params) applies new settings from the next block.
+    Settings registered with _set() ramp over `ramp_samples` (0 = step).
+    """
+
+    def __init__(self, sample_hz, params):
+        self.sample_hz = float(sample_hz)
+        self.dt = 1.0 / self.sample_hz
+        self.n = 0          # samples rendered so far
+        self.phase = 0.0    # radians, carried across blocks
+        self.ramp_samples = 0
+        self.ramps = {}
+        self.update(params)
+
+    def update(self, p):
+        pass
+
+    def _set(self, name, value):
+        ramp = self.ramps.get(name)
+        if ramp is None:
+            self.ramps[name] = Ramp(value)
+        else:
+            ramp.set(value, self.ramp_samples)
+
+    def _track(self, name, n):
+        return self.ramps[name].track(n)
+
+    def level(self, name):
+        """
+        Current (not target) value of a ramped setting.
+        """
+        return self.ramps[name].value
+
+    def hold(self, name, value):
+        """
+        Set a ramped setting immediately, e.g. from a control loop.
+        """
+        self.ramps[name].hold(value)
+
+    def _times(self, n):
+        return (self.n + np.arange(n)) * self.dt
+
+    def render(self, n):
+        raise NotImplementedError
+
+
+class ManualGen(BlockGenerator):
+    key = "manual"
+
+    def update(self, p):
+        self._set("level", p[self.key])
+
+    def render(self, n):
+        self.n += n
+        return np.broadcast_to(self._track("level", n), (n,)).copy()
+
+
+class DCGen(ManualGen):
+    key = "dc"
+
+
+class SineGen(BlockGenerator):
+    def update(self, p):
+        self._set("amp", p["amp"])
+        self._set("freq", p["freq"])
+        self._set("dc", p["dc"])
+
+    def current_freq(self):
+        return self.level("freq")
+
+    def _advance_phase(self, n):
+        f = self._track("freq", n)
+        if np.ndim(f):
+            # Ramping: integrate the per-sample frequency
+            w = TWO_PI * self.dt * f
+            ph = self.phase + np.cumsum(w) - w
+            self.phase = (self.phase + w.sum()) % TWO_PI
+        else:
+            w = TWO_PI * f * self.dt
+            ph = self.phase + w * np.arange(n)
+            self.phase = (self.phase + w * n) % TWO_PI
+        self.n += n
+        return ph
+
+    def render(self, n):
+        ph = self._advance_phase(n)
+        return self._track("dc", n) + self._track("amp", n) * np.sin(ph)
+
+
+class SineSweepGen(SineGen):
+    """
+    Linear sweep from f_start to f_end over `dur` seconds, then holds f_end.
+    The phase is the running integral of the instantaneous frequency.
+    """
+
+    def update(self, p):
+        self._set("amp", p["amp"])
+        self._set("dc", p["dc"])
+        self.f_start = float(p["f_start"])
+        self.f_end = float(p["f_end"])
+        self.dur = max(float(p["dur"]), 1e-6)
+
+    def current_freq(self):
+        frac = min(self.n * self.dt, self.dur) / self.dur
+        return self.f_start + (self.f_end - self.f_start) * frac
+
+    def render(self, n):
+        k = (self.f_end - self.f_start) / self.dur
+        f = self.f_start + k * np.clip(self._times(n), 0.0, self.dur)
+        w = TWO_PI * self.dt * f
+        ph = self.phase + np.cumsum(w) - w
+        self.phase = (self.phase + w.sum()) % TWO_PI
+        self.n += n
+        return self._track("dc", n) + self._track("amp", n) * np.sin(ph)
+
+
+class RandomNoiseGen(BlockGenerator):
+    def __init__(self, sample_hz, params, seed=None):
+        self.rng = np.random.default_rng(seed)
+        super().__init__(sample_hz, params)
+
+    def update(self, p):
+        self._set("dc", p["dc"])
+        self._set("std", p["noise"])
+
+    def render(self, n):
+        self.n += n
+        return self._track("dc", n) + self._track("std", n) * self.rng.standard_normal(n)
+
+
+class SineOnRandomGen(SineGen):
+    def __init__(self, sample_hz, params, seed=None):
+        self.rng = np.random.default_rng(seed)
+        super().__init__(sample_hz, params)
+
+    def update(self, p):
+        super().update(p)
+        self._set("std", p["noise"])
+
+    def render(self, n):
+        sine_part = super().render(n)
+        return sine_part + self._track("std", n) * self.rng.standard_normal(n)
+
+
+class ShockGen(BlockGenerator):
+    def update(self, p):
+        self.t0 = float(p["shock_t0"])
+        self.peak = float(p["shock_peak"])
+        self._set("dc", p["dc"])
+        self.tau = max(float(p["shock_tau"]), 1e-6)
+
+    def render(self, n):
+        t = self._times(n)
+        self.n += n
+        pulse = self.peak * np.exp(-np.maximum(t - self.t0, 0.0) / self.tau)
+        return self._track("dc", n) + np.where(t < self.t0, 0.0, pulse)
+
+
+GENERATORS = {
+    "Manual": ManualGen,
+    "Sine": SineGen,
+    "Sine Sweep": SineSweepGen,
+    "Random Noise": RandomNoiseGen,
+    "Sine on Random": SineOnRandomGen,
+    "Resonance Dwell": SineGen,
+    "Shock": ShockGen,
+    "Random Control": RandomControlGen,
+    "Resonance Search": ResonanceSearchGen,
+}
+
+
+# Modes that can run under closed-loop sine control
+SINE_CONTROL_MODES = ("Sine", "Sine Sweep", "Resonance Dwell")
+
+
+def generator_key(mode, params):
+    """
+    Identifies which generator make_generator() would build; a new
+    generator is only needed when this changes.
+    """
+    if mode == "Profile":
+        return mode, params.get("profile")
+    if mode == "Replication":
+        return mode, params.get("replication")
+    closed = bool(params.get("closed_loop")) and mode in SINE_CONTROL_MODES
+    return mode, closed
+
+
+def make_generator(mode, params, sample_hz, ramp_s=0.0):
+    """
+    Build the block generator for a UI mode name. Unknown modes hold DC.
+    Sine modes with params["closed_loop"] set are wrapped in SineControlGen.
+    Later changes to ramped settings take `ramp_s` seconds. "Profile"
+    streams the compiled profile named by params["profile"], "Replication"
+    the drive of the replication job in params["replication"].
+    """
+    if mode == "Profile":
+        from sequencer import ProfilePlayer
+        return ProfilePlayer(sample_hz, params)
+    if mode == "Replication":
+        from replication import ReplicationGen
+        return ReplicationGen(sample_hz, params)
+    gen = GENERATORS.get(mode, DCGen)(sample_hz, params)
+    if isinstance(gen, BlockGenerator):
+        gen.ramp_samples = int(round(max(ramp_s, 0.0) * sample_hz))
+    if generator_key(mode, params)[1]:
+        return SineControlGen(sample_hz, params, gen)
+    return gen